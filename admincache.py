@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from telegram.error import TelegramError
+from tracing import span
+
+
+# Member statuses that have permissions over a chat
+ADMIN_STATUSES = ("creator", "administrator")
+
+
+# This is a per-chat cache of the chat administrators' user IDs, filled from
+# a single getChatAdministrators call and kept for a limited time (TTL), so
+# permission checks don't need a Telegram round trip each time.
+# It can be shared between handlers running in different threads
+class AdminCache(object):
+    def __init__(self, ttl=600, logger=None):
+        # Time (in s) that a chat's administrators list is considered valid
+        self.ttl = ttl
+        # The logger shared program-wide
+        self.logger = logger
+        # Chat ID -> (fetch timestamp, set of admin user IDs)
+        self._admins = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._admins)
+
+    # Returns the cached set of admin IDs of a chat, or None if it's missing or expired
+    def cached(self, cid):
+        cid = str(cid)
+        with self._lock:
+            entry = self._admins.get(cid)
+        if entry is None:
+            return None
+        timestamp, admins = entry
+        if (time.monotonic() - timestamp) >= self.ttl:
+            return None
+        return admins
+
+    # Fetches the administrators of a chat from Telegram and caches them.
+    # Returns None if the chat's administrators can't be listed (e.g. private chats)
+    def fetch(self, chat):
+        try:
+            members = chat.get_administrators()
+        except TelegramError as e:
+            if self.logger:
+                self.logger.warning("Could not list administrators of chat {}: {}".format(chat.id, e))
+            return None
+        admins = frozenset(m.user.id for m in members if m.status in ADMIN_STATUSES)
+        with self._lock:
+            self._admins[str(chat.id)] = (time.monotonic(), admins)
+        return admins
+
+    # Returns True if the user has permissions over the chat. It's a local lookup
+    # unless the chat's entry is missing or expired
+    def is_admin(self, chat, uid):
+        admins = self.cached(chat.id)
+        if admins is None:
+            with span("get_administrators"):
+                admins = self.fetch(chat)
+        if admins is None:
+            # Fall back to asking for this specific member
+            with span("get_member"):
+                member = chat.get_member(uid)
+            return member.status in ADMIN_STATUSES
+        return uid in admins
+
+    # Drops a chat's entry, so the next check fetches it again
+    def invalidate(self, cid):
+        with self._lock:
+            self._admins.pop(str(cid), None)
+
+    # Drops every entry
+    def clear(self):
+        with self._lock:
+            self._admins.clear()
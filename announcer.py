@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from telegram.error import BadRequest, ChatMigrated, NetworkError, RetryAfter, Unauthorized
+
+
+# This is an announcement job: a text to be sent to a list of chats, with the
+# progress of each one, so it can be checkpointed and resumed after a restart
+class Announcement(object):
+    # Results of sending the announcement to a chat
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    # The bot was blocked, kicked, or the chat doesn't exist anymore
+    BLOCKED = "blocked"
+
+    # Amount of results between checkpoints
+    CHECKPOINT_EVERY = 50
+
+    def __init__(self, text, targets, logger, store=None, results=None):
+        # The announcement's text
+        self.text = text
+        # The chat IDs to send the announcement to, in order
+        self.targets = [str(cid) for cid in targets]
+        # The logger shared program-wide
+        self.logger = logger
+        # Function that stores the job's state, or deletes it when given None
+        self.store = store
+        # Chat ID -> result, for the chats already done
+        self.results = dict(results) if results else {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1}/{2} done>".format(self.__class__.__name__, len(self.results), len(self.targets))
+
+    # Create an Announcement from a checkpointed state
+    def FromState(state, logger, store=None):
+        return Announcement(state["text"], state["targets"], logger, store, state["results"])
+
+    # The job's state, ready to be checkpointed
+    def state(self):
+        with self._lock:
+            return {"text": self.text, "targets": self.targets, "results": dict(self.results)}
+
+    # The chats still waiting for the announcement
+    def pending(self):
+        with self._lock:
+            return [cid for cid in self.targets if cid not in self.results]
+
+    # Counts of each kind of result so far, plus the pending chats
+    def counts(self):
+        with self._lock:
+            counts = {Announcement.DELIVERED: 0, Announcement.FAILED: 0, Announcement.BLOCKED: 0}
+            for result in self.results.values():
+                counts[result] += 1
+        counts["pending"] = len(self.targets) - sum(counts.values())
+        return counts
+
+    def checkpoint(self):
+        if self.store:
+            self.store(self.state())
+
+    # Sends the announcement to all pending chats, through a pool of `workers`
+    # threads of its own that go through the given rate limiter. They spend
+    # most of their time waiting on the limiter and on flood limits, so they
+    # are never taken from a pool meant for other work. Checkpoints every few
+    # results, and deletes the checkpoint once done. Returns the final counts
+    def run(self, bot, limiter, workers=8, retries=3):
+        pending = self.pending()
+        self.logger.info("Announcing to {} chats ({} already done)...".format(len(pending), len(self.results)))
+        start = time.perf_counter()
+        self.checkpoint()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="announce") as pool:
+            self.collect(pool, bot, pending, limiter, retries)
+        if self.store:
+            self.store(None)
+        counts = self.counts()
+        self.logger.info("Announcement finished in {:.1f}s: {} delivered, {} failed, {} blocked.".format(
+            time.perf_counter() - start, counts[Announcement.DELIVERED],
+            counts[Announcement.FAILED], counts[Announcement.BLOCKED]))
+        return counts
+
+    # Sends the announcement to the given chats through a thread pool, and
+    # records the results as they come
+    def collect(self, pool, bot, pending, limiter, retries):
+        futures = {pool.submit(self.deliver, bot, cid, limiter, retries): cid for cid in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            cid = futures[future]
+            with self._lock:
+                self.results[cid] = future.result()
+            if i % Announcement.CHECKPOINT_EVERY == 0:
+                self.checkpoint()
+
+    # Sends the announcement to a single chat, retrying when Telegram asks to
+    # wait or the network fails. Returns the result
+    def deliver(self, bot, cid, limiter, retries=3):
+        for attempt in range(retries + 1):
+            limiter.acquire()
+            try:
+                bot.send_message(cid, self.text)
+                return Announcement.DELIVERED
+            except RetryAfter as e:
+                # Flood limit: wait as much as Telegram says
+                time.sleep(e.retry_after)
+            except ChatMigrated as e:
+                # The group became a supergroup with a new ID
+                cid = e.new_chat_id
+            except Unauthorized:
+                return Announcement.BLOCKED
+            except BadRequest as e:
+                if "chat not found" in e.message.lower():
+                    return Announcement.BLOCKED
+                self.logger.warning("Announcement to {} failed: {}".format(cid, e))
+                return Announcement.FAILED
+            except NetworkError:
+                time.sleep(2 ** attempt)
+            except Exception as e:
+                self.logger.error("Announcement to {} caused exception:".format(cid))
+                self.logger.exception(e)
+                return Announcement.FAILED
+        return Announcement.FAILED
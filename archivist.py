@@ -1,14 +1,41 @@
 
+import io
 import os
+import gzip
+import json
+import hashlib
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from reader import Reader
 from generator import Generator
+from metadata import Metadata
+from tracing import span
 
 
 class Archivist(object):
+    # Amount of compressed files that the cold archive is split into
+    COLD_SHARDS = 16
+    # Format tag of the snapshot files
+    SNAPSHOT_FORMAT = "velasco-snapshot/1"
+    # Name of the snapshot's manifest, its first member
+    SNAPSHOT_MANIFEST = "snapshot.json"
+    # Pax header holding the SHA-256 of each file in a snapshot
+    SNAPSHOT_CHECKSUM = "VELASCO.sha256"
+    # Compression level of the snapshots (gzip's default 9 is several times
+    # slower, for a few percent less)
+    SNAPSHOT_COMPRESSION = 6
+    # Maximum time (in s) to wait for a chat that is being restored from a snapshot
+    RESTORE_WAIT = 60
 
     def __init__(self, logger, chatdir=None, chatext=None, admin=0,
                  period_inc=5, save_count=15, min_period=1,
-                 max_period=100000, read_only=False
+                 max_period=100000, read_only=False, order=Generator.ORDER
                  ):
         if chatdir is None or len(chatdir) == 0:
             chatdir = "./"
@@ -22,6 +49,20 @@ class Archivist(object):
         self.min_period = min_period
         self.max_period = max_period
         self.read_only = read_only
+        # The order of the Generators for new and loaded vocabularies
+        self.order = order
+        # Lock for moving chats in and out of the cold archive
+        self.cold_lock = threading.RLock()
+        # Cold archive shard path -> (modification time, chat IDs in it)
+        self.cold_index = {}
+        # Chat ID -> amount of reads and writes going on in its folder, which
+        # is kept out of the cold archive meanwhile (see in_use)
+        self.using = {}
+        # Chat ID -> event set once it's restored, for the chats of an ongoing
+        # snapshot restore that aren't on disk yet
+        self.restoring = {}
+        # Amount of chats restored by the last snapshot restore
+        self.restored = 0
 
     # Formats and returns a chat folder path
     def chat_folder(self, *formatting, **key_format):
@@ -31,29 +72,330 @@ class Archivist(object):
     def chat_file(self, *formatting, **key_format):
         return (self.chatdir + "/chat_{tag}/{file}{ext}").format(*formatting, **key_format)
 
-    # Stores a Reader/Generator file pair
+    # Returns the path of the cold archive shard that holds a chat
+    def cold_file(self, tag):
+        shard = zlib.crc32(tag.encode()) % Archivist.COLD_SHARDS
+        return "{}/cold/shard_{:02d}.zip".format(self.chatdir, shard)
+
+    # Returns the paths of the existing cold archive shards
+    def cold_files(self):
+        folder = self.chatdir + "/cold"
+        if not os.path.isdir(folder):
+            return []
+        return sorted(entry.path for entry in os.scandir(folder)
+                      if entry.name.startswith("shard_") and entry.name.endswith(".zip"))
+
+    # Returns the IDs of the chats in a cold archive shard. They are cached until
+    # the shard is rewritten
+    def cold_tags(self, shard):
+        mtime = os.stat(shard).st_mtime_ns
+        cached = self.cold_index.get(shard)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with zipfile.ZipFile(shard) as archive:
+            tags = [name[:-len("/card.txt")] for name in archive.namelist() if name.endswith("/card.txt")]
+        self.cold_index[shard] = (mtime, tags)
+        return tags
+
+    # Returns the IDs of the chats in the cold archive that don't have a stored
+    # (hot) folder too, which always takes precedence
+    def cold_chats(self):
+        hot = set(self.hot_chats())
+        tags = []
+        for shard in self.cold_files():
+            tags.extend(tag for tag in self.cold_tags(shard) if tag not in hot)
+        return tags
+
+    # Loads a chat's card and vocabulary file dumps from the cold archive.
+    # Returns None if the chat isn't there
+    def load_cold(self, tag):
+        shard = self.cold_file(tag)
+        if not os.path.exists(shard):
+            return None
+        try:
+            with zipfile.ZipFile(shard) as archive:
+                # Decoded like load_card() and load_vocab() do
+                with io.TextIOWrapper(archive.open(tag + "/card.txt")) as file:
+                    card = file.read()
+                try:
+                    vocab = archive.read(tag + "/record" + self.chatext).decode("utf-16")
+                except KeyError:
+                    vocab = None
+            return card, vocab
+        except KeyError:
+            return None
+        except (OSError, zipfile.BadZipFile) as e:
+            self.logger.error("Failed reading cold archive {}.".format(shard))
+            self.logger.exception(e)
+            return None
+
+    # Moves a chat back from the cold archive into its folder. Its entry in the
+    # archive is left behind, shadowed by the folder, until the next freeze
+    def thaw(self, tag):
+        with self.cold_lock:
+            folder = self.chat_folder(tag=tag)
+            if os.path.isdir(folder):
+                return True
+            shard = self.cold_file(tag)
+            if not os.path.exists(shard):
+                return False
+            start = time.perf_counter()
+            # Extracted aside and then moved, so a failure never leaves half a chat
+            tmp = self.chatdir + "/thawing_" + tag
+            try:
+                with zipfile.ZipFile(shard) as archive:
+                    members = [name for name in archive.namelist() if name.startswith(tag + "/")]
+                    if len(members) == 0:
+                        return False
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    os.makedirs(tmp)
+                    # Copied as they are, without decoding them into memory
+                    for name in members:
+                        with archive.open(name) as src, open(os.path.join(tmp, name.split("/", 1)[1]), 'wb') as dst:
+                            shutil.copyfileobj(src, dst)
+                os.replace(tmp, folder)
+            except (OSError, zipfile.BadZipFile) as e:
+                self.logger.error("Failed thawing chat {} from {}.".format(tag, shard))
+                self.logger.exception(e)
+                shutil.rmtree(tmp, ignore_errors=True)
+                return False
+            self.logger.info("Thawed chat {} from the cold archive in {:.3f}s.".format(
+                tag, time.perf_counter() - start))
+            return True
+
+    # Keeps a chat's folder out of the cold archive while it's read or written
+    # inside this context, moving the chat back from the archive first if thaw
+    # is True. Yields whether the chat has a folder
+    @contextmanager
+    def in_use(self, tag, thaw=True):
+        with self.cold_lock:
+            if thaw and not self.read_only and not os.path.isdir(self.chat_folder(tag=tag)):
+                with span("thaw_cold"):
+                    self.thaw(tag)
+            stored = os.path.isdir(self.chat_folder(tag=tag))
+            self.using[tag] = self.using.get(tag, 0) + 1
+        try:
+            yield stored
+        finally:
+            with self.cold_lock:
+                self.using[tag] -= 1
+                if self.using[tag] <= 0:
+                    del self.using[tag]
+
+    # Returns how long ago (in s) a chat's card was written, or None if it has none
+    def idle_time(self, tag, now):
+        try:
+            return now - os.stat(self.chat_file(tag=tag, file="card", ext=".txt")).st_mtime
+        except OSError:
+            return None
+
+    # Moves the chats idle for at least idle_time seconds (by their card's last
+    # write) into the cold archive, except the excluded ones. Each affected shard
+    # is rewritten once, dropping the entries of chats that were thawed since.
+    # The lock is only held for one shard at a time, and the chats read or
+    # written meanwhile (see in_use) are left out. If given a stop function,
+    # the shards left are skipped once it returns True. Returns the amount of
+    # chats frozen
+    def freeze_idle(self, idle_time, exclude=(), stop=None):
+        if self.read_only:
+            return 0
+        start = time.perf_counter()
+        before = self.disk_usage()
+        now = time.time()
+        shards = {}
+        for subdir in os.scandir(self.chatdir):
+            if not subdir.name.startswith("chat_") or not subdir.is_dir():
+                continue
+            tag = subdir.name[5:]
+            if tag in exclude:
+                continue
+            idle = self.idle_time(tag, now)
+            if idle is not None and idle >= idle_time:
+                shards.setdefault(self.cold_file(tag), []).append(tag)
+        if len(shards) == 0:
+            return 0
+
+        os.makedirs(self.chatdir + "/cold", exist_ok=True)
+        frozen = 0
+        for shard, tags in shards.items():
+            if stop is not None and stop():
+                break
+            with self.cold_lock:
+                # Checked again, as they may have been used since the scan
+                now = time.time()
+                tags = [tag for tag in tags if tag not in self.using
+                        and (self.idle_time(tag, now) or 0) >= idle_time]
+                if len(tags) == 0:
+                    continue
+                try:
+                    self.pack(shard, tags)
+                except (OSError, zipfile.BadZipFile) as e:
+                    self.logger.error("Failed freezing chats into {}.".format(shard))
+                    self.logger.exception(e)
+                    continue
+                # Only removed once the shard holding them is in place
+                for tag in tags:
+                    shutil.rmtree(self.chat_folder(tag=tag), ignore_errors=True)
+                frozen += len(tags)
+        after = self.disk_usage()
+        self.logger.info("Froze {} idle chats in {:.2f}s. Disk: {} files, {} bytes -> {} files, {} bytes. "
+                         "Chat scan: {:.3f}s -> {:.3f}s.".format(
+                             frozen, time.perf_counter() - start,
+                             before["files"], before["bytes"], after["files"], after["bytes"],
+                             before["scan_time"], after["scan_time"]))
+        return frozen
+
+    # Rewrites a cold archive shard with the given chats' folders added, keeping
+    # the entries of the other chats unless they have a folder again
+    def pack(self, shard, tags):
+        packing = set(tags)
+        tmp = shard + ".tmp"
+        with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as new:
+            if os.path.exists(shard):
+                with zipfile.ZipFile(shard) as old:
+                    for info in old.infolist():
+                        tag = info.filename.split("/", 1)[0]
+                        if tag in packing or os.path.isdir(self.chat_folder(tag=tag)):
+                            continue
+                        new.writestr(info, old.read(info))
+            for tag in tags:
+                folder = self.chat_folder(tag=tag)
+                for entry in os.scandir(folder):
+                    if entry.is_file():
+                        new.write(entry.path, arcname=tag + "/" + entry.name)
+        os.replace(tmp, shard)
+
+    # Measures the chat logs directory: the amount of files, the bytes they take
+    # on disk, and the time it takes to count the stored chats
+    def disk_usage(self):
+        files = 0
+        size = 0
+        for root, dirs, names in os.walk(self.chatdir):
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files += 1
+                # Allocated blocks where available, so small files count as they weigh
+                size += st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+        start = time.perf_counter()
+        self.chat_count()
+        return {"files": files, "bytes": size, "scan_time": time.perf_counter() - start}
+
+    # Returns the path of the file listing the chats that were in memory
+    def hot_file(self):
+        return self.chatdir + "/hot.txt"
+
+    # Stores the list of chat IDs that were in memory, hottest first
+    def store_hot(self, tags):
+        if self.read_only:
+            return
+        try:
+            file = open(self.hot_file(), 'w')
+            file.write('\n'.join(tags) + '\n')
+            file.close()
+        except OSError as e:
+            self.logger.error("Failed storing the hot chats list.")
+            self.logger.exception(e)
+
+    # Loads the list of chat IDs that were in memory, hottest first
+    def load_hot(self):
+        try:
+            file = open(self.hot_file(), 'r')
+            tags = [line.strip() for line in file]
+            file.close()
+            return [tag for tag in tags if len(tag) > 0]
+        except OSError:
+            return []
+
+    # Returns the path of the file with the checkpoint of an ongoing announcement
+    def announcement_file(self):
+        return self.chatdir + "/announcement.json"
+
+    # Stores the state of an ongoing announcement, or deletes it if None is given
+    def store_announcement(self, state):
+        if self.read_only:
+            return
+        filepath = self.announcement_file()
+        try:
+            if state is None:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                return
+            # Written aside and then moved, so a crash never leaves half a checkpoint
+            file = open(filepath + ".tmp", 'w', encoding="utf-8")
+            json.dump(state, file, ensure_ascii=False)
+            file.close()
+            os.replace(filepath + ".tmp", filepath)
+        except OSError as e:
+            self.logger.error("Failed storing the announcement checkpoint.")
+            self.logger.exception(e)
+
+    # Loads the state of an ongoing announcement, or None if there's none
+    def load_announcement(self):
+        try:
+            file = open(self.announcement_file(), 'r', encoding="utf-8")
+            state = json.load(file)
+            file.close()
+            return state
+        except OSError:
+            return None
+        except ValueError as e:
+            self.logger.error("Announcement checkpoint is corrupted.")
+            self.logger.exception(e)
+            return None
+
+    # Stores a Reader/Generator file pair. A chat moved into the cold archive
+    # since it was loaded is moved back first, so a card stored without its
+    # vocabulary never ends up in a folder that shadows the archived one
     def store(self, tag, data, vocab):
         chat_folder = self.chat_folder(tag=tag)
         chat_card = self.chat_file(tag=tag, file="card", ext=".txt")
 
         if self.read_only:
             return
+        with self.in_use(tag):
+            try:
+                if not os.path.exists(chat_folder):
+                    os.makedirs(chat_folder, exist_ok=True)
+                    self.logger.info("Storing a new chat. Folder %s created.", chat_folder)
+            except Exception:
+                self.logger.error("Failed creating {} folder.".format(chat_folder))
+                return
+            with span("store_file"):
+                file = open(chat_card, 'w')
+                file.write(data)
+                file.close()
+
+                if vocab is not None:
+                    chat_record = self.chat_file(tag=tag, file="record", ext=self.chatext)
+                    file = open(chat_record, 'w', encoding="utf-16")
+                    file.write(vocab)
+                    file.close()
+
+    # Loads a Generator from its vocabulary file, parsing it incrementally so the
+    # whole dump is never held in memory (see Generator.load_stream). Returns an
+    # empty Generator if there's no file, which chats stored before they learned
+    # anything may lack (see Reader.FromChat)
+    def load_generator(self, tag):
+        filepath = self.chat_file(tag=tag, file="record", ext=self.chatext)
         try:
-            if not os.path.exists(chat_folder):
-                os.makedirs(chat_folder, exist_ok=True)
-                self.logger.info("Storing a new chat. Folder {} created.".format(chat_folder))
-        except Exception:
-            self.logger.error("Failed creating {} folder.".format(chat_folder))
-            return
-        file = open(chat_card, 'w')
-        file.write(data)
-        file.close()
-
-        if vocab is not None:
-            chat_record = self.chat_file(tag=tag, file="record", ext=self.chatext)
-            file = open(chat_record, 'w', encoding="utf-16")
-            file.write(vocab)
-            file.close()
+            file = open(filepath, 'r', encoding="utf-16")
+        except FileNotFoundError:
+            self.logger.info("Chat %s has no vocabulary file yet, starting an empty one.", tag)
+            return Generator(order=self.order)
+        except OSError as e:
+            self.logger.error("Vocabulary file {} not found.".format(filepath))
+            self.logger.exception(e)
+            return Generator(order=self.order)
+        with file:
+            try:
+                return Generator.load_incremental(file, self.order)
+            except UnicodeError as e:
+                self.logger.error("Vocabulary file {} is not UTF-16.".format(filepath))
+                self.logger.exception(e)
+                return Generator(order=self.order)
 
     # Loads a Generator's vocabulary file dump
     def load_vocab(self, tag):
@@ -94,40 +436,52 @@ class Archivist(object):
             return None
 
     # Returns a Reader for a given ID with an already working vocabulary - be it
-    # new or loaded from file
-    def get_reader(self, tag):
-        card = self.load_card(tag)
-        if card:
-            vocab_dump = self.load_vocab(tag)
-            if vocab_dump:
-                vocab = Generator.loads(vocab_dump)
+    # new or loaded from file. Chats in the cold archive are moved back into
+    # their folder first, or just read from it if thaw is False. The folder is
+    # kept out of the cold archive while it's read (see in_use)
+    def get_reader(self, tag, thaw=True):
+        self.wait_restored(tag)
+        thaw = thaw and not self.read_only
+        with self.in_use(tag, thaw) as stored:
+            if not stored:
+                dumps = None if thaw else self.load_cold(tag)
+                return self.reader_from(*dumps) if dumps else None
+            card = self.load_card(tag)
+            if card:
+                with span("load_file"):
+                    vocab = self.load_generator(tag)
+                return Reader.FromCard(card, vocab, self.min_period, self.max_period, self.logger)
             else:
-                vocab = Generator()
-            return Reader.FromCard(card, vocab, self.min_period, self.max_period, self.logger)
+                return None
+
+    # Returns a Reader from its card and vocabulary file dumps
+    def reader_from(self, card, vocab_dump):
+        if vocab_dump:
+            vocab = Generator.loads(vocab_dump, self.order)
         else:
-            return None
+            vocab = Generator(order=self.order)
+        return Reader.FromCard(card, vocab, self.min_period, self.max_period, self.logger)
 
-    # Count the stored chats
+    # Count the stored chats, cold ones included
     def chat_count(self):
-        count = 0
-        directory = os.fsencode(self.chatdir)
-        for subdir in os.scandir(directory):
-            dirname = subdir.name.decode("utf-8")
-            if dirname.startswith("chat_"):
-                count += 1
-        return count
+        return len(self.hot_chats()) + len(self.cold_chats())
+
+    # Returns the IDs of the chats stored in their own folder
+    def hot_chats(self):
+        return [entry.name[5:] for entry in os.scandir(self.chatdir) if entry.name.startswith("chat_")]
 
-    # Crawl through all the stored Readers
+    # Crawl through all the stored Readers. Cold ones are read without thawing them
     def readers_pass(self):
         directory = os.fsencode(self.chatdir)
-        for subdir in os.scandir(directory):
-            dirname = subdir.name.decode("utf-8")
+        dirnames = [subdir.name.decode("utf-8") for subdir in os.scandir(directory)]
+        dirnames += ["chat_" + tag for tag in self.cold_chats()]
+        for dirname in dirnames:
             if dirname.startswith("chat_"):
                 cid = dirname[5:]
                 try:
-                    reader = self.get_reader(cid)
+                    reader = self.get_reader(cid, thaw=False)
                     # self.logger.info("Chat {} contents:\n{}".format(cid, reader.card.dumps()))
-                    self.logger.info("Successfully passed through {} ({}) chat.\n".format(cid, reader.title()))
+                    self.logger.info("Successfully passed through %s (%s) chat.\n", cid, reader.title())
                     if reader.period() > self.max_period:
                         reader.set_period(self.max_period)
                         self.store(*reader.archive())
@@ -140,6 +494,279 @@ class Archivist(object):
                     self.logger.exception(e)
                     raise e
 
+    # Crawl through the Metadata of all the stored chats, without loading any vocabulary
+    def cards_pass(self):
+        directory = os.fsencode(self.chatdir)
+        for subdir in os.scandir(directory):
+            dirname = subdir.name.decode("utf-8")
+            if dirname.startswith("chat_"):
+                card = self.load_card(dirname[5:])
+                if card:
+                    try:
+                        yield Metadata.loads(card)
+                    except Exception as e:
+                        self.logger.error("Failed reading the card of {}".format(dirname))
+                        self.logger.exception(e)
+        for shard in self.cold_files():
+            with zipfile.ZipFile(shard) as archive:
+                for tag in self.cold_tags(shard):
+                    if os.path.isdir(self.chat_folder(tag=tag)):
+                        continue
+                    try:
+                        with io.TextIOWrapper(archive.open(tag + "/card.txt")) as file:
+                            meta = Metadata.loads(file.read())
+                    except Exception as e:
+                        self.logger.error("Failed reading the cold card of {}".format(tag))
+                        self.logger.exception(e)
+                        continue
+                    yield meta
+
+    # Waits until a chat is on disk, if it's part of an ongoing snapshot restore
+    def wait_restored(self, tag):
+        event = self.restoring.get(tag)
+        if event is not None and not event.wait(Archivist.RESTORE_WAIT):
+            self.logger.warning("Chat {} is still being restored, going on without it.".format(tag))
+
+    # Exports the chat logs, or only the given chats, into a single gzipped tar
+    # file, written as a stream: a manifest first, then each chat's files (the
+    # ones in hot.txt first, so they are restored first), and the cold archive
+    # shards last. Every file carries its SHA-256. The bot should be stopped, or
+    # its chats in memory stored, beforehand. Returns the amount of chats exported
+    def export_snapshot(self, path, tags=None):
+        start = time.perf_counter()
+        with self.cold_lock:
+            hot = self.hot_chats()
+            if tags is None:
+                shards = self.cold_files()
+                cold = {os.path.basename(shard): self.cold_tags(shard) for shard in shards}
+                chats = hot
+            else:
+                # Chats in the cold archive are exported as folders, read from it
+                shards = []
+                cold = {}
+                stored = set(hot) | set(self.cold_chats())
+                chats = [tag for tag in dict.fromkeys(tags) if tag in stored]
+            # The chats last in memory first, in their order, then the rest
+            priority = {tag: i for i, tag in enumerate(self.load_hot())}
+            chats = sorted(chats, key=lambda tag: priority.get(tag, len(priority)))
+            exported = set(chats)
+            manifest = {
+                "format": Archivist.SNAPSHOT_FORMAT,
+                "created": time.time(),
+                "chats": chats,
+                "cold": cold,
+                "hot": [tag for tag in self.load_hot() if tag in exported],
+            }
+
+            tmp = path + ".tmp"
+            size = 0
+            with gzip.open(tmp, 'wb', compresslevel=Archivist.SNAPSHOT_COMPRESSION) as stream, \
+                    tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT) as snapshot:
+                self.add_snapshot_file(snapshot, Archivist.SNAPSHOT_MANIFEST,
+                                       json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+                for tag in chats:
+                    for name, data in self.chat_files(tag):
+                        size += self.add_snapshot_file(snapshot, "chat_{}/{}".format(tag, name), data)
+                for shard in shards:
+                    with open(shard, 'rb') as file:
+                        size += self.add_snapshot_file(snapshot, "cold/" + os.path.basename(shard), file.read())
+                if tags is None and os.path.exists(self.announcement_file()):
+                    with open(self.announcement_file(), 'rb') as file:
+                        self.add_snapshot_file(snapshot, os.path.basename(self.announcement_file()), file.read())
+            os.replace(tmp, path)
+        self.logger.info("Exported {} chats and {} cold shards into {} in {:.2f}s ({} bytes -> {} bytes).".format(
+            len(chats), len(shards), path, time.perf_counter() - start, size, os.path.getsize(path)))
+        return len(chats)
+
+    # Returns the (name, contents) of the files of a chat, from its folder or
+    # from the cold archive
+    def chat_files(self, tag):
+        folder = self.chat_folder(tag=tag)
+        if os.path.isdir(folder):
+            files = []
+            for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+                if entry.is_file():
+                    with open(entry.path, 'rb') as file:
+                        files.append((entry.name, file.read()))
+            return files
+        with zipfile.ZipFile(self.cold_file(tag)) as archive:
+            return [(name.split("/", 1)[1], archive.read(name))
+                    for name in archive.namelist() if name.startswith(tag + "/")]
+
+    # Adds a file to a snapshot being written, with its checksum. Returns its size
+    @staticmethod
+    def add_snapshot_file(snapshot, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.pax_headers = {Archivist.SNAPSHOT_CHECKSUM: hashlib.sha256(data).hexdigest()}
+        snapshot.addfile(info, io.BytesIO(data))
+        return len(data)
+
+    # Starts restoring a snapshot into the chat logs directory in the background,
+    # and returns the restoring thread. The manifest is read right away, so until
+    # each listed chat is on disk, loading it waits for it (see wait_restored):
+    # the bot can start serving while the rest is restored, hot chats first.
+    # Chats and files that are already on disk are left as they are
+    def start_restore(self, path, workers=8):
+        snapshot = tarfile.open(path, "r|gz")
+        try:
+            member = snapshot.next()
+            if member is None or member.name != Archivist.SNAPSHOT_MANIFEST:
+                raise ValueError("{} is not a snapshot, it has no manifest.".format(path))
+            data = snapshot.extractfile(member).read()
+            self.check_snapshot_file(member, data)
+            manifest = json.loads(data.decode("utf-8"))
+            if manifest.get("format") != Archivist.SNAPSHOT_FORMAT:
+                raise ValueError("Unknown snapshot format {}.".format(manifest.get("format")))
+        except Exception:
+            snapshot.close()
+            raise
+
+        os.makedirs(self.chatdir, exist_ok=True)
+        tags = list(manifest["chats"]) + [tag for shard in manifest["cold"].values() for tag in shard]
+        for tag in tags:
+            self.restoring[tag] = threading.Event()
+        if not os.path.exists(self.hot_file()) and len(manifest["hot"]) > 0:
+            self.store_hot(manifest["hot"])
+        self.logger.info("Restoring {} chats and {} cold shards from {}...".format(
+            len(manifest["chats"]), len(manifest["cold"]), path))
+        thread = threading.Thread(target=self.restore, args=(snapshot, manifest, workers),
+                                  name="restore", daemon=True)
+        thread.start()
+        return thread
+
+    # Restores a snapshot into the chat logs directory, and waits until it's
+    # done. Returns the amount of chats restored
+    def restore_snapshot(self, path, workers=8):
+        self.start_restore(path, workers).join()
+        return self.restored
+
+    # Reads the rest of an opened snapshot, grouping the files of each chat,
+    # and writes them through a pool of threads
+    def restore(self, snapshot, manifest, workers):
+        start = time.perf_counter()
+        # Bounds the files read ahead of the writers
+        slots = threading.BoundedSemaphore(workers * 4)
+        # List of (whether it's a chat, future of whether it was restored)
+        futures = []
+
+        def submit(pool, chat, function, *args):
+            slots.acquire()
+            future = pool.submit(function, *args)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append((chat, future))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restore") as pool:
+            try:
+                tag, files = None, []
+                while True:
+                    member = snapshot.next()
+                    if member is None:
+                        break
+                    # A streamed tar file can't go back, so there's no point in
+                    # keeping the headers of all the files read so far
+                    snapshot.members.clear()
+                    if not member.isfile():
+                        continue
+                    data = snapshot.extractfile(member).read()
+                    parts = member.name.split("/")
+                    if any(part in ("", ".", "..") for part in parts):
+                        self.logger.warning("Skipping snapshot file {}.".format(member.name))
+                    elif len(parts) == 2 and parts[0].startswith("chat_"):
+                        if parts[0][5:] != tag:
+                            if tag is not None:
+                                submit(pool, True, self.restore_chat, tag, files)
+                            tag, files = parts[0][5:], []
+                        files.append((member, parts[1], data))
+                    elif len(parts) == 2 and parts[0] == "cold":
+                        submit(pool, False, self.restore_shard, member, data, manifest["cold"].get(parts[1], []))
+                    elif len(parts) == 1:
+                        submit(pool, False, self.restore_file, member, data)
+                    else:
+                        self.logger.warning("Skipping snapshot file {}.".format(member.name))
+                if tag is not None:
+                    submit(pool, True, self.restore_chat, tag, files)
+            except (OSError, EOFError, tarfile.TarError, zlib.error) as e:
+                self.logger.error("Snapshot is truncated or corrupted, restored what could be read.")
+                self.logger.exception(e)
+            finally:
+                snapshot.close()
+        self.restored = sum(1 for chat, future in futures if chat and future.result())
+        failed = sum(1 for chat, future in futures if not future.result())
+        # Anything listed but missing from the snapshot is not waited for anymore
+        for event in list(self.restoring.values()):
+            event.set()
+        self.restoring = {}
+        self.logger.info("Restored {} of {} chats and {} cold shards in {:.2f}s ({} entries failed).".format(
+            self.restored, len(manifest["chats"]), len(manifest["cold"]), time.perf_counter() - start, failed))
+
+    # Raises a ValueError if a snapshot file doesn't match its checksum
+    @staticmethod
+    def check_snapshot_file(member, data):
+        expected = member.pax_headers.get(Archivist.SNAPSHOT_CHECKSUM)
+        if expected is None or hashlib.sha256(data).hexdigest() != expected:
+            raise ValueError("Checksum mismatch in snapshot file {}.".format(member.name))
+
+    # Writes a restored chat's folder, if all of its files are intact and it
+    # isn't on disk already. Returns True if it was written
+    def restore_chat(self, tag, files):
+        folder = self.chat_folder(tag=tag)
+        tmp = self.chatdir + "/restoring_" + tag
+        try:
+            for member, filename, data in files:
+                self.check_snapshot_file(member, data)
+            if os.path.isdir(folder):
+                return True
+            # Written aside and then moved, so a failure never leaves half a chat
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for member, filename, data in files:
+                with open(os.path.join(tmp, filename), 'wb') as file:
+                    file.write(data)
+            os.replace(tmp, folder)
+            return True
+        except (OSError, ValueError) as e:
+            self.logger.error("Failed restoring chat {}.".format(tag))
+            self.logger.exception(e)
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        finally:
+            self.restored_chat(tag)
+
+    # Writes a restored cold archive shard, if it's intact and it isn't on
+    # disk already. Returns True if it was written
+    def restore_shard(self, member, data, tags):
+        try:
+            os.makedirs(self.chatdir + "/cold", exist_ok=True)
+            return self.restore_file(member, data)
+        finally:
+            for tag in tags:
+                self.restored_chat(tag)
+
+    # Writes any other restored file, if it's intact and it isn't on disk
+    # already. Returns True if it was written
+    def restore_file(self, member, data):
+        path = os.path.join(self.chatdir, *member.name.split("/"))
+        try:
+            self.check_snapshot_file(member, data)
+            if os.path.exists(path):
+                return True
+            with open(path + ".tmp", 'wb') as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+            return True
+        except (OSError, ValueError) as e:
+            self.logger.error("Failed restoring {}.".format(member.name))
+            self.logger.exception(e)
+            return False
+
+    # Marks a chat of an ongoing restore as available
+    def restored_chat(self, tag):
+        event = self.restoring.pop(tag, None)
+        if event is not None:
+            event.set()
+
     # Load and immediately store every Reader
     def update(self):
         for reader in self.readers_pass():
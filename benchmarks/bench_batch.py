@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Benchmarks generating many messages at once over the integer-encoded
+# transition table (Generator.generate_many) against the scalar loop. With
+# --frozen, the Generator is frozen first, and the table is built from the
+# FrozenChain without thawing it.
+# Usage: python benchmarks/bench_batch.py [-n MESSAGES] [-g GENERATIONS] [-o ORDER] [--frozen]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generator import Generator, numpy, numpyError  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch generation benchmark.')
+    parser.add_argument('-n', '--messages', type=int, default=20000,
+                        help='Number of synthetic messages to learn. (default: 20000)')
+    parser.add_argument('-g', '--generations', type=int, default=20000,
+                        help='Number of messages to generate. (default: 20000)')
+    parser.add_argument('-o', '--order', type=int, default=2,
+                        help='Order of the Generator. (default: 2)')
+    parser.add_argument('--frozen', action='store_true',
+                        help='Freeze the Generator first (see Generator.freeze).')
+    args = parser.parse_args()
+
+    if numpy is None:
+        sys.exit("NumPy is needed for this benchmark: {}".format(numpyError))
+
+    gen = Generator(order=args.order)
+    for text in synthetic_corpus(args.messages):
+        gen.add(text)
+    if args.frozen:
+        gen.freeze()
+
+    start = time.perf_counter()
+    for i in range(args.generations):
+        gen.generate(50)
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = gen.transitions()
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gen.generate_many(args.generations, 50)
+    batch = time.perf_counter() - start
+
+    print("{} messages learned, order {}{}, {}".format(
+        args.messages, args.order, ", still frozen" if gen.is_frozen() else "", table))
+    print("scalar:  {:.3f}s ({:.0f} msg/s)".format(scalar, args.generations / scalar))
+    print("table:   {:.3f}s to build".format(build))
+    print("batch:   {:.3f}s ({:.0f} msg/s), {:.1f}x faster".format(
+        batch, args.generations / batch, scalar / batch))
+
+
+if __name__ == '__main__':
+    main()
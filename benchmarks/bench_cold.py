@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Benchmarks the cold archive: stores many synthetic chats, freezes the idle
+# ones, and reports the disk footprint and scan times before and after, and
+# how long it takes to load a chat back from it.
+# Usage: python benchmarks/bench_cold.py [-c CHATS] [-n MESSAGES] [-i IDLE_RATIO]
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from archivist import Archivist  # noqa: E402
+from generator import Generator  # noqa: E402
+from metadata import Metadata  # noqa: E402
+from reader import Reader  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def report(label, archivist):
+    usage = archivist.disk_usage()
+    cards, elapsed = timed(lambda: sum(1 for meta in archivist.cards_pass()))
+    print("{:7} {:6} files, {:8.1f} MiB on disk, chat count {:.3f}s, cards pass {:.3f}s ({} cards)".format(
+        label, usage["files"], usage["bytes"] / 2 ** 20, usage["scan_time"], elapsed, cards))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold archive benchmark.')
+    parser.add_argument('-c', '--chats', type=int, default=2000,
+                        help='Number of synthetic chats. (default: 2000)')
+    parser.add_argument('-n', '--messages', type=int, default=50,
+                        help='Number of synthetic messages per chat. (default: 50)')
+    parser.add_argument('-i', '--idle', type=float, default=0.9,
+                        help='Ratio of chats that are idle. (default: 0.9)')
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_cold")
+    directory = tempfile.mkdtemp(prefix="velasco_cold_")
+    archivist = Archivist(logger, directory, ".json")
+    corpus = synthetic_corpus(args.messages * 10)
+    rng = random.Random(0)
+    old = time.time() - 365 * 86400
+    idle = []
+    for i in range(args.chats):
+        vocab = Generator()
+        for text in rng.sample(corpus, args.messages):
+            vocab.add(text)
+        reader = Reader(Metadata(-1000 - i, "group", "Group {}".format(i)), vocab, 1, 100000, logger)
+        archivist.store(*reader.archive())
+        if rng.random() < args.idle:
+            tag = reader.cid()
+            os.utime(archivist.chat_file(tag=tag, file="card", ext=".txt"), (old, old))
+            idle.append(tag)
+
+    report("before", archivist)
+    frozen, elapsed = timed(archivist.freeze_idle, 30 * 86400)
+    print("froze {} chats in {:.2f}s".format(frozen, elapsed))
+    report("after", archivist)
+
+    sample = rng.sample(idle, min(100, len(idle)))
+    readers, elapsed = timed(lambda: [archivist.get_reader(tag) for tag in sample])
+    print("thawed {} chats in {:.3f}s ({:.1f} ms each)".format(
+        len(readers), elapsed, elapsed / max(1, len(readers)) * 1000))
+    print("chat logs in", directory)
+
+
+if __name__ == '__main__':
+    main()
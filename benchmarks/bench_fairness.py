@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Benchmarks how a few chats with the shortest period hold up the replies to
+# mentions in every other chat, with and without a generation budget per chat
+# (see speakbudget.py). Messages arrive at a fixed rate and are handled one by
+# one, as by the dispatcher; sending a message takes a fixed time. Reports the
+# latency of the replies to mentions in the quiet chats (from the arrival of
+# the mention to its reply being sent), and the messages sent by each kind of chat.
+# Usage: python benchmarks/bench_fairness.py [-n MESSAGES] [-r RATE] [-s SEND_MS] [-B BUDGET]
+
+import argparse
+import datetime
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, Update  # noqa: E402
+
+from archivist import Archivist  # noqa: E402
+from speaker import Speaker  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+# Takes the messages the bot would send, taking `delay` seconds for each
+class SlowBot(object):
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = {}
+
+    def send_message(self, chat_id, *args, **kwargs):
+        time.sleep(self.delay)
+        self.sent[chat_id] = self.sent.get(chat_id, 0) + 1
+
+
+def updates(noisy, quiet, messages, share, mentions, seed=0):
+    corpus = synthetic_corpus(messages)
+    rng = random.Random(seed)
+    date = datetime.datetime.now()
+    result = []
+    for uid in range(messages):
+        text = corpus[uid]
+        if rng.random() < share:
+            chat = rng.choice(noisy)
+        else:
+            chat = rng.choice(quiet)
+            if rng.random() < mentions:
+                text = "@bench_bot " + text
+        result.append(Update(uid, message=Message(uid, date, chat, text=text)))
+    return result
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(budget, period, noisy, quiet, stream, rate, delay, logger):
+    root = tempfile.mkdtemp(prefix="velasco_fairness_")
+    try:
+        archivist = Archivist(logger, root, ".json", min_period=1, max_period=100000)
+        speaker = Speaker("@bench_bot", archivist, logger, memory=len(noisy) + len(quiet) + 1,
+                          batch_size=1, speak_budget=budget, budget_period=period)
+        for chat in noisy:
+            speaker.load_reader(chat).set_period(1)
+        for chat in quiet:
+            speaker.load_reader(chat).set_period(100000)
+        bot = SlowBot(delay)
+        context = SimpleNamespace(bot=bot, update_queue=queue.Queue())
+        latencies = []
+        start = time.perf_counter()
+        for i, update in enumerate(stream):
+            arrival = start + i / rate
+            wait = arrival - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            speaker.read(update, context)
+            if update.message.text.startswith("@bench_bot"):
+                latencies.append(time.perf_counter() - arrival)
+        elapsed = time.perf_counter() - start
+        speaker.io_executor.shutdown(wait=True)
+        return elapsed, latencies, bot.sent, speaker.speak_budget
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-chat generation budget fairness benchmark.')
+    parser.add_argument('-n', '--messages', type=int, default=3000,
+                        help='Number of messages read. (default: 3000)')
+    parser.add_argument('-r', '--rate', type=float, default=300,
+                        help='Messages arriving per second. (default: 300)')
+    parser.add_argument('-s', '--send_ms', type=float, default=10,
+                        help='Time (in ms) taken by each message sent. (default: 10)')
+    parser.add_argument('-B', '--budget', type=float, default=0.5,
+                        help='Time (in s) per budget period of each chat. (default: 0.5)')
+    parser.add_argument('-p', '--period', type=float, default=5,
+                        help='Length (in s) of the budget period. (default: 5)')
+    parser.add_argument('--noisy', type=int, default=3,
+                        help='Number of chats with a period of 1. (default: 3)')
+    parser.add_argument('--quiet', type=int, default=20,
+                        help='Number of chats that only get replies to mentions. (default: 20)')
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_fairness")
+    # Missing cards of the new chats are logged as errors
+    logger.setLevel(logging.CRITICAL)
+    noisy = [Chat(-1000 - i, "group", title="Noisy {}".format(i)) for i in range(args.noisy)]
+    quiet = [Chat(-2000 - i, "group", title="Quiet {}".format(i)) for i in range(args.quiet)]
+    stream = updates(noisy, quiet, args.messages, share=0.8, mentions=0.1)
+    noisy_ids = set(str(chat.id) for chat in noisy)
+    print("{} messages at {:.0f}/s, 80% from {} noisy chats, {:.0f} ms per message sent".format(
+        args.messages, args.rate, args.noisy, args.send_ms))
+    for budget in (0, args.budget):
+        elapsed, latencies, sent, speak_budget = run(budget, args.period, noisy, quiet, stream,
+                                                     args.rate, args.send_ms / 1000, logger)
+        noisy_sent = sum(count for cid, count in sent.items() if cid in noisy_ids)
+        quiet_sent = sum(sent.values()) - noisy_sent
+        deferred = sum(usage["deferred"] for cid, usage in speak_budget.usage())
+        name = "no budget" if budget <= 0 else "budget {}s/{}s".format(budget, args.period)
+        print("{:>16}: {:.2f}s, mention replies p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms; "
+              "sent {} noisy, {} quiet, {} deferred".format(
+                  name, elapsed, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+                  max(latencies, default=0) * 1000, noisy_sent, quiet_sent, deferred))
+
+
+if __name__ == '__main__':
+    main()
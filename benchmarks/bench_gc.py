@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Benchmarks the garbage collector pauses while handling messages with many
+# vocabularies loaded: as they are (tracked by the collector), moved out of
+# its reach with gc.freeze() (see GCMonitor.freeze), and packed into their
+# frozen array form (see Generator.freeze). Each mode runs in its own process.
+# Messages only go to a few active chats, the rest of them stay idle.
+# Usage: python benchmarks/bench_gc.py [-c CHATS] [-n MESSAGES] [-m HANDLED] [-a ACTIVE]
+
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gcmonitor import GCMonitor, percentile  # noqa: E402
+from generator import Generator  # noqa: E402
+from metadata import Metadata  # noqa: E402
+from reader import Reader  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+MODES = ("tracked", "gc.freeze", "frozen")
+
+
+def run(mode, chats, messages, handled, active):
+    logger = logging.getLogger("bench_gc")
+    corpus = synthetic_corpus(messages * 4)
+    rng = random.Random(0)
+    readers = []
+    for i in range(chats):
+        vocab = Generator()
+        for text in rng.sample(corpus, messages):
+            vocab.add(text)
+        reader = Reader(Metadata(-1000 - i, "group", "Group {}".format(i)), vocab, 1, 100000, logger)
+        # Idle chats, as Speaker.compact leaves them (active ones would thaw right away)
+        if mode == "frozen" and i >= active:
+            reader.freeze()
+        readers.append(reader)
+    # The idle ones are kept alive all along, as they would be in memory
+    readers, idle = readers[:active], readers[active:]
+
+    monitor = GCMonitor(history=100000)
+    if mode == "gc.freeze":
+        monitor.freeze()
+    monitor.install()
+    latencies = []
+    for i in range(handled):
+        reader = rng.choice(readers)
+        message = SimpleNamespace(message_id=i, text=rng.choice(corpus), sticker=None, animation=None, video=None)
+        start = time.perf_counter()
+        reader.read(message)
+        if i % 10 == 0:
+            reader.generate_message(50)
+        latencies.append(time.perf_counter() - start)
+    monitor.uninstall()
+    latencies.sort()
+    points = monitor.percentiles()
+    return {"mode": mode, "tracked": len(gc.get_objects()), "collections": sum(monitor.counts),
+            "full": monitor.counts[2], "gc_total": sum(monitor.totals),
+            "gc_p50": points[50], "gc_p99": points[99], "gc_max": points[100],
+            "msg_p99": percentile(latencies, 99), "msg_max": latencies[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Garbage collector pauses benchmark.')
+    parser.add_argument('-c', '--chats', type=int, default=50,
+                        help='Number of vocabularies loaded. (default: 50)')
+    parser.add_argument('-n', '--messages', type=int, default=5000,
+                        help='Number of synthetic messages learned by each vocabulary. (default: 5000)')
+    parser.add_argument('-m', '--handled', type=int, default=50000,
+                        help='Number of messages handled while measuring. (default: 50000)')
+    parser.add_argument('-a', '--active', type=int, default=5,
+                        help='Number of chats receiving the messages. (default: 5)')
+    parser.add_argument('--mode', choices=MODES, default=None,
+                        help='Run a single mode in this process and print its results as JSON.')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args.chats, args.messages, args.handled, args.active)))
+        return
+
+    print("{} chats of {} messages, {} messages handled by {} of them".format(
+        args.chats, args.messages, args.handled, args.active))
+    print("{:10} {:>10} {:>6} {:>5} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9}".format(
+        "mode", "tracked", "GCs", "full", "GC ms", "p50 ms", "p99 ms", "max ms", "msg p99", "msg max"))
+    for mode in MODES:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--mode", mode,
+                                          "-c", str(args.chats), "-n", str(args.messages), "-m", str(args.handled),
+                                          "-a", str(args.active)])
+        r = json.loads(output)
+        print("{:10} {:>10} {:>6} {:>5} {:>9.1f} {:>8.3f} {:>8.3f} {:>8.1f} {:>9.3f} {:>9.1f}".format(
+            r["mode"], r["tracked"], r["collections"], r["full"], r["gc_total"] * 1000, r["gc_p50"] * 1000,
+            r["gc_p99"] * 1000, r["gc_max"] * 1000, r["msg_p99"] * 1000, r["msg_max"] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Benchmarks the memory and throughput of the Generator across chain orders,
+# against the legacy flat dictionary of order 2 word pairs. Next to the memory
+# measured, it shows the Generator's own estimate of it (see Generator.size).
+# Usage: python benchmarks/bench_generator.py [-n MESSAGES] [-f FILE]
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generator import Generator, getkey, rewrite, triplets  # noqa: E402
+
+
+# The legacy order 2 vocabulary: a flat dict from "('w1', 'w2')" keys to lists
+class LegacyGenerator(object):
+    def __init__(self):
+        self.cache = {}
+
+    def add(self, text):
+        words = [Generator.HEAD]
+        words.extend(rewrite(text + Generator.TAIL))
+        for w1, w2, w3 in triplets(words):
+            if w1 == Generator.HEAD:
+                self.cache.setdefault(Generator.HEAD, []).append(w2)
+            self.cache.setdefault(getkey(w1, w2), []).append(w3)
+
+    def generate(self, size=50):
+        w1 = random.choice(self.cache[Generator.HEAD])
+        w2 = random.choice(self.cache[getkey(Generator.HEAD, w1)])
+        gen_words = []
+        for i in range(size):
+            gen_words.append(w1)
+            if getkey(w1, w2) not in self.cache:
+                break
+            w1, w2 = w2, random.choice(self.cache[getkey(w1, w2)])
+        return ' '.join(gen_words)
+
+
+# Synthetic chat messages, with word frequencies following Zipf's law
+def synthetic_corpus(n, vocabulary=5000, seed=0):
+    rng = random.Random(seed)
+    words = ["w{}".format(i) for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    corpus = []
+    for i in range(n):
+        length = rng.randint(1, 20)
+        corpus.append(' '.join(rng.choices(words, weights, k=length)))
+    return corpus
+
+
+def measure(name, make, corpus, generations):
+    tracemalloc.start()
+    start = time.perf_counter()
+    gen = make()
+    for text in corpus:
+        gen.add(text)
+    add_time = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    # The same vocabulary, packed into its frozen form
+    estimate = "-"
+    frozen = "-"
+    frozen_estimate = "-"
+    frozen_gen = "-"
+    if hasattr(gen, "freeze"):
+        estimate = "{:.1f}".format(gen.size() / 2**20)
+        gen.freeze()
+        # The trie's leftovers, for a fair measure
+        gc.collect()
+        frozen = "{:.1f}".format(tracemalloc.get_traced_memory()[0] / 2**20)
+        frozen_estimate = "{:.1f}".format(gen.size() / 2**20)
+        gen.thaw()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for i in range(generations):
+        gen.generate(50)
+    gen_time = time.perf_counter() - start
+
+    if hasattr(gen, "freeze"):
+        gen.freeze()
+        start = time.perf_counter()
+        for i in range(generations):
+            gen.generate(50)
+        frozen_gen = "{:.0f}".format(generations / (time.perf_counter() - start))
+
+    print("{:<10} {:>10.1f} {:>9} {:>14.0f} {:>14.0f} {:>11} {:>12} {:>14}".format(
+        name, size / 2**20, estimate, len(corpus) / add_time, generations / gen_time,
+        frozen, frozen_estimate, frozen_gen))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generator memory and throughput benchmark.')
+    parser.add_argument('-n', '--messages', type=int, default=100000,
+                        help='Number of synthetic messages to learn. (default: 100000)')
+    parser.add_argument('-g', '--generations', type=int, default=5000,
+                        help='Number of messages to generate. (default: 5000)')
+    parser.add_argument('-f', '--file', default=None,
+                        help='Text file with one message per line, instead of synthetic messages.')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            corpus = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.messages)
+
+    print("{} messages".format(len(corpus)))
+    print("{:<10} {:>10} {:>9} {:>14} {:>14} {:>11} {:>12} {:>14}".format(
+        "model", "MiB", "est. MiB", "learn msg/s", "generate msg/s", "frozen MiB",
+        "frozen est.", "frozen gen/s"))
+    measure("legacy", LegacyGenerator, corpus, args.generations)
+    for order in range(Generator.MIN_ORDER, Generator.MAX_ORDER + 1):
+        measure("order {}".format(order), lambda: Generator(order=order), corpus, args.generations)
+
+
+if __name__ == '__main__':
+    main()
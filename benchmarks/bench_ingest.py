@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Benchmarks reading bursts of messages through the Speaker's handlers, one
+# message at a time (batch size 1) against gathering them per chat first (see
+# Speaker.read and Speaker.flush_batches). The update queue is kept busy, so
+# batches are only read once they are full or their window is over.
+# Usage: python benchmarks/bench_ingest.py [-c CHATS] [-n MESSAGES] [-b BURST] [-s SIZES]
+
+import argparse
+import datetime
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, Update  # noqa: E402
+
+from archivist import Archivist  # noqa: E402
+from speaker import Speaker  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+# Takes the messages the bot would send, without sending them anywhere
+class StubBot(object):
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, *args, **kwargs):
+        self.sent += 1
+
+
+def updates(chats, messages, burst, seed=0):
+    corpus = synthetic_corpus(messages)
+    rng = random.Random(seed)
+    date = datetime.datetime.now()
+    result = []
+    while len(result) < messages:
+        chat = rng.choice(chats)
+        for i in range(rng.randint(1, burst * 2)):
+            uid = len(result)
+            message = Message(uid, date, chat, text=corpus[uid % len(corpus)])
+            result.append(Update(uid, message=message))
+    return result[:messages]
+
+
+def run(batch_size, chats, stream, logger):
+    root = tempfile.mkdtemp(prefix="velasco_ingest_")
+    try:
+        archivist = Archivist(logger, root, ".json", min_period=1, max_period=100000)
+        speaker = Speaker("@bench_bot", archivist, logger, memory=len(chats) + 1, reply=0, repeat=0,
+                          batch_size=batch_size, batch_window=3600)
+        for chat in chats:
+            speaker.load_reader(chat)
+        bot = StubBot()
+        busy = queue.Queue()
+        busy.put(None)
+        context = SimpleNamespace(bot=bot, update_queue=busy)
+        start = time.perf_counter()
+        for update in stream:
+            speaker.read(update, context)
+            speaker.flush_batches(update, context)
+        for cid in list(speaker.batches):
+            speaker.flush(cid, bot)
+        elapsed = time.perf_counter() - start
+        speaker.io_executor.shutdown(wait=True)
+        return elapsed, bot.sent
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-chat batched reading benchmark.')
+    parser.add_argument('-c', '--chats', type=int, default=20,
+                        help='Number of chats sending messages. (default: 20)')
+    parser.add_argument('-n', '--messages', type=int, default=50000,
+                        help='Number of messages read. (default: 50000)')
+    parser.add_argument('-b', '--burst', type=int, default=16,
+                        help='Average length of the bursts of messages from a single chat. (default: 16)')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1, 8, 32],
+                        help='Batch sizes to compare. (default: 1 8 32)')
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_ingest")
+    # Missing cards of the new chats are logged as errors
+    logger.setLevel(logging.CRITICAL)
+    chats = [Chat(-1000 - i, "group", title="Group {}".format(i)) for i in range(args.chats)]
+    stream = updates(chats, args.messages, args.burst)
+    print("{} messages from {} chats, in bursts of ~{}".format(args.messages, args.chats, args.burst))
+    base = None
+    for size in args.sizes:
+        elapsed, sent = run(size, chats, stream, logger)
+        base = base or elapsed
+        print("batch {:>3}: {:.3f}s ({:.0f} msg/s), {} sent, {:.2f}x".format(
+            size, elapsed, args.messages / elapsed, sent, base / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Benchmarks loading a vocabulary record file: reading it whole and parsing it
+# with json.loads (the old path) against parsing it incrementally into the
+# Generator, reporting the peak memory, final memory and time of each (times
+# include the overhead of tracing memory allocations).
+# Usage: python benchmarks/bench_load.py [-n MESSAGES] [-o ORDER] [--legacy]
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generator import Generator  # noqa: E402
+from bench_generator import LegacyGenerator, synthetic_corpus  # noqa: E402
+
+
+def whole(path, order):
+    file = open(path, 'r', encoding="utf-16")
+    record = file.read()
+    file.close()
+    return Generator.loads(record, order)
+
+
+def incremental(path, order):
+    with open(path, 'r', encoding="utf-16") as file:
+        return Generator.load_incremental(file, order)
+
+
+def measure(name, load, path, order):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    gen = load(path, order)
+    elapsed = time.perf_counter() - start
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:<12} {:>10.1f} {:>10.1f} {:>8.2f}".format(name, peak / 2**20, size / 2**20, elapsed))
+    return gen
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vocabulary loading benchmark.')
+    parser.add_argument('-n', '--messages', type=int, default=100000,
+                        help='Number of synthetic messages in the record. (default: 100000)')
+    parser.add_argument('-o', '--order', type=int, default=2,
+                        help='Order of the Generator. (default: 2)')
+    parser.add_argument('--legacy', action='store_true',
+                        help='Write the record in the legacy (order 2) format.')
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.messages)
+    if args.legacy:
+        gen = LegacyGenerator()
+        for text in corpus:
+            gen.add(text)
+        dump = json.dumps(gen.cache, ensure_ascii=False)
+    else:
+        gen = Generator(order=args.order)
+        for text in corpus:
+            gen.add(text)
+        dump = gen.dumps()
+    del gen
+    path = os.path.join(tempfile.mkdtemp(prefix="velasco_load_"), "record.json")
+    with open(path, 'w', encoding="utf-16") as file:
+        file.write(dump)
+    del dump
+
+    print("{} messages, {:.1f} MiB record".format(args.messages, os.path.getsize(path) / 2**20))
+    print("{:<12} {:>10} {:>10} {:>8}".format("loader", "peak MiB", "final MiB", "time s"))
+    a = measure("whole", whole, path, args.order)
+    del a
+    measure("incremental", incremental, path, args.order)
+
+
+if __name__ == '__main__':
+    main()
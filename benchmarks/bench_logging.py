@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Benchmarks the time the handlers spend logging the messages they send (see
+# speaker.send): writing the log lines right away, as the bot used to, against
+# the bot's current setup (see logqueue.py): records without the caller's
+# details, put into a queue written by a background thread, with and without
+# limiting them to a rate. Only the time spent by the sending thread is
+# measured, and then the time until the background thread wrote everything.
+# Usage: python benchmarks/bench_logging.py [-n MESSAGES] [-r RATE]
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logqueue  # noqa: E402
+from speaker import send  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+# Takes the messages, without sending them anywhere
+class StubBot(object):
+    def send_message(self, *args, **kwargs):
+        pass
+
+
+def run(mode, corpus, path, rate):
+    logger = logging.getLogger("bench_logging." + mode)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(open(path, 'a'))
+    handler.setFormatter(logging.Formatter("[BENCH][%(asctime)s]%(name)s::%(levelname)s: %(message)s"))
+    logger.addHandler(handler)
+    listener = None
+    if mode != "sync":
+        listener = logqueue.install(logger, rate=rate if mode == "sampled" else 0)
+    bot = StubBot()
+    start = time.perf_counter()
+    for i, text in enumerate(corpus):
+        send(bot, -1000 - i % 100, text, replying=i if i % 2 else None, logger=logger)
+    elapsed = time.perf_counter() - start
+    if listener is not None:
+        listener.stop()
+    drained = time.perf_counter() - start
+    handler.stream.close()
+    return elapsed, drained
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Logging overhead benchmark.')
+    parser.add_argument('-n', '--messages', type=int, default=100000,
+                        help='Number of messages sent. (default: 100000)')
+    parser.add_argument('-r', '--rate', type=int, default=20,
+                        help='Log lines per second of each kind when limited. (default: 20)')
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.messages)
+    path = tempfile.mkstemp(prefix="velasco_logging_", suffix=".log")[1]
+    try:
+        print("{} messages sent, each one logged".format(args.messages))
+        base = None
+        for mode in ("sync", "queue", "sampled"):
+            if mode == "queue":
+                logqueue.skip_record_details()
+            elapsed, drained = run(mode, corpus, path, args.rate)
+            base = base or elapsed
+            print("{:8} {:.3f}s ({:.2f} us per message, {:.1f}x), {:.3f}s until written".format(
+                mode, elapsed, elapsed / args.messages * 1e6, base / elapsed, drained))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Benchmarks finding the words of a message in the vocabulary to start a reply
+# from (see Generator.seeds): through the seed index, against going through
+# every context key as it would take without it. Also reports the time to
+# build the index, and to generate a reply with and without a seed, and how
+# many of those replies are a single word.
+# Usage: python benchmarks/bench_seed.py [-n MESSAGES] [-l LOOKUPS] [-o ORDER] [--frozen]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generator import Generator, rewrite, seedkey  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+# Finds the keys of the words of a text by going through every key of the chain
+def scan(gen, text):
+    words = set(seedkey(word) for word in rewrite(text))
+    keys = gen.frozen.root_keys() if gen.frozen is not None else gen.root.children
+    return [key for key in keys if not key.startswith("^") and seedkey(key) in words and gen.followers(key) > 0]
+
+
+def timed(function, texts):
+    start = time.perf_counter()
+    for text in texts:
+        function(text)
+    return (time.perf_counter() - start) / len(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reply seed lookup benchmark.')
+    parser.add_argument('-n', '--messages', type=int, default=100000,
+                        help='Number of synthetic messages learned. (default: 100000)')
+    parser.add_argument('-l', '--lookups', type=int, default=2000,
+                        help='Number of messages looked up. (default: 2000)')
+    parser.add_argument('-o', '--order', type=int, default=2,
+                        help='Order of the Generator. (default: 2)')
+    parser.add_argument('--frozen', action='store_true',
+                        help='Freeze the Generator first (see Generator.freeze).')
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.messages + args.lookups)
+    gen = Generator(order=args.order)
+    for text in corpus[:args.messages]:
+        gen.add(text)
+    if args.frozen:
+        gen.freeze()
+    texts = corpus[args.messages:]
+    random.seed(0)
+
+    start = time.perf_counter()
+    index = gen.seed_index()
+    build = time.perf_counter() - start
+    print("{} messages learned, order {}{}, {} words indexed in {:.1f} ms".format(
+        args.messages, args.order, ", frozen" if args.frozen else "",
+        sum(len(keys) for keys in index.values()), build * 1000))
+
+    found = sum(1 for text in texts if gen.seeds(text))
+    indexed = timed(gen.seeds, texts)
+    scanned = timed(lambda text: scan(gen, text), texts[:max(1, args.lookups // 100)])
+    print("seed lookup: index {:.1f} us, scan {:.1f} us ({:.0f}x), {} of {} messages with known words".format(
+        indexed * 1e6, scanned * 1e6, scanned / indexed, found, len(texts)))
+
+    plain = timed(lambda text: gen.generate(50), texts)
+    seeded = timed(lambda text: gen.generate(50, seed=text), texts)
+    print("generate: random start {:.1f} us, seeded {:.1f} us".format(plain * 1e6, seeded * 1e6))
+
+    single = sum(1 for text in texts if len(gen.generate(50).split()) == 1)
+    single_seeded = sum(1 for text in texts if len(gen.generate(50, seed=text).split()) == 1)
+    print("single word replies: random start {:.1%}, seeded {:.1%}".format(
+        single / len(texts), single_seeded / len(texts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Benchmarks snapshots: stores many synthetic chats (some of them in the cold
+# archive), and compares copying the chat logs tree file by file against
+# exporting them into a snapshot and restoring it elsewhere, including how soon
+# the hottest chat can be loaded while the restore is still going on.
+# Usage: python benchmarks/bench_snapshot.py [-c CHATS] [-n MESSAGES] [-w WORKERS]
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from archivist import Archivist  # noqa: E402
+from generator import Generator  # noqa: E402
+from metadata import Metadata  # noqa: E402
+from reader import Reader  # noqa: E402
+from bench_generator import synthetic_corpus  # noqa: E402
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot export and restore benchmark.')
+    parser.add_argument('-c', '--chats', type=int, default=2000,
+                        help='Number of synthetic chats. (default: 2000)')
+    parser.add_argument('-n', '--messages', type=int, default=50,
+                        help='Number of synthetic messages per chat. (default: 50)')
+    parser.add_argument('-i', '--idle', type=float, default=0.5,
+                        help='Ratio of chats moved into the cold archive. (default: 0.5)')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='Number of restoring threads. (default: 8)')
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_snapshot")
+    root = tempfile.mkdtemp(prefix="velasco_snapshot_")
+    source = Archivist(logger, os.path.join(root, "source"), ".json")
+    os.makedirs(source.chatdir)
+    corpus = synthetic_corpus(args.messages * 10)
+    rng = random.Random(0)
+    old = time.time() - 365 * 86400
+    tags = []
+    for i in range(args.chats):
+        vocab = Generator()
+        for text in rng.sample(corpus, args.messages):
+            vocab.add(text)
+        reader = Reader(Metadata(-1000 - i, "group", "Group {}".format(i)), vocab, 1, 100000, logger)
+        source.store(*reader.archive())
+        tags.append(reader.cid())
+        if rng.random() < args.idle:
+            os.utime(source.chat_file(tag=reader.cid(), file="card", ext=".txt"), (old, old))
+    hot = tags[-50:]
+    source.store_hot(hot)
+    source.freeze_idle(30 * 86400, exclude=set(hot))
+    usage = source.disk_usage()
+    print("source: {} chats, {} files, {:.1f} MiB on disk".format(
+        source.chat_count(), usage["files"], usage["bytes"] / 2 ** 20))
+
+    _, elapsed = timed(shutil.copytree, source.chatdir, os.path.join(root, "copy"))
+    print("copy tree:  {:.2f}s".format(elapsed))
+
+    path = os.path.join(root, "snapshot.tar.gz")
+    exported, elapsed = timed(source.export_snapshot, path)
+    print("export:     {:.2f}s, {} chats, {:.1f} MiB".format(elapsed, exported, os.path.getsize(path) / 2 ** 20))
+
+    target = Archivist(logger, os.path.join(root, "target"), ".json")
+    start = time.perf_counter()
+    thread = target.start_restore(path, args.workers)
+    reader = target.get_reader(hot[-1])
+    first = time.perf_counter() - start
+    thread.join()
+    elapsed = time.perf_counter() - start
+    print("restore:    {:.2f}s with {} threads, {} chats, hottest chat loaded after {:.3f}s".format(
+        elapsed, args.workers, target.restored, first))
+
+    assert reader is not None and reader.cid() == hot[-1]
+    assert target.chat_count() == source.chat_count()
+    assert target.load_hot() == source.load_hot()
+    sample = rng.sample(tags, min(100, len(tags)))
+    for tag in sample:
+        assert target.get_reader(tag, thaw=False).vocab.dumps() == source.get_reader(tag, thaw=False).vocab.dumps()
+    print("checked {} chats against the source".format(len(sample)))
+    shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Benchmarks the overhead of tracing the updates (see tracing.py) while
+# reading bursts of messages through the Speaker's handlers (as in
+# bench_ingest.py): with no Tracer in use, and with one whose threshold no
+# update reaches, so nothing is written. Each case runs several times, in turns.
+# Usage: python benchmarks/bench_tracing.py [-c CHATS] [-n MESSAGES] [-b BURST] [-r ROUNDS]
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat  # noqa: E402
+
+from tracing import Tracer  # noqa: E402
+from bench_ingest import run, updates  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update tracing overhead benchmark.')
+    parser.add_argument('-c', '--chats', type=int, default=20,
+                        help='Number of chats sending messages. (default: 20)')
+    parser.add_argument('-n', '--messages', type=int, default=30000,
+                        help='Number of messages read. (default: 30000)')
+    parser.add_argument('-b', '--burst', type=int, default=4,
+                        help='Average length of the bursts of messages from a single chat. (default: 4)')
+    parser.add_argument('-r', '--rounds', type=int, default=3,
+                        help='Number of times each case runs. (default: 3)')
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_tracing")
+    logger.setLevel(logging.CRITICAL)
+    chats = [Chat(-1000 - i, "group", title="Group {}".format(i)) for i in range(args.chats)]
+    stream = updates(chats, args.messages, args.burst)
+    path = tempfile.mkstemp(prefix="velasco_tracing_", suffix=".jsonl")[1]
+    tracer = Tracer(path, threshold=3600)
+    times = {"off": [], "on": []}
+    try:
+        for i in range(args.rounds):
+            for case in ("off", "on"):
+                if case == "on":
+                    tracer.install()
+                elapsed, sent = run(32, chats, stream, logger)
+                tracer.uninstall()
+                times[case].append(elapsed)
+    finally:
+        os.remove(path)
+
+    print("{} messages from {} chats, in bursts of ~{}, {} traces recorded".format(
+        args.messages, args.chats, args.burst, tracer.traced))
+    best = {case: min(elapsed) for case, elapsed in times.items()}
+    for case in ("off", "on"):
+        print("tracing {:3}: best {:.3f}s ({:.0f} msg/s), all {}".format(
+            case, best[case], args.messages / best[case], ", ".join("{:.3f}s".format(t) for t in times[case])))
+    print("overhead: {:+.1%}".format(best["on"] / best["off"] - 1))
+
+
+if __name__ == '__main__':
+    main()
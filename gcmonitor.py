@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import gc
+import threading
+import time
+from collections import deque
+
+
+# Returns the p-th percentile (0 to 100) of a sorted list of values
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+# This measures the pauses of the cyclic garbage collector, through the
+# gc.callbacks hooks that run right before and after each collection. It keeps
+# the last `history` pauses of each generation, to report their percentiles.
+# It can also move every object alive into the permanent generation (see
+# freeze()), so the big, long-lived vocabularies stop being scanned again and
+# again by every full collection
+class GCMonitor(object):
+    # Percentiles reported
+    POINTS = (50, 90, 99)
+
+    def __init__(self, history=1000):
+        # Generation -> last pauses (in s)
+        self.pauses = [deque(maxlen=history) for _ in range(len(gc.get_count()))]
+        # Generation -> amount of collections and their total time (in s)
+        self.counts = [0] * len(self.pauses)
+        self.totals = [0.0] * len(self.pauses)
+        # Amount of objects moved into the permanent generation by the last freeze
+        self.frozen = 0
+        self._start = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1} collections, {2} frozen>".format(self.__class__.__name__, sum(self.counts), self.frozen)
+
+    # Starts measuring
+    def install(self):
+        if self.callback not in gc.callbacks:
+            gc.callbacks.append(self.callback)
+
+    # Stops measuring
+    def uninstall(self):
+        if self.callback in gc.callbacks:
+            gc.callbacks.remove(self.callback)
+
+    # Called by the collector, with phase "start" or "stop". Collections never
+    # overlap, as they hold the GIL from start to stop
+    def callback(self, phase, info):
+        if phase == "start":
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            pause = time.perf_counter() - self._start
+            self._start = None
+            generation = info["generation"]
+            with self._lock:
+                self.pauses[generation].append(pause)
+                self.counts[generation] += 1
+                self.totals[generation] += pause
+
+    # Forgets the measurements so far
+    def reset(self):
+        with self._lock:
+            for pauses in self.pauses:
+                pauses.clear()
+            self.counts = [0] * len(self.pauses)
+            self.totals = [0.0] * len(self.pauses)
+
+    # Returns the percentiles (in s) of the last pauses of a generation, or of
+    # all of them if none is given, as a dict of percentile -> pause
+    def percentiles(self, generation=None):
+        with self._lock:
+            if generation is None:
+                values = [pause for pauses in self.pauses for pause in pauses]
+            else:
+                values = list(self.pauses[generation])
+        values.sort()
+        return {p: percentile(values, p) for p in GCMonitor.POINTS + (100,)}
+
+    # Returns the measurements as a dict, ready to be logged or exported
+    def metrics(self):
+        metrics = {"frozen": self.frozen, "permanent": gc.get_freeze_count(), "pending": gc.get_count()}
+        for generation in range(len(self.pauses)):
+            points = self.percentiles(generation)
+            metrics["gen{}".format(generation)] = {
+                "collections": self.counts[generation],
+                "total_ms": self.totals[generation] * 1000,
+                "p50_ms": points[50] * 1000,
+                "p90_ms": points[90] * 1000,
+                "p99_ms": points[99] * 1000,
+                "max_ms": points[100] * 1000,
+            }
+        return metrics
+
+    # Returns a line of text per generation with its collections and pauses
+    def summary(self):
+        lines = []
+        for generation in range(len(self.pauses)):
+            points = self.percentiles(generation)
+            lines.append("gen{}: {} collections, {:.1f} ms total, p50 {:.2f} ms, p90 {:.2f} ms, "
+                         "p99 {:.2f} ms, max {:.2f} ms".format(
+                             generation, self.counts[generation], self.totals[generation] * 1000,
+                             points[50] * 1000, points[90] * 1000, points[99] * 1000, points[100] * 1000))
+        if gc.get_freeze_count() > 0:
+            lines.append("{} objects frozen out of the collector".format(gc.get_freeze_count()))
+        return lines
+
+    # Collects the young generations, and moves every object still alive into
+    # the permanent generation, which the collector never scans. Objects there
+    # are still freed by reference counting, as vocabularies have no reference
+    # cycles; only garbage cycles among them would never be reclaimed. Returns
+    # the amount of objects frozen
+    def freeze(self):
+        gc.collect(1)
+        before = gc.get_freeze_count()
+        gc.freeze()
+        self.frozen = gc.get_freeze_count() - before
+        return self.frozen
+
+    # Moves every frozen object back under the collector, collects all the
+    # generations, and freezes what's still alive again. Any object frozen by
+    # chance while it was in use (an update, a batch) and left behind in a
+    # garbage cycle is reclaimed then, so they don't pile up with uptime. It
+    # takes as long as a full collection. Returns the amount of objects frozen
+    def refreeze(self):
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        self.frozen = gc.get_freeze_count()
+        return self.frozen
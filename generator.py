@@ -2,6 +2,20 @@
 
 import random
 import json
+import re
+import sys
+from array import array
+from ast import literal_eval
+from bisect import bisect_left
+from jsonstream import JSONStream
+from tracing import span
+
+numpyError = None
+try:
+    import numpy
+except ImportError as e:
+    numpy = None
+    numpyError = e
 
 
 # This splits strings into lists of words delimited by space.
@@ -24,17 +38,38 @@ def rewrite(text):
 
 
 # This gives a dictionary key from 2 words, ignoring case
+# (the legacy, order 2, vocabulary format)
 def getkey(w1, w2):
     key = (w1.strip().casefold(), w2.strip().casefold())
     return str(key)
 
 
-# This turns a dictionary key back into 2 separate words
+# This turns a legacy dictionary key back into 2 separate words
 def getwords(key):
-    words = key.strip('()').split(', ')
-    for i in range(len(words)):
-        words[i].strip('\'')
-    return words
+    # Keys are the repr() of a tuple of 2 strings; without quotes or escapes
+    # inside the words they can be split directly, which is much faster
+    if key.startswith("('") and key.endswith("')") and '\\' not in key:
+        words = key[2:-2].split("', '")
+        if len(words) == 2:
+            return words
+    return list(literal_eval(key))
+
+
+# This gives the key of a single word in a context, ignoring case.
+# Keys are interned, so every context sharing a word shares its string
+def wordkey(word):
+    return sys.intern(word.strip().casefold())
+
+
+# Runs of letters and digits of a word, the only part that counts when looking
+# for the words of a message in the vocabulary (see Generator.seeds)
+SEED_WORD = re.compile(r'\w+')
+
+
+# This gives the normalized form of a word for the seed index, ignoring case,
+# punctuation and emoji, or an empty string if nothing is left
+def seedkey(word):
+    return "".join(SEED_WORD.findall(word.casefold()))
 
 
 # Generates triplets of words from the given data string. So if our string
@@ -48,6 +83,374 @@ def triplets(wordlist):
         yield (wordlist[i], wordlist[i+1], wordlist[i+2])
 
 
+# This is a node of the context trie (see Generator below). Nodes at the
+# deepest level are stored as plain lists of following words instead, as
+# they have no children
+class Node(object):
+    __slots__ = ("children", "words", "total")
+
+    def __init__(self, children=None, words=None):
+        # Next context word (key) -> Node or list of following words
+        self.children = children
+        # Words that follow this exact context, if learned at this depth
+        self.words = words
+        # Number of following words in this node and all of its children
+        self.total = count(words) + sum(count(c) for c in children.values()) if children else count(words)
+
+    # Shallow dict form of the node, for JSON dumps. Own words are kept under
+    # a " " key, which can never be a word key as keys are stripped
+    def as_dict(self):
+        d = dict(self.children) if self.children else {}
+        if self.words:
+            d[" "] = self.words
+        return d
+
+    # Creates a Node from its dict form
+    def from_dict(d):
+        words = d.pop(" ", None)
+        return Node(children=(d if len(d) > 0 else None), words=words)
+
+
+# Turns a dict decoded from a vocabulary dump into a trie Node, as a JSON
+# object_hook (innermost first), interning keys and words so equal ones
+# share their strings
+def interned_node(d):
+    words = d.pop(" ", None)
+    children = {sys.intern(key): ([sys.intern(w) for w in value] if isinstance(value, list) else value)
+                for key, value in d.items()}
+    return Node(children=(children if len(children) > 0 else None),
+                words=([sys.intern(w) for w in words] if words else None))
+
+
+# Number of following words stored in a trie node or leaf
+def count(value):
+    if value is None:
+        return 0
+    elif isinstance(value, Node):
+        return value.total
+    return len(value)
+
+
+# Picks a random following word from a trie node or leaf, with each stored
+# word equally likely, as if all of them were in a single list
+def sample(value):
+    while isinstance(value, Node):
+        r = random.randrange(value.total)
+        if value.words:
+            if r < len(value.words):
+                return value.words[r]
+            r -= len(value.words)
+        for child in value.children.values():
+            c = count(child)
+            if r < c:
+                value = child
+                break
+            r -= c
+    return random.choice(value)
+
+
+# Returns all the following words stored in a trie node or leaf, in the same
+# order that sample() counts them
+def flatten(value):
+    if not isinstance(value, Node):
+        return list(value)
+    words = list(value.words) if value.words else []
+    if value.children:
+        for child in value.children.values():
+            words.extend(flatten(child))
+    return words
+
+
+# This is an integer-encoded snapshot of a Generator's chain, for generating
+# many messages at once. Each state is a context as found by Generator.lookup(),
+# and its following words are laid out in CSR form: the words of state s are
+# word_ids[indptr[s]:indptr[s+1]], and next_ids holds the state reached after
+# each of them (or -1 if there's none). Only states reachable from the start
+# of a message are included. A frozen Generator's table is built straight from
+# its FrozenChain, without thawing it. Requires NumPy
+class TransitionTable(object):
+    # Size of a reference in the word list
+    POINTER_BYTES = 8
+
+    def __init__(self, gen):
+        # Word ID -> word. The END marker is always ID 0
+        self.words = [Generator.END]
+        word_ids = {Generator.END: 0}
+        # Context (tuple of keys) -> state ID
+        states = {}
+        indptr = [0]
+        succ_words = []
+        succ_next = []
+        if gen.frozen is not None:
+            lookup_depth = gen.frozen.lookup_depth
+            following = gen.frozen.following
+        else:
+            lookup_depth = gen.lookup_depth
+            following = flatten
+
+        def state_of(context):
+            node, depth = lookup_depth(context)
+            if node is None:
+                return -1
+            key = tuple(context[len(context) - depth:])
+            state = states.get(key)
+            if state is None:
+                words = following(node)
+                if len(words) == 0:
+                    return -1
+                state = states[key] = len(states)
+                queue.append((key, words))
+            return state
+
+        queue = []
+        self.start = state_of([Generator.HEAD_KEY] * gen.order)
+        i = 0
+        while i < len(queue):
+            key, words = queue[i]
+            i += 1
+            for word in words:
+                word_id = word_ids.get(word)
+                if word_id is None:
+                    word_id = word_ids[word] = len(self.words)
+                    self.words.append(word)
+                succ_words.append(word_id)
+                if word_id == 0:
+                    succ_next.append(-1)
+                else:
+                    succ_next.append(state_of(list(key) + [wordkey(word)]))
+            indptr.append(len(succ_words))
+
+        self.states = len(queue)
+        self.indptr = numpy.array(indptr, dtype=numpy.int64)
+        self.word_ids = numpy.array(succ_words, dtype=numpy.int32)
+        self.next_ids = numpy.array(succ_next, dtype=numpy.int32)
+
+    def __repr__(self):
+        return "<{0} {1} states, {2} transitions, {3} words>".format(
+            self.__class__.__name__, self.states, len(self.word_ids), len(self.words))
+
+    # Memory (in bytes) taken by the table's arrays and word list
+    def size(self):
+        return (self.indptr.nbytes + self.word_ids.nbytes + self.next_ids.nbytes
+                + len(self.words) * TransitionTable.POINTER_BYTES)
+
+    # Generates n messages as lists of word IDs, drawing the random numbers of
+    # all the messages at each step in bulk
+    def sample_ids(self, n, size=50, seed=None):
+        rng = numpy.random.default_rng(seed)
+        messages = numpy.full((n, size), -1, dtype=numpy.int32)
+        if self.start < 0:
+            return messages
+        state = numpy.full(n, self.start, dtype=numpy.int64)
+        alive = numpy.arange(n)
+        for step in range(size):
+            if len(alive) == 0:
+                break
+            current = state[alive]
+            low = self.indptr[current]
+            amount = self.indptr[current + 1] - low
+            picks = low + (rng.random(len(alive)) * amount).astype(numpy.int64)
+            words = self.word_ids[picks]
+            going = words != 0
+            alive = alive[going]
+            messages[alive, step] = words[going]
+            following = self.next_ids[picks][going]
+            state[alive] = following
+            # Messages whose last word has nothing to follow it stop here
+            alive = alive[following >= 0]
+        return messages
+
+    # Generates n messages, like Generator.generate() does for one
+    def generate_many(self, n, size=50, silence=False, seed=None):
+        words = self.words
+        if silence:
+            words = [w.replace("@", "(@)") if w.startswith("@") and len(w) > 1 else w for w in words]
+        messages = []
+        for row in self.sample_ids(n, size, seed).tolist():
+            gen_words = []
+            for word_id in row:
+                if word_id < 0:
+                    break
+                gen_words.append(words[word_id])
+            messages.append(' '.join(gen_words))
+        return messages
+
+
+# This is a compact, read-only form of a Generator's trie, for chats that are
+# idle. Nodes are numbered in preorder, and the following words of every node's
+# subtree are laid out contiguously in word_ids (its own words first, then its
+# children's in order), so a node's words are word_ids[span_start[i]:span_end[i]]
+# and sampling one of them takes a single random index. Each node's children are
+# child_keys[child_ptr[i]:child_ptr[i+1]] (sorted key IDs), with their node
+# indices in child_nodes. Keys and words are kept once, in plain lists
+class FrozenChain(object):
+    # Typecode of the index arrays (unsigned 32-bit integers)
+    TYPECODE = "I"
+    # Size of a reference in the key and word lists
+    POINTER_BYTES = 8
+    # Approximate size of an entry in the key index
+    KEY_INDEX_BYTES = 64
+
+    def __init__(self, root):
+        # Key ID -> key, and key -> key ID
+        self.keys = []
+        self.key_ids = {}
+        # Word ID -> word
+        self.words = []
+        word_index = {}
+        # Built as lists, which are faster to grow, and packed into arrays below
+        word_ids = []
+        span_start = []
+        own_end = []
+        # Node index -> list of (key ID, child node index)
+        rows = []
+
+        # Depth-first, in preorder, with each node's children in key ID order
+        stack = [(root, -1, 0)]
+        while len(stack) > 0:
+            value, parent, key_id = stack.pop()
+            i = len(rows)
+            if parent >= 0:
+                rows[parent].append((key_id, i))
+            rows.append([])
+            span_start.append(len(word_ids))
+            node = isinstance(value, Node)
+            for word in (value.words if node else value) or ():
+                word_id = word_index.get(word)
+                if word_id is None:
+                    word_id = word_index[word] = len(self.words)
+                    self.words.append(word)
+                word_ids.append(word_id)
+            own_end.append(len(word_ids))
+            if node and value.children:
+                children = []
+                for key, child in value.children.items():
+                    child_id = self.key_ids.get(key)
+                    if child_id is None:
+                        child_id = self.key_ids[key] = len(self.keys)
+                        self.keys.append(key)
+                    children.append((child_id, child))
+                # Pushed in reverse, so they're visited in order
+                children.sort(key=lambda c: c[0], reverse=True)
+                stack.extend((child, i, child_id) for child_id, child in children)
+
+        # A subtree ends where its last child's subtree does
+        span_end = own_end
+        for i in range(len(rows) - 1, -1, -1):
+            if len(rows[i]) > 0:
+                span_end[i] = span_end[rows[i][-1][1]]
+
+        child_ptr = [0]
+        child_keys = []
+        child_nodes = []
+        for row in rows:
+            for key_id, child in row:
+                child_keys.append(key_id)
+                child_nodes.append(child)
+            child_ptr.append(len(child_keys))
+        typecode = FrozenChain.TYPECODE
+        self.word_ids = array(typecode, word_ids)
+        self.span_start = array(typecode, span_start)
+        self.span_end = array(typecode, span_end)
+        self.child_ptr = array(typecode, child_ptr)
+        self.child_keys = array(typecode, child_keys)
+        self.child_nodes = array(typecode, child_nodes)
+        # Payload of the key and word strings, each counted once (words equal
+        # to a key are the same interned string)
+        self.string_bytes = (sum(sys.getsizeof(key) for key in self.keys)
+                             + sum(sys.getsizeof(word) for word in self.words if word not in self.key_ids))
+
+    def __repr__(self):
+        return "<{0} {1} nodes, {2} transitions, {3} words>".format(
+            self.__class__.__name__, len(self.span_start), self.total(), len(self.words))
+
+    # Number of following words stored
+    def total(self):
+        return self.span_end[0] - self.span_start[0]
+
+    # Memory (in bytes) taken by the arrays, the key and word lists, the key
+    # index and the strings themselves
+    def size(self):
+        arrays = (self.word_ids, self.span_start, self.span_end,
+                  self.child_ptr, self.child_keys, self.child_nodes)
+        return (sum(a.itemsize * len(a) for a in arrays)
+                + (len(self.keys) + len(self.words)) * FrozenChain.POINTER_BYTES
+                + len(self.key_ids) * FrozenChain.KEY_INDEX_BYTES
+                + self.string_bytes)
+
+    # Returns the node index of the longest known suffix of a context (a list of
+    # keys, oldest first), or None if not even its last word is known
+    def lookup(self, context):
+        return self.lookup_depth(context)[0]
+
+    # Like lookup(), but also returns how many of the context's last words were found
+    def lookup_depth(self, context):
+        node = 0
+        found = None
+        depth = 0
+        for i in range(1, len(context) + 1):
+            key = self.key_ids.get(context[-i])
+            if key is None:
+                break
+            low = self.child_ptr[node]
+            high = self.child_ptr[node + 1]
+            j = bisect_left(self.child_keys, key, low, high)
+            if j == high or self.child_keys[j] != key:
+                break
+            node = found = self.child_nodes[j]
+            depth = i
+        return (found, depth)
+
+    # Returns all the following words of a node, like flatten() for a trie node
+    def following(self, node):
+        words = self.words
+        return [words[w] for w in self.word_ids[self.span_start[node]:self.span_end[node]]]
+
+    # Picks a random word to follow a context, like Generator.next_word()
+    def next_word(self, context):
+        node = self.lookup(context)
+        if node is None or self.span_end[node] == self.span_start[node]:
+            return None
+        return self.words[self.word_ids[random.randrange(self.span_start[node], self.span_end[node])]]
+
+    # Number of words following the contexts whose most recent word is a key
+    def followers(self, key):
+        node = self.lookup([key])
+        return 0 if node is None else self.span_end[node] - self.span_start[node]
+
+    # Returns the keys of the root's children: the most recent words of every context
+    def root_keys(self):
+        return [self.keys[k] for k in self.child_keys[self.child_ptr[0]:self.child_ptr[1]]]
+
+    # Rebuilds the trie, returning its root Node
+    def thaw(self):
+        # Plain lists are faster to index than arrays
+        keys = self.keys
+        words = [self.words[w] for w in self.word_ids]
+        span_start = self.span_start.tolist()
+        span_end = self.span_end.tolist()
+        child_ptr = self.child_ptr.tolist()
+        child_keys = [keys[k] for k in self.child_keys]
+        child_nodes = self.child_nodes.tolist()
+
+        # Children always come after their parent, so they're built first
+        built = [None] * len(span_start)
+        for i in range(len(built) - 1, -1, -1):
+            first = child_ptr[i]
+            last = child_ptr[i + 1]
+            if first == last:
+                built[i] = words[span_start[i]:span_end[i]]
+                continue
+            own = words[span_start[i]:span_start[child_nodes[first]]]
+            node = Node(words=(own if len(own) > 0 else None))
+            node.children = {child_keys[j]: built[child_nodes[j]] for j in range(first, last)}
+            # The subtree's words are contiguous, so there's no need to add them up
+            node.total = span_end[i] - span_start[i]
+            built[i] = node
+        root = built[0]
+        return root if isinstance(root, Node) else Node(words=(root if len(root) > 0 else None))
+
+
 class Generator(object):
     # Marks when we want to create a Generator object from a given JSON
     MODE_JSON = "MODE_JSON"
@@ -66,112 +469,671 @@ class Generator(object):
     # Marks the end of a message
     TAIL = " ^MESSAGE_SEPARATOR^"
 
-    def __init__(self, load=None, mode=None):
+    # The end of a message, as it is stored after a message's last word
+    END = TAIL.strip()
+    # The context key of the beginning of a message
+    HEAD_KEY = wordkey(HEAD)
+
+    # Default and allowed number of previous words used to pick the next one
+    ORDER = 2
+    MIN_ORDER = 1
+    MAX_ORDER = 4
+
+    # Version of the vocabulary dump format (legacy dumps have none)
+    VERSION = 3
+
+    # Media messages are learned as a tag followed by the media's file ID (see
+    # Reader.TAG_PREFIX). File IDs are long, so each one is stored once in a
+    # media table and the chain holds a short reference to it instead
+    MEDIA_TAG_PREFIX = "^is_"
+    MEDIA_REF = "^#{}^"
+
+    # Times the word after a reply's seed is drawn again when it ends the
+    # message, before going on from the start of a message instead (see generate)
+    SEED_TRIES = 5
+
+    # Approximate memory (in bytes) taken by each context with words stored,
+    # each stored word, and each inner trie node, for size estimations. The
+    # key and word strings are counted apart (see string_size()). Fitted to
+    # what tracemalloc measures (see benchmarks/bench_generator.py)
+    KEY_BYTES = 87
+    WORD_BYTES = 10
+    NODE_BYTES = 233
+    MEDIA_BYTES = 150
+    # Approximate memory (in bytes) taken by each entry of the seed index
+    INDEX_BYTES = 90
+
+    # Decoder for the parts of a dump loaded incrementally (see load_stream)
+    STREAM_DECODER = json.JSONDecoder(object_hook=interned_node)
+
+    # The vocabulary is a trie of contexts: the path from the root follows the
+    # previous words from the most recent one backwards, so the node at depth k
+    # holds the words that followed that k-word context. Contexts sharing their
+    # last words share their nodes and key strings.
+    # Words are only stored at the deepest level (the order), and a shallower
+    # context is equivalent to all the words below its node. That allows backing
+    # off to a shorter context when a longer one was never seen.
+    def __init__(self, load=None, mode=None, order=ORDER):
+        if order < Generator.MIN_ORDER or order > Generator.MAX_ORDER:
+            raise ValueError("Generator order must be between {} and {}.".format(
+                Generator.MIN_ORDER, Generator.MAX_ORDER))
+        self.order = order
+        self.root = Node()
+        # Running counters of the vocabulary: messages learned, contexts with
+        # words stored (keys) and inner trie nodes. The number of stored words
+        # (transitions) is the root's total
+        self.messages = 0
+        self.keys = 0
+        self.nodes = 0
+        # Running estimate of the payload of the key and word strings (see
+        # string_size()), which are interned and shared across the trie
+        self.string_bytes = 0
+        # Media file IDs by reference number, and reference numbers by file ID
+        self.media = []
+        self.media_refs = {}
+        # Integer-encoded transition table, built on demand (see transitions())
+        self.table = None
+        # Seed index, built on demand and kept up to date after that (see
+        # seed_index()), and the amount of keys in it
+        self.index = None
+        self.indexed = 0
+        # Compact form of the trie while the Generator is frozen (see freeze()),
+        # in which case root is None
+        self.frozen = None
         if mode is not None:
             if mode == Generator.MODE_JSON:
-                self.cache = json.loads(load)
+                self.load_json(load)
             elif mode == Generator.MODE_LIST:
-                self.cache = {}
                 self.load_list(load)
             elif mode == Generator.MODE_DICT:
-                self.cache = load
+                self.load_dict(load)
             # TODO: Chat History mode
-        else:
-            self.cache = {}
 
     # Loads a text divided into a list of lines
     def load_list(self, many):
         for one in many:
             self.add(one)
 
-    # Dumps the cache dictionary into a JSON-formatted string
+    # Loads a JSON-formatted string, in either the current or the legacy format
+    def load_json(self, dump):
+        if dump.startswith('{"VERSION"'):
+            self.load_dict(json.loads(dump, object_hook=Generator.object_hook))
+        else:
+            self.load_dict(json.loads(dump))
+
+    # Turns every dict in a current format dump into a trie Node as it's parsed
+    # (innermost first), except for the top level one
+    def object_hook(d):
+        if "CHAIN" in d and "VERSION" in d:
+            return d
+        return Node.from_dict(d)
+
+    # Loads a dictionary, in either the current or the legacy format
+    def load_dict(self, d):
+        if "CHAIN" in d and "VERSION" in d:
+            chain = d["CHAIN"]
+            self.root = chain if isinstance(chain, Node) else Generator.from_plain(chain)
+            self.messages = d.get("MESSAGES", 0)
+            self.recount()
+            media = d.get("MEDIA")
+        else:
+            self.load_legacy(d)
+            media = None
+        self.load_media(media)
+
+    # Loads the media table, or builds it from the chain if the dump has none
+    def load_media(self, media):
+        if media is None:
+            # Dumps from before the media table have the file IDs in the chain
+            self.migrate_media()
+        else:
+            self.media = [sys.intern(file_id) for file_id in media]
+            self.media_refs = {file_id: i for i, file_id in enumerate(self.media)}
+
+    # Loads a JSON-formatted text file object, in either the current or the
+    # legacy format, incrementally: each context is parsed straight into the
+    # trie, so the whole dump is never held in memory at once
+    def load_stream(self, f):
+        stream = JSONStream(f)
+        if stream.peek() == "":
+            # Empty file
+            return
+        media = None
+        current = False
+        for key in stream.keys():
+            if key == "VERSION":
+                current = True
+                stream.value()
+            elif current and key == "CHAIN":
+                self.root = Generator.stream_node(stream)
+            elif current and key == "MESSAGES":
+                self.messages = stream.value()
+            elif current and key == "MEDIA":
+                media = stream.value()
+            elif current:
+                # ORDER, or anything newer
+                stream.value()
+            else:
+                self.load_legacy_leaf(key, stream.value())
+        self.recount()
+        self.load_media(media)
+
+    # Parses the root Node of the trie from a JSON stream, with the same layout
+    # as Node.as_dict(). Each of the root's children (the contexts ending in a
+    # given word) is decoded whole, which is much faster than key by key and
+    # still only holds a small part of the dump at once
+    def stream_node(stream):
+        children = {}
+        words = None
+        for key in stream.keys():
+            value = stream.value(Generator.STREAM_DECODER)
+            if key == " ":
+                words = [sys.intern(w) for w in value]
+            elif isinstance(value, list):
+                children[sys.intern(key)] = [sys.intern(w) for w in value]
+            else:
+                children[sys.intern(key)] = value
+        return Node(children=(children if len(children) > 0 else None), words=words)
+
+    # Converts the nested dicts of a current format dump into trie Nodes
+    def from_plain(d):
+        d = {key: (Generator.from_plain(value) if isinstance(value, dict) else value)
+             for key, value in d.items()}
+        return Node.from_dict(d)
+
+    # Loads a legacy (order 2) dictionary, where each key is a pair of words and
+    # the HEAD key holds the first words of each message
+    def load_legacy(self, cache):
+        for key, words in cache.items():
+            self.load_legacy_leaf(key, words)
+        self.recount()
+
+    # Loads a single key of a legacy dictionary and its list of words.
+    # recount() must be called after loading all of them
+    def load_legacy_leaf(self, key, words):
+        if key == Generator.HEAD:
+            context = (Generator.HEAD_KEY, Generator.HEAD_KEY)
+        else:
+            context = getwords(key)
+        words = [sys.intern(w) for w in words]
+        # Legacy dumps don't keep the count of messages
+        self.messages += words.count(Generator.END)
+        self.insert_leaf(context, words)
+
+    # Stores a list of following words for a context (oldest word first) as a
+    # leaf, merging it with any words already stored for it. Totals are not
+    # updated, so recount() must be called after loading all leaves
+    def insert_leaf(self, context, words):
+        self.thaw()
+        node = self.root
+        depth = len(context)
+        for i, key in enumerate(reversed(context), 1):
+            key = wordkey(key)
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(key)
+            if i == depth:
+                if child is None:
+                    node.children[key] = words
+                elif isinstance(child, Node):
+                    child.words = (child.words or []) + words
+                else:
+                    child.extend(words)
+            else:
+                if child is None:
+                    child = node.children[key] = Node()
+                elif not isinstance(child, Node):
+                    child = node.children[key] = Node(words=child)
+                node = child
+
+    # Recalculates the totals of every node in the trie, and the keys and nodes
+    # counters. Returns the total of stored words
+    def recount(self):
+        self.thaw()
+        # Contexts may have been added in bulk, so the seed index is built again
+        self.index = None
+        self.indexed = 0
+        self.keys = 0
+        self.nodes = 0
+        total = self.recount_node(self.root)
+        self.string_bytes = self.string_size()
+        return total
+
+    # Returns the payload (in bytes) of the distinct key and word strings of
+    # the trie. Every key is a child of the root, and a word only counts if it
+    # isn't a key too, as then they are the same interned string
+    def string_size(self):
+        keys = self.root.children or {}
+        words = set()
+        stack = [self.root]
+        while len(stack) > 0:
+            value = stack.pop()
+            if isinstance(value, Node):
+                if value.words:
+                    words.update(value.words)
+                if value.children:
+                    stack.extend(value.children.values())
+            else:
+                words.update(value)
+        return (sum(sys.getsizeof(key) for key in keys)
+                + sum(sys.getsizeof(word) for word in words if word not in keys))
+
+    def recount_node(self, node):
+        total = count(node.words)
+        if node.words:
+            self.keys += 1
+        if node.children:
+            for child in node.children.values():
+                if isinstance(child, Node):
+                    self.nodes += 1
+                    self.recount_node(child)
+                else:
+                    self.keys += 1
+                total += count(child)
+        node.total = total
+        return total
+
+    # Returns the reference to a media file ID, adding it to the media table if it's new
+    def media_ref(self, file_id):
+        ref = self.media_refs.get(file_id)
+        if ref is None:
+            ref = len(self.media)
+            self.media.append(sys.intern(file_id))
+            self.media_refs[file_id] = ref
+        return Generator.MEDIA_REF.format(ref)
+
+    # Returns the media file ID of a word if it's a media reference, or the word otherwise
+    def resolve(self, word):
+        if word.startswith("^#") and word.endswith("^"):
+            try:
+                return self.media[int(word[2:-1])]
+            except (ValueError, IndexError):
+                pass
+        return word
+
+    # Resolves all the media references in a generated text
+    def resolve_text(self, text):
+        if "^#" not in text:
+            return text
+        return ' '.join(self.resolve(word) for word in text.split(' '))
+
+    # Moves the media file IDs in the chain into the media table. The words
+    # that follow a media tag are file IDs, and a file ID only appears as a key
+    # as the most recent word of a context, as it is the end of its message
+    def migrate_media(self):
+        if not self.root.children:
+            return
+        keys = {}
+        for key, child in self.root.children.items():
+            if key.startswith(Generator.MEDIA_TAG_PREFIX) and key.endswith("^"):
+                for context, words in self.items(child, (key,)) if isinstance(child, Node) else [((key,), child)]:
+                    for i, word in enumerate(words):
+                        ref = self.media_ref(word)
+                        words[i] = sys.intern(ref)
+                        # Keys are casefolded, so casefolded IDs are kept to find them
+                        keys.setdefault(word.casefold(), ref)
+        for key, ref in keys.items():
+            child = self.root.children.pop(key, None)
+            if child is None:
+                continue
+            if ref in self.root.children:
+                # Two file IDs that only differ in case already shared their contexts
+                self.cross_child(ref, child)
+            else:
+                self.root.children[sys.intern(ref)] = child
+        self.recount()
+
+    # Merges a trie node or leaf into the root's child of the given key.
+    # Totals are not updated, so recount() must be called afterwards
+    def cross_child(self, key, child):
+        if isinstance(child, Node):
+            for context, words in self.items(child, (key,)):
+                self.insert_leaf(context, list(words))
+        else:
+            self.insert_leaf((key,), list(child))
+
+    # Returns the vocabulary's running counters, and its approximate size in memory
+    def stats(self):
+        return {"messages": self.messages,
+                "keys": self.keys,
+                "transitions": self.total(),
+                "bytes": self.size()}
+
+    # Number of following words stored (transitions)
+    def total(self):
+        return self.frozen.total() if self.frozen is not None else self.root.total
+
+    # Approximate memory (in bytes) taken by the vocabulary, in its current form
+    def size(self):
+        media = len(self.media) * Generator.MEDIA_BYTES
+        media += self.indexed * Generator.INDEX_BYTES
+        if self.frozen is not None:
+            return self.frozen.size() + media
+        return (self.keys * Generator.KEY_BYTES
+                + self.root.total * Generator.WORD_BYTES
+                + self.nodes * Generator.NODE_BYTES
+                + self.string_bytes
+                + media)
+
+    # Packs the trie into a FrozenChain, which takes a fraction of the memory.
+    # A frozen Generator still generates messages and dumps as usual, and thaws
+    # back into a trie as soon as something else needs it (like learning)
+    def freeze(self):
+        if self.frozen is None:
+            self.frozen = FrozenChain(self.root)
+            self.root = None
+            # The exact payload, as the running one is an estimate
+            self.string_bytes = self.frozen.string_bytes
+            self.table = None
+
+    def thaw(self):
+        if self.frozen is not None:
+            with span("thaw"):
+                self.root = self.frozen.thaw()
+            self.frozen = None
+
+    def is_frozen(self):
+        return self.frozen is not None
+
+    # Returns the trie's root, rebuilding a copy of it if the Generator is frozen
+    def trie(self):
+        return self.frozen.thaw() if self.frozen is not None else self.root
+
+    # Default JSON encoding for trie Nodes
+    def encode(node):
+        return node.as_dict()
+
+    # Dumps the vocabulary into a JSON-formatted string
     def dumps(self):
-        return json.dumps(self.cache, ensure_ascii=False)
+        return json.dumps(self.as_plain(), ensure_ascii=False, default=Generator.encode)
 
-    # Dumps the cache dictionary into a file, formatted as JSON
+    # Dumps the vocabulary into a file, formatted as JSON
     def dump(self, f):
-        json.dump(self.cache, f, ensure_ascii=False)
+        json.dump(self.as_plain(), f, ensure_ascii=False, default=Generator.encode)
 
-    # Loads the cache dictionary from a JSON-formatted string
-    def loads(dump):
+    # Top level of a vocabulary dump
+    def as_plain(self):
+        return {"VERSION": Generator.VERSION, "ORDER": self.order,
+                "MESSAGES": self.messages, "MEDIA": self.media, "CHAIN": self.trie()}
+
+    # Loads the vocabulary from a JSON-formatted string
+    def loads(dump, order=ORDER):
         if len(dump) == 0:
             # faulty dump gives default Generator
-            return Generator()
+            return Generator(order=order)
         # otherwise
-        return Generator(load=dump, mode=Generator.MODE_JSON)
+        return Generator(load=dump, mode=Generator.MODE_JSON, order=order)
+
+    # Loads the vocabulary from a file, formatted as JSON
+    def load(f, order=ORDER):
+        return Generator(load=json.load(f), mode=Generator.MODE_DICT, order=order)
 
-    # Loads the cache dictionary from a file, formatted as JSON
-    def load(f):
-        return Generator(load=json.load(f), mode=Generator.MODE_DICT)
+    # Loads the vocabulary from a file, formatted as JSON, incrementally (see load_stream)
+    def load_incremental(f, order=ORDER):
+        gen = Generator(order=order)
+        gen.load_stream(f)
+        return gen
 
     def add(self, text):
-        words = [Generator.HEAD]
         text = rewrite(text + Generator.TAIL)
-        words.extend(text)
-        self.database(words)
+        self.database(text)
 
-    # This takes a list of words and stores it in the cache, adding
-    # a special entry for the first word (the HEAD marker)
+    # This takes a list of words (ending with the END marker) and stores each one
+    # as following the previous `order` words, starting from HEAD markers
     def database(self, words):
-        for w1, w2, w3 in triplets(words):
-            if w1 == Generator.HEAD:
-                if w1 in self.cache:
-                    self.cache[Generator.HEAD].append(w2)
+        if len(words) < 2:
+            # Nothing but the END marker
+            return
+        self.thaw()
+        self.messages += 1
+        self.table = None
+        context = [Generator.HEAD_KEY] * self.order
+        for word in words:
+            word = sys.intern(word)
+            self.insert(context, word)
+            key = wordkey(word)
+            # A word that isn't its own key is a string of its own, counted the
+            # first time its key is seen (other spellings of it are not counted)
+            if key is not word and key not in self.root.children:
+                self.string_bytes += sys.getsizeof(word)
+            context.append(key)
+            del context[0]
+
+    # Stores a word as following a context (a list of keys, oldest first)
+    def insert(self, context, word):
+        node = self.root
+        node.total += 1
+        depth = len(context)
+        for i in range(1, depth + 1):
+            key = context[-i]
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(key)
+            if i == depth:
+                if child is None:
+                    node.children[key] = [word]
+                    self.keys += 1
+                    if i == 1:
+                        self.string_bytes += sys.getsizeof(key)
+                        if self.index is not None:
+                            self.index_key(key)
+                elif isinstance(child, Node):
+                    if child.words is None:
+                        child.words = []
+                        self.keys += 1
+                    child.words.append(word)
+                    child.total += 1
                 else:
-                    self.cache[Generator.HEAD] = [w2]
-            key = getkey(w1, w2)
-            if key in self.cache:
-                # if the key exists, add the new word to the end of the chain
-                self.cache[key].append(w3)
+                    child.append(word)
             else:
-                # otherwise, create a new entry for the new key starting with
-                # the new end of chain
-                self.cache[key] = [w3]
+                if child is None:
+                    child = node.children[key] = Node()
+                    self.nodes += 1
+                    if i == 1:
+                        self.string_bytes += sys.getsizeof(key)
+                        if self.index is not None:
+                            self.index_key(key)
+                elif not isinstance(child, Node):
+                    # A leaf loaded from a lower order dump gets deeper contexts
+                    child = node.children[key] = Node(words=child)
+                    self.nodes += 1
+                child.total += 1
+                node = child
+
+    # Returns the trie node or leaf of the longest known suffix of a context
+    # (a list of keys, oldest first), or None if not even its last word is known
+    def lookup(self, context):
+        return self.lookup_depth(context)[0]
+
+    # Like lookup(), but also returns how many of the context's last words were found
+    def lookup_depth(self, context):
+        self.thaw()
+        node = self.root
+        found = None
+        depth = 0
+        for i in range(1, len(context) + 1):
+            if not isinstance(node, Node) or node.children is None:
+                break
+            node = node.children.get(context[-i])
+            if node is None:
+                break
+            found = node
+            depth = i
+        return (found, depth)
+
+    # Picks a random word to follow a context, backing off to shorter contexts
+    # if the whole one is unknown. Returns None if there's nothing to follow it
+    def next_word(self, context):
+        node = self.lookup(context)
+        if node is None or count(node) == 0:
+            return None
+        return sample(node)
+
+    # Returns the integer-encoded transition table of the chain, building it
+    # if the vocabulary changed since it was last built
+    def transitions(self):
+        if self.table is None:
+            with span("build_table"):
+                self.table = TransitionTable(self)
+        return self.table
+
+    # Generates n messages at once, with the same rules as generate(). With
+    # NumPy, all of them advance together over the transition table; without
+    # it, they're generated one by one. Media references are resolved back
+    # into file IDs, as in Reader.generate_message, so they're ready to be sent
+    def generate_many(self, n, size=50, silence=False, seed=None):
+        if self.total() == 0:
+            return [""] * n
+        if numpy is None:
+            texts = [self.generate(size, silence) for i in range(n)]
+        else:
+            texts = self.transitions().generate_many(n, size, silence, seed)
+        return [self.resolve_text(text) for text in texts]
 
     # This generates the Markov text/word chain
     # silence=True disables Telegram user mentions
-    def generate(self, size=50, silence=False):
-        if len(self.cache) == 0:
+    # If given a seed text (like the message being replied to), it starts from
+    # one of its words instead, if the chain knows any (see pick_seed)
+    def generate(self, size=50, silence=False, seed=None):
+        if self.total() == 0:
             # If there is nothing in the cache we cannot generate anything
             return ""
+        # A frozen Generator picks words straight from its compact form
+        next_word = self.frozen.next_word if self.frozen is not None else self.next_word
 
-        # Start with a message HEAD and a random message starting word
-        w1 = random.choice(self.cache[Generator.HEAD])
-        w2 = random.choice(self.cache[getkey(Generator.HEAD, w1)])
+        # Start with message HEADs, so the first word is a message starting word
+        context = [Generator.HEAD_KEY] * self.order
+        # ...or with the seed word, which is then followed as if it started a
+        # message (backing off to whatever followed it anywhere, if none did)
+        start = self.pick_seed(seed) if seed else None
         gen_words = []
         # As long as we don't go over the max. message length (in n. of words)...
         for i in range(size):
-            if silence and w1.startswith("@") and len(w1) > 1:
-                # ...append word 1, disabling any possible Telegram mention
-                gen_words.append(w1.replace("@", "(@)"))
+            if i == 0 and start is not None:
+                word = start[0]
             else:
-                # ..append word 1
-                gen_words.append(w1)
-            if w2 == Generator.TAIL or not getkey(w1, w2) in self.cache:
-                # When there's no key from the last 2 words to follow the chain,
-                # or we reached a separation between messages, stop
+                word = next_word(context)
+                if i == 1 and start is not None and (word is None or word == Generator.END):
+                    # The seed alone is no reply, so it goes on past it
+                    word = self.past_seed(next_word, context)
+            if word is None or word == Generator.END:
+                # When there's nothing to follow the chain, or we reached a
+                # separation between messages, stop
                 break
+            if silence and word.startswith("@") and len(word) > 1:
+                # ...append the word, disabling any possible Telegram mention
+                gen_words.append(word.replace("@", "(@)"))
             else:
-                # Get a random third word that follows the chain of words 1
-                # and 2, then make words 2 and 3 to be the new words 1 and 2
-                w1, w2 = w2, random.choice(self.cache[getkey(w1, w2)])
+                # ..append the word
+                gen_words.append(word)
+            context.append(wordkey(word))
+            del context[0]
         return ' '.join(gen_words)
 
-    # Cross a second Generator into this one
-    def cross(self, gen):
-        for key in gen.cache:
-            if key in self.cache:
-                self.cache[key].extend(gen.cache[key])
+    # Returns a word to follow a reply's seed with, other than the end of the
+    # message: one that followed the seed, if any did within SEED_TRIES draws,
+    # or else the first word of a message
+    def past_seed(self, next_word, context):
+        for attempt in range(Generator.SEED_TRIES):
+            word = next_word(context)
+            if word is not None and word != Generator.END:
+                return word
+        return next_word([Generator.HEAD_KEY] * self.order)
+
+    # Returns the seed index: normalized word (see seedkey) -> list of the keys
+    # of the contexts whose most recent word it is (the root's children in the
+    # trie), like "hello" -> ["hello", "hello,", "hello!"]. It's built on the
+    # first call, and kept up to date as new words are learned (see insert), so
+    # finding the words of a text in the chain never goes through every key
+    def seed_index(self):
+        if self.index is None:
+            self.index = {}
+            self.indexed = 0
+            if self.frozen is not None:
+                keys = self.frozen.root_keys()
             else:
-                self.cache[key] = list(gen.cache[key])
+                keys = self.root.children or ()
+            for key in keys:
+                self.index_key(key)
+        return self.index
+
+    # Adds a key to the seed index. Message separators and media references
+    # (which start with "^") are left out
+    def index_key(self, key):
+        if key.startswith("^"):
+            return
+        norm = seedkey(key)
+        if len(norm) > 0:
+            self.index.setdefault(norm, []).append(key)
+            self.indexed += 1
+
+    # Number of words following the contexts whose most recent word is a key
+    def followers(self, key):
+        if self.frozen is not None:
+            return self.frozen.followers(key)
+        return count(self.root.children.get(key)) if self.root.children else 0
+
+    # Returns the keys of the contexts that end in any of the words of a text,
+    # ignoring case and punctuation, and that have words following them, as a
+    # list of (key, number of following words)
+    def seeds(self, text):
+        index = self.seed_index()
+        seeds = []
+        for norm in set(seedkey(word) for word in rewrite(text)):
+            for key in index.get(norm, ()):
+                followers = self.followers(key)
+                if followers > 0:
+                    seeds.append((key, followers))
+        return seeds
+
+    # Picks a key to start a reply to a text from, among the ones of its words
+    # (see seeds). Words followed by more words are likelier, as they have
+    # more to go on with: favoring rare ones picked the words that end
+    # messages, and the reply was often the seed alone. Returns (word, key),
+    # the word as written in the text if it is, or None if the chain knows none
+    def pick_seed(self, text):
+        seeds = self.seeds(text)
+        if len(seeds) == 0:
+            return None
+        key = random.choices([key for key, followers in seeds], [followers for key, followers in seeds])[0]
+        for word in rewrite(text):
+            if wordkey(word) == key:
+                return (word, key)
+        return (key, key)
+
+    # Iterates through every context that has words stored, as a tuple of
+    # (context keys oldest first, list of following words)
+    def items(self, node=None, path=()):
+        node = node or self.trie()
+        if node.words:
+            yield (path, node.words)
+        if node.children:
+            for key, child in node.children.items():
+                if isinstance(child, Node):
+                    yield from self.items(child, (key,) + path)
+                else:
+                    yield ((key,) + path, child)
+
+    # Cross a second Generator into this one, translating its media references
+    def cross(self, gen):
+        def translate(word):
+            resolved = gen.resolve(word)
+            return self.media_ref(resolved) if resolved is not word else word
+
+        for context, words in gen.items():
+            context = tuple(translate(key) for key in context)
+            self.insert_leaf(context, [sys.intern(translate(word)) for word in words])
+        self.messages += gen.messages
+        self.table = None
+        self.recount()
 
     # Count again the number of messages
     # (for whenever the count number is unreliable)
     def new_count(self):
         count = 0
-        for key in self.cache:
-            for word in self.cache[key]:
-                if word == Generator.TAIL:
+        for context, words in self.items():
+            for word in words:
+                if word == Generator.END:
                     # ...by just counting message separators
                     count += 1
         return count
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import re
+
+# Runs of letters and digits, the only part of a message that counts when
+# comparing it against others
+WORDS = re.compile(r'\w+')
+
+
+# Returns a hash of a message that ignores case, punctuation, spacing and
+# emoji, so copies that differ only in those count as the same message, along
+# with its amount of words
+def fingerprint(text):
+    words = WORDS.findall(text.casefold())
+    return hash(" ".join(words)), len(words)
+
+
+# This is a bounded set of recently seen hashes, made of two generations: new
+# hashes go into the current one, and when it's full it replaces the previous
+# one, which is dropped. A hash is remembered for at least `capacity` more
+# insertions, and at most 2 * `capacity` hashes are kept
+class HashWindow(object):
+    # Approximate memory (in bytes) taken by each hash kept
+    HASH_BYTES = 64
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._current = set()
+        self._previous = set()
+
+    def __repr__(self):
+        return "<{0} {1} hashes, capacity {2}>".format(self.__class__.__name__, len(self), self.capacity)
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def __contains__(self, key):
+        return key in self._current or key in self._previous
+
+    # Remembers a hash. Returns True if it was already in the window (and
+    # refreshes it, so a message repeated over and over is never forgotten)
+    def seen(self, key):
+        found = key in self
+        if key not in self._current:
+            if len(self._current) >= self.capacity:
+                self._previous = self._current
+                self._current = set()
+            self._current.add(key)
+        return found
+
+    # Approximate memory (in bytes) taken by the window
+    def size(self):
+        return len(self) * HashWindow.HASH_BYTES
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import json
+import re
+
+# Whitespace allowed between JSON tokens
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+# This is an incremental JSON reader over a text file object. It keeps only a
+# window of the file in memory, and lets the caller walk through objects key by
+# key, decoding each value on its own (see keys() and value()), so a large
+# document never has to be held as a single string
+class JSONStream(object):
+    # Amount of characters read from the file at once
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        # The window of the file read so far but not consumed yet, from pos onwards
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def __repr__(self):
+        return "<{0} {1} buffered>".format(self.__class__.__name__, len(self.buffer) - self.pos)
+
+    # Reads at least `amount` more characters into the window, dropping the
+    # consumed ones. Returns False if the file is over
+    def fill(self, amount=None):
+        chunk = self.file.read(max(amount or 0, self.chunk_size))
+        if len(chunk) == 0:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # Skips whitespace and returns the next character without consuming it, or
+    # an empty string at the end of the file
+    def peek(self):
+        while True:
+            if self.pos < len(self.buffer) and self.buffer[self.pos] not in " \t\n\r":
+                return self.buffer[self.pos]
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    # Consumes the next character, which has to be the given one
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected {!r} at offset {} but found {!r}.".format(char, self.pos, found))
+        self.pos += 1
+
+    # Decodes and returns the next whole value, optionally with another
+    # json.JSONDecoder (to use an object_hook, for example). If it doesn't fit
+    # in the window yet, the window grows until it does
+    def value(self, decoder=None):
+        decoder = decoder or self.decoder
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self.fill(len(self.buffer) - self.pos):
+                    raise
+                continue
+            # A number that ends with the window may go on in the file
+            if end == len(self.buffer) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    # Iterates over the keys of the next object. The caller has to consume each
+    # key's value (with value() or keys()) before asking for the next key
+    def keys(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError("Expected an object key at offset {}.".format(self.pos))
+            key = self.value()
+            self.expect(':')
+            yield key
+            found = self.peek()
+            self.pos += 1
+            if found == '}':
+                return
+            elif found != ',':
+                raise ValueError("Expected ',' or '}}' at offset {} but found {!r}.".format(self.pos - 1, found))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the Telegram Bot API, for load testing the bot without
+# touching Telegram. It serves the methods the bot uses, hands out the updates
+# pushed into it through getUpdates, and records every message the bot sends
+# to measure the latency between an update being delivered and its reply.
+
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+# Returns the value of a percentile (0 to 100) of a sorted list
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class FakeBotAPI(object):
+    # Methods that send a message to a chat
+    SEND_METHODS = ("sendMessage", "sendSticker", "sendAnimation", "sendVideo")
+
+    def __init__(self, username="Welaskobot", rate_limit_chance=0.0, retry_after=1):
+        # The bot's username, as returned by getMe
+        self.username = username
+        # Chance of answering a send method with a 429 error
+        self.rate_limit_chance = rate_limit_chance
+        # The retry_after value (in s) of the 429 errors
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._new_updates = threading.Condition(self._lock)
+        # Updates not yet acknowledged by the bot, oldest first
+        self._updates = deque()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        # Chat ID -> deque of (message ID, delivery timestamp) awaiting a reply
+        self._awaiting = {}
+        # Message ID -> delivery timestamp, for replies to a specific message
+        self._delivered = {}
+
+        # Metrics
+        self.pushed = 0
+        self.delivered = 0
+        self.sent = 0
+        self.rate_limited = 0
+        self.unknown_calls = 0
+        self.calls = {}
+        self.latencies = []
+        self.started = None
+        self.server = None
+        self.stopped = False
+
+    # Starts serving in a background thread. Returns the base URL for the bot
+    def start(self, host="127.0.0.1", port=0):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.handle_call()
+
+            def do_POST(self):
+                self.handle_call()
+
+            def handle_call(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > 0:
+                    body = self.rfile.read(length)
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body.decode("utf-8")))
+                status, response = api.call(method, params)
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fakeapi", daemon=True).start()
+        self.started = time.perf_counter()
+        return "http://{}:{}/bot".format(*self.server.server_address)
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        with self._lock:
+            self.stopped = True
+            self._new_updates.notify_all()
+
+    # Queues an update (without its update_id) to be handed to the bot
+    def push(self, update):
+        with self._lock:
+            update = dict(update, update_id=self._next_update_id)
+            self._next_update_id += 1
+            self._updates.append(update)
+            self.pushed += 1
+            self._new_updates.notify_all()
+        return update["update_id"]
+
+    # Returns a new message ID, unique across all chats
+    def message_id(self):
+        with self._lock:
+            mid = self._next_message_id
+            self._next_message_id += 1
+        return mid
+
+    def user(self):
+        return {"id": 1, "is_bot": True, "first_name": self.username, "username": self.username}
+
+    # Handles a Bot API call. Returns the HTTP status and the JSON response
+    def call(self, method, params):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self.get_updates(params)}
+        elif method == "getMe":
+            return 200, {"ok": True, "result": self.user()}
+        elif method in ("deleteWebhook", "setWebhook"):
+            return 200, {"ok": True, "result": True}
+        elif method in FakeBotAPI.SEND_METHODS:
+            return self.send(method, params)
+        elif method == "getChatMember":
+            member = {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}
+            return 200, {"ok": True, "result": {"user": member, "status": "member"}}
+        elif method == "getChatAdministrators":
+            creator = {"id": 2, "is_bot": False, "first_name": "Owner"}
+            return 200, {"ok": True, "result": [{"user": creator, "status": "creator", "is_anonymous": False}]}
+        with self._lock:
+            self.unknown_calls += 1
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+
+    # Long polling of updates: acknowledges the ones before the offset, and
+    # waits up to the timeout for new ones
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                while len(self._updates) > 0 and self._updates[0]["update_id"] < offset:
+                    self._updates.popleft()
+                if len(self._updates) > 0 or self.stopped:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._new_updates.wait(remaining)
+            updates = [u for u, i in zip(self._updates, range(limit))]
+            now = time.perf_counter()
+            for update in updates:
+                message = update.get("message")
+                if message is None or message["message_id"] in self._delivered:
+                    continue
+                self.delivered += 1
+                self._delivered[message["message_id"]] = now
+                self._awaiting.setdefault(message["chat"]["id"], deque()).append((message["message_id"], now))
+        return updates
+
+    # Records a message sent by the bot, and the latency of the update it answers:
+    # the replied message if it's a reply, or else the last one delivered in the chat
+    def send(self, method, params):
+        if self.rate_limit_chance > 0 and random.random() < self.rate_limit_chance:
+            with self._lock:
+                self.rate_limited += 1
+            return 429, {"ok": False, "error_code": 429,
+                         "description": "Too Many Requests: retry after {}".format(self.retry_after),
+                         "parameters": {"retry_after": self.retry_after}}
+        now = time.perf_counter()
+        cid = int(params["chat_id"])
+        reply_to = params.get("reply_to_message_id")
+        with self._lock:
+            self.sent += 1
+            awaiting = self._awaiting.get(cid)
+            delivered = None
+            if reply_to is not None and int(reply_to) in self._delivered:
+                delivered = self._delivered[int(reply_to)]
+                if awaiting:
+                    # Everything up to the replied message has been handled
+                    while len(awaiting) > 0 and awaiting[0][0] <= int(reply_to):
+                        awaiting.popleft()
+            elif awaiting:
+                delivered = awaiting[-1][1]
+                awaiting.clear()
+            if delivered is not None:
+                self.latencies.append(now - delivered)
+        message = {"message_id": self.message_id(), "date": int(time.time()),
+                   "chat": {"id": cid, "type": "group" if cid < 0 else "private"},
+                   "from": self.user()}
+        if method == "sendMessage":
+            message["text"] = params.get("text", "")
+        return 200, {"ok": True, "result": message}
+
+    # Summary of the metrics so far
+    def report(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.perf_counter() - self.started if self.started else 0
+            sends = self.sent + self.rate_limited
+            return {"elapsed": elapsed,
+                    "pushed": self.pushed,
+                    "delivered": self.delivered,
+                    "sent": self.sent,
+                    "updates_per_s": self.delivered / elapsed if elapsed else 0,
+                    "replies_per_s": self.sent / elapsed if elapsed else 0,
+                    "rate_limited": self.rate_limited,
+                    "rate_limited_ratio": self.rate_limited / sends if sends else 0,
+                    "unknown_calls": self.unknown_calls,
+                    "latency_p50": percentile(latencies, 50),
+                    "latency_p90": percentile(latencies, 90),
+                    "latency_p99": percentile(latencies, 99),
+                    "latency_max": latencies[-1] if latencies else 0,
+                    "calls": dict(self.calls)}
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# End-to-end load test: runs velasco.py against a local fake Bot API (see
+# fakeapi.py), feeds it synthetic or recorded updates at a given rate across
+# many chats, and reports reply latency percentiles, throughput, error rates
+# and the bot's memory use.
+# Usage: python loadtest/loadtest.py [-r RATE] [-t SECONDS] [-c CHATS] [--replay FILE]
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fakeapi import FakeBotAPI
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+# Returns the resident memory (in bytes) of a process, or None if unknown
+def rss(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+# Makes synthetic message updates, with Zipf-like word frequencies, spread over
+# group chats (negative IDs) and private chats (positive IDs)
+class SyntheticStream(object):
+    def __init__(self, api, chats, private=0.2, mention=0.05, sticker=0.05,
+                 vocabulary=2000, username="Welaskobot", seed=0):
+        self.api = api
+        self.rng = random.Random(seed)
+        self.chats = []
+        for i in range(chats):
+            if self.rng.random() < private:
+                self.chats.append({"id": 100000 + i, "type": "private", "first_name": "User{}".format(i)})
+            else:
+                self.chats.append({"id": -100000 - i, "type": "group", "title": "Group {}".format(i)})
+        # Some chats are much busier than others
+        self.weights = [1 / (i + 1) for i in range(chats)]
+        self.words = ["w{}".format(i) for i in range(vocabulary)]
+        self.word_weights = [1 / (i + 1) for i in range(vocabulary)]
+        self.mention = mention
+        self.sticker = sticker
+        self.username = username
+
+    def next(self):
+        chat = self.rng.choices(self.chats, self.weights)[0]
+        uid = self.rng.randint(10, 1000)
+        message = {"message_id": self.api.message_id(), "date": int(time.time()), "chat": chat,
+                   "from": {"id": uid, "is_bot": False, "first_name": "User{}".format(uid)}}
+        roll = self.rng.random()
+        if roll < self.sticker:
+            message["sticker"] = {"file_id": "STICKER{}".format(self.rng.randint(0, 50)),
+                                  "file_unique_id": "U", "width": 512, "height": 512,
+                                  "is_animated": False, "is_video": False, "type": "regular"}
+        else:
+            words = self.rng.choices(self.words, self.word_weights, k=self.rng.randint(1, 15))
+            if roll < self.sticker + self.mention:
+                words.insert(self.rng.randint(0, len(words)), "@" + self.username)
+            message["text"] = ' '.join(words)
+        return {"message": message}
+
+
+# Replays recorded updates (one Update JSON per line, as returned by getUpdates),
+# looping over them, with new message IDs
+class ReplayStream(object):
+    def __init__(self, api, path):
+        self.api = api
+        with open(path, encoding="utf-8") as f:
+            self.updates = [json.loads(line) for line in f if line.strip()]
+        self.updates = [u for u in self.updates if "message" in u]
+        if len(self.updates) == 0:
+            raise ValueError("No message updates to replay in {}".format(path))
+        self.i = 0
+
+    def next(self):
+        update = self.updates[self.i % len(self.updates)]
+        self.i += 1
+        message = dict(update["message"], message_id=self.api.message_id(), date=int(time.time()))
+        return {"message": message}
+
+
+# Pushes updates from a stream into the fake API at a steady rate
+def feed(api, stream, rate, duration, stop):
+    interval = 1 / rate
+    start = time.perf_counter()
+    n = 0
+    while not stop.is_set():
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        due = int(elapsed * rate) + 1
+        while n < due:
+            api.push(stream.next())
+            n += 1
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the bot against a fake Bot API.')
+    parser.add_argument('-r', '--rate', type=float, default=50,
+                        help='Updates per second. (default: 50)')
+    parser.add_argument('-t', '--time', type=float, default=30,
+                        help='Duration (in s) of the test. (default: 30)')
+    parser.add_argument('-c', '--chats', type=int, default=200,
+                        help='Number of synthetic chats. (default: 200)')
+    parser.add_argument('--replay', default=None, metavar='FILE',
+                        help='JSONL file of recorded updates to replay instead of synthetic ones.')
+    parser.add_argument('--rate_limit', type=float, default=0.0, metavar='P',
+                        help='Chance of answering a send with a 429 error. (default: 0)')
+    parser.add_argument('--retry_after', type=int, default=1,
+                        help='retry_after (in s) of the 429 errors. (default: 1)')
+    parser.add_argument('--directory', default=None,
+                        help='Chat logs directory for the bot. (default: a temporary one)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON.')
+    parser.add_argument('bot_args', nargs=argparse.REMAINDER,
+                        help='Extra arguments for velasco.py, after "--".')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(rate_limit_chance=args.rate_limit, retry_after=args.retry_after)
+    base_url = api.start()
+    stream = ReplayStream(api, args.replay) if args.replay else SyntheticStream(api, args.chats)
+
+    directory = args.directory or tempfile.mkdtemp(prefix="velasco_loadtest_")
+    bot_args = [a for a in args.bot_args if a != "--"]
+    env = dict(os.environ, BOT_TOKEN="123:LOADTEST", ADMIN_ID="2")
+    command = [sys.executable, os.path.join(ROOT, "velasco.py"),
+               "--api_url", base_url, "--directory", directory] + bot_args
+    bot = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                           universal_newlines=True)
+
+    errors = []
+
+    def watch_stderr():
+        for line in bot.stderr:
+            # A new chat's missing card is logged as an error, but it's expected
+            if ("ERROR" in line and "Metadata file" not in line) or "Traceback" in line:
+                errors.append(line.rstrip())
+
+    threading.Thread(target=watch_stderr, daemon=True).start()
+
+    # Wait for the bot to start polling
+    deadline = time.monotonic() + 30
+    while api.calls.get("getUpdates", 0) == 0 and time.monotonic() < deadline:
+        if bot.poll() is not None:
+            sys.exit("velasco.py exited with code {}".format(bot.returncode))
+        time.sleep(0.1)
+
+    stop = threading.Event()
+    feeder = threading.Thread(target=feed, args=(api, stream, args.rate, args.time, stop), daemon=True)
+    api.started = time.perf_counter()
+    feeder.start()
+    peak = 0
+    while feeder.is_alive():
+        peak = max(peak, rss(bot.pid) or 0)
+        time.sleep(0.5)
+    # Let the bot drain what's left
+    time.sleep(2)
+    final = rss(bot.pid) or 0
+    report = api.report()
+
+    bot.send_signal(signal.SIGINT)
+    try:
+        bot.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+    api.stop()
+
+    report.update({"rss_peak": max(peak, final), "rss_final": final,
+                   "bot_errors": len(errors), "directory": directory})
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    mib = 2 ** 20
+    print("Updates:  {pushed} pushed, {delivered} delivered ({updates_per_s:.1f}/s)".format(**report))
+    print("Replies:  {sent} sent ({replies_per_s:.1f}/s)".format(**report))
+    print("Latency:  p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+        report["latency_p50"] * 1000, report["latency_p90"] * 1000,
+        report["latency_p99"] * 1000, report["latency_max"] * 1000))
+    print("Errors:   {rate_limited} simulated 429s ({rate_limited_ratio:.1%} of sends), "
+          "{unknown_calls} unknown API calls, {bot_errors} bot errors".format(**report))
+    print("Memory:   peak {:.1f} MiB, final {:.1f} MiB".format(report["rss_peak"] / mib, report["rss_final"] / mib))
+    for line in errors[:10]:
+        print("  " + line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+# This is a QueueHandler that puts the records into the queue as they are,
+# instead of formatting them first (as logging.handlers.QueueHandler does), so
+# the formatting is done by the writer thread too. The arguments of a record
+# must not change after it's logged, which holds for the IDs, names and texts
+# the bot logs
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# This is a logging filter that limits the records logged with arguments (that
+# is, with lazy formatting, as in logger.info("Sending to %s", cid)) to `rate`
+# per second for each message template, so a message logged for every update
+# can't flood the output. Records at `level` or above (warnings and errors by
+# default) always go through. The first record of a template let through after
+# some were skipped tells how many were. A rate of 0 means no limit
+class SampleFilter(logging.Filter):
+    def __init__(self, rate, level=logging.WARNING):
+        super(SampleFilter, self).__init__()
+        self.rate = rate
+        self.level = level
+        # Message template -> [start of the current second, records let through
+        # in it, records skipped since the last one let through]
+        self._windows = {}
+        # Total amount of records skipped
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1}/s per template, {2} skipped>".format(self.__class__.__name__, self.rate, self.skipped)
+
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= self.level or not record.args:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(record.msg)
+            if window is None:
+                window = self._windows[record.msg] = [now, 0, 0]
+            elif now - window[0] >= 1:
+                window[0] = now
+                window[1] = 0
+            if window[1] >= self.rate:
+                window[2] += 1
+                self.skipped += 1
+                return False
+            window[1] += 1
+            skipped = window[2]
+            window[2] = 0
+        if skipped > 0 and isinstance(record.args, tuple):
+            record.msg = "{} (and %d more like it skipped)".format(record.msg)
+            record.args = record.args + (skipped,)
+        return True
+
+
+# Stops looking up, for every record created, the details that a log format
+# may not show: the file, line and function it was logged from (the most
+# expensive part of creating a record), the thread and the process. Only for
+# formats that use none of them (see "Optimization" in the logging HOWTO)
+def skip_record_details():
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+
+# Moves the handlers of a logger (the root logger by default) behind a queue,
+# written by a background thread, so logging never blocks on the output. The
+# records can be limited by a SampleFilter of the given rate. Returns the
+# started logging.handlers.QueueListener, which has to be stopped to write the
+# last records
+def install(logger=None, rate=0):
+    logger = logger or logging.getLogger()
+    handlers = list(logger.handlers)
+    log_queue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    if rate > 0:
+        handler.addFilter(SampleFilter(rate))
+    for old in handlers:
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import itertools
 from collections.abc import Sequence
 
+# Clock of accesses shared by every MemoryList, so the items of different lists
+# can be compared by how recently they were accessed (see SharedBudget)
+access_clock = itertools.count(1)
+
 
 class MemoryList(Sequence):
     """Special "memory list" class that:
@@ -11,21 +16,32 @@ class MemoryList(Sequence):
          back
        - If a new item is added that goes over a given capacity
          limit, the item at the front (oldest accessed item)
-         is removed (and returned)"""
+         is removed (and returned)
+       - If given a byte budget and a function that measures
+         the size of an item, items at the front are removed
+         (and returned) until the total size fits the budget
+       A capacity or budget of 0 means no limit."""
 
-    def __init__(self, capacity, data=None):
+    def __init__(self, capacity, data=None, budget=0, sizeof=None):
         super(MemoryList, self).__init__()
         self._capacity = capacity
+        # Maximum total size (in bytes) of the items, and the function to measure them
+        self._budget = budget if sizeof is not None else 0
+        self._sizeof = sizeof
         if (data is not None):
             self._list = list(data)
         else:
             self._list = list()
+        # Item ID -> access clock time of its last access
+        self._ticks = {id(val): next(access_clock) for val in self._list}
 
     def __repr__(self):
-        return "<{0} {1}, capacity {2}>".format(self.__class__.__name__, self._list, self._capacity)
+        return "<{0} {1}, capacity {2}, budget {3}>".format(self.__class__.__name__, self._list,
+                                                            self._capacity, self._budget)
 
     def __str__(self):
-        return "{0}, {1}/{2}".format(self._list, len(self._list), self._capacity)
+        return "{0}, {1}/{2}, {3}/{4} bytes".format(self._list, len(self._list), self._capacity,
+                                                    self.usage(), self._budget)
 
     def __len__(self):
         return len(self._list)
@@ -33,6 +49,27 @@ class MemoryList(Sequence):
     def capacity(self):
         return self._capacity
 
+    def budget(self):
+        return self._budget
+
+    # Returns a list of (item, size) pairs, oldest accessed first
+    def sizes(self):
+        if self._sizeof is None:
+            return [(val, 0) for val in self._list]
+        return [(val, self._sizeof(val)) for val in self._list]
+
+    # Returns the total size (in bytes) of the items
+    def usage(self):
+        return sum(size for val, size in self.sizes())
+
+    # Returns a list of (item, size, last access clock time) tuples, oldest accessed first
+    def entries(self):
+        return [(val, size, self._ticks.get(id(val), 0)) for val, size in self.sizes()]
+
+    # Measures an item that may not be in the list
+    def sizeof(self, val):
+        return self._sizeof(val) if self._sizeof is not None else 0
+
     def __getitem__(self, ii):
         return self._list[ii]
 
@@ -42,24 +79,119 @@ class MemoryList(Sequence):
     def __iter__(self):
         return self._list.__iter__()
 
+    # Adds an item at the back, and removes the oldest accessed items that don't
+    # fit anymore. Returns the list of removed items
     def add(self, val):
         if val in self._list:
             self._list.remove(val)
 
         self._list.append(val)
-        if len(self._list) >= self._capacity:
-            x = self._list[0]
-            del self._list[0]
-            return x
-        else:
-            return None
+        self._ticks[id(val)] = next(access_clock)
+        return self.trim()
+
+    # Removes the oldest accessed items until the list fits its capacity and
+    # budget, always keeping the last accessed one. Items can grow after they
+    # were added, so this can be called anytime. Returns the list of removed items
+    def trim(self):
+        removed = []
+        while self._capacity > 0 and len(self._list) >= self._capacity:
+            removed.append(self._list[0])
+            self.remove(self._list[0])
+        if self._budget > 0:
+            sizes = self.sizes()
+            total = sum(size for val, size in sizes)
+            i = 0
+            while total > self._budget and i < len(sizes) - 1:
+                val, size = sizes[i]
+                self.remove(val)
+                removed.append(val)
+                total -= size
+                i += 1
+        return removed
+
+    # Adds an item at the front (as the oldest accessed item) only if there's room
+    # for it without pushing anything else out. Returns True if it was added
+    def add_cold(self, val):
+        if val in self._list or self.full():
+            return False
+        if self._budget > 0 and self.usage() + self._sizeof(val) > self._budget:
+            return False
+        self._list.insert(0, val)
+        # As old as it gets
+        self._ticks[id(val)] = 0
+        return True
+
+    # Returns True if there's no room left for an item without pushing another one out
+    def full(self):
+        if self._capacity > 0 and len(self._list) + 1 >= self._capacity:
+            return True
+        return self._budget > 0 and self.usage() >= self._budget
 
     def search(self, cond, *args, **kwargs):
         val = next((v for v in self._list if cond(v)), *args, **kwargs)
         if val is not None:
             self._list.remove(val)
             self._list.append(val)
+            self._ticks[id(val)] = next(access_clock)
         return val
 
     def remove(self, val):
         self._list.remove(val)
+        self._ticks.pop(id(val), None)
+
+
+class SharedBudget(object):
+    """Byte budget shared by several MemoryLists, each one measuring
+       its own items. Whenever it's trimmed, the least recently
+       accessed items across all of the lists are removed (and
+       returned) until their total size fits the budget, always
+       keeping the last accessed one. A budget of 0 means no limit."""
+
+    def __init__(self, budget):
+        self._budget = budget
+        # List of (MemoryList, function that disposes of its removed items)
+        self._members = []
+
+    def __repr__(self):
+        return "<{0} {1}/{2} bytes, {3} lists>".format(self.__class__.__name__, self.usage(),
+                                                        self._budget, len(self._members))
+
+    def budget(self):
+        return self._budget
+
+    # Adds a MemoryList to the budget, with the function that has to be called
+    # with the items removed from it
+    def register(self, memory, evict):
+        self._members.append((memory, evict))
+
+    # Returns the total size (in bytes) of the items of all the lists
+    def usage(self):
+        return sum(memory.usage() for memory, evict in self._members)
+
+    # Returns True if there's no room left for an item without pushing another one out
+    def full(self):
+        return self._budget > 0 and self.usage() >= self._budget
+
+    # Returns True if an item of the given size fits without pushing another one out
+    def fits(self, size):
+        return self._budget <= 0 or self.usage() + size <= self._budget
+
+    # Removes the least recently accessed items across all the lists until they
+    # fit the budget. Returns a list of (evict function, list of removed items)
+    def trim(self):
+        if self._budget <= 0:
+            return []
+        entries = []
+        for memory, evict in self._members:
+            for val, size, tick in memory.entries():
+                entries.append((tick, size, val, memory, evict))
+        entries.sort(key=lambda e: e[0])
+        total = sum(e[1] for e in entries)
+        removed = {}
+        for tick, size, val, memory, evict in entries[:-1]:
+            if total <= self._budget:
+                break
+            memory.remove(val)
+            removed.setdefault(id(memory), (evict, []))[1].append(val)
+            total -= size
+        return list(removed.values())
@@ -13,7 +13,8 @@ def parse_card_line(line):
 # This is a chat's Metadata, holding different configuration values for
 # Velasco and other miscellaneous information about the chat
 class Metadata(object):
-    def __init__(self, cid, ctype, title, count=0, period=None, answer=0.5, restricted=False, silenced=False):
+    def __init__(self, cid, ctype, title, count=0, period=None, answer=0.5, restricted=False, silenced=False,
+                 stats=None):
         # The Telegram chat's ID
         self.id = str(cid)
         # The type of chat
@@ -37,6 +38,9 @@ class Metadata(object):
         self.restricted = restricted
         # Wether messages should silence user mentions
         self.silenced = silenced
+        # The vocabulary's counters, as of the last time it was stored (see
+        # Generator.stats). None if unknown, as in cards older than v6
+        self.stats = stats if stats is not None else {"messages": 0, "keys": 0, "transitions": 0, "bytes": 0}
 
     # Sets the period for a chat
     # It has to be higher than 1
@@ -63,7 +67,7 @@ class Metadata(object):
     # Dumps the metadata into a list of lines, then joined together in a string,
     # ready to be written into a file
     def dumps(self):
-        lines = ["CARD=v5"]
+        lines = ["CARD=v6"]
         lines.append("CHAT_ID=" + self.id)
         lines.append("CHAT_TYPE=" + self.type)
         lines.append("CHAT_NAME=" + self.title)
@@ -72,6 +76,10 @@ class Metadata(object):
         lines.append("ANSWER_PROB=" + str(self.answer))
         lines.append("RESTRICTED=" + str(self.restricted))
         lines.append("SILENCED=" + str(self.silenced))
+        lines.append("VOCAB_MESSAGES=" + str(self.stats["messages"]))
+        lines.append("VOCAB_KEYS=" + str(self.stats["keys"]))
+        lines.append("VOCAB_TRANSITIONS=" + str(self.stats["transitions"]))
+        lines.append("VOCAB_BYTES=" + str(self.stats["bytes"]))
         # lines.append("WORD_DICT=")
         return ('\n'.join(lines)) + '\n'
 
@@ -88,8 +96,22 @@ class Metadata(object):
         # same order, and nobody can stop me
         version = parse_card_line(lines[0]).strip()
         version = version if len(version.strip()) > 1 else (lines[4] if len(lines) > 4 else "LOG_ZERO")
-        if version == "v4" or version == "v5":
+        if version == "v6":
             return Metadata(cid=parse_card_line(lines[1]),
+                            ctype=parse_card_line(lines[2]),
+                            title=parse_card_line(lines[3]),
+                            count=int(parse_card_line(lines[4])),
+                            period=int(parse_card_line(lines[5])),
+                            answer=float(parse_card_line(lines[6])),
+                            restricted=(parse_card_line(lines[7]) == 'True'),
+                            silenced=(parse_card_line(lines[8]) == 'True'),
+                            stats={"messages": int(parse_card_line(lines[9])),
+                                   "keys": int(parse_card_line(lines[10])),
+                                   "transitions": int(parse_card_line(lines[11])),
+                                   "bytes": int(parse_card_line(lines[12]))}
+                            )
+        elif version == "v4" or version == "v5":
+            meta = Metadata(cid=parse_card_line(lines[1]),
                             ctype=parse_card_line(lines[2]),
                             title=parse_card_line(lines[3]),
                             count=int(parse_card_line(lines[4])),
@@ -98,6 +120,9 @@ class Metadata(object):
                             restricted=(parse_card_line(lines[7]) == 'True'),
                             silenced=(parse_card_line(lines[8]) == 'True')
                             )
+            # These cards have no counters, they are filled in when the chat is stored
+            meta.stats = None
+            return meta
         elif version == "v3":
             # Deprecated: this elif block will be removed in a new version
             print("Warning! This Card format ({}) is deprecated. Update all".format(version),
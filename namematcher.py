@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import re
+
+
+# This builds a regular expression that matches any of the given words, laid
+# out as a trie (e.g. "velasco(?:bot)?" instead of "velascobot|velasco"), so
+# the work done at each position of the text depends on the length of the
+# names and not on how many names there are
+def trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # The empty key marks the end of a word
+        node[""] = True
+
+    def build(node):
+        end = "" in node
+        alternatives = [re.escape(char) + build(child)
+                        for char, child in sorted(node.items()) if char != ""]
+        if len(alternatives) == 0:
+            return ""
+        if len(alternatives) == 1 and not end:
+            return alternatives[0]
+        group = "(?:" + "|".join(alternatives) + ")"
+        return group + "?" if end else group
+
+    return build(trie)
+
+
+# This is the matcher for the bot's names in a message, built once at startup
+# from the bot's username and nicknames. Everything is compared casefolded
+class NameMatcher(object):
+    # Messages with up to this many words that contain one of the names are
+    # considered summons, and are not learned
+    SUMMON_LENGTH = 3
+
+    def __init__(self, username, nicknames=[]):
+        # The bot's username, "@" included
+        self.username = username.casefold()
+        # Any other name the bot answers to
+        self.nicknames = set(n.casefold() for n in nicknames if len(n) > 0)
+        self.pattern = re.compile(trie_pattern(self.nicknames | {self.username}))
+        # The same, for texts that aren't casefolded (see strip)
+        self.any_case = re.compile(self.pattern.pattern, re.IGNORECASE)
+
+    def __repr__(self):
+        return "<{0} {1}>".format(self.__class__.__name__, self.pattern.pattern)
+
+    # Returns a (mentioned, summon) tuple for a text:
+    # - mentioned is True if the bot's username is called, or if one of the
+    #   nicknames is called and it's not another user's username ("@nickname")
+    # - summon is True if any of the names appears in a message short enough
+    #   to be most probably just a summon
+    def match(self, text):
+        if not text:
+            return (False, False)
+        text = text.casefold()
+        found = False
+        mentioned = False
+        for m in self.pattern.finditer(text):
+            found = True
+            name = m.group()
+            if name == self.username or m.start() == 0 or text[m.start() - 1] != "@":
+                mentioned = True
+                break
+        summon = found and len(text.split(maxsplit=self.SUMMON_LENGTH)) <= self.SUMMON_LENGTH
+        return (mentioned, summon)
+
+    # Returns a text without any of the names in it
+    def strip(self, text):
+        return self.any_case.sub("", text)
+
+    def mentioned(self, text):
+        return self.match(text)[0]
+
+    def is_summon(self, text):
+        return self.match(text)[1]
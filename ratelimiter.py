@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+
+# This is a token bucket rate limiter that can be shared between threads:
+# up to `burst` calls can go through at once, and then `rate` calls per second
+class RateLimiter(object):
+    def __init__(self, rate, burst=None):
+        # Calls allowed per second
+        self.rate = rate
+        # Calls allowed at once after being idle
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1}/s, burst {2}>".format(self.__class__.__name__, self.rate, self.burst)
+
+    # Refills the bucket with the tokens earned since the last call
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._timestamp) * self.rate)
+        self._timestamp = now
+
+    # Takes a token if there's one available. Returns True if it did
+    def try_acquire(self):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    # Blocks until a token is available, and takes it
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
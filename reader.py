@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
 import random
+import time
+from collections import deque
 from metadata import Metadata, parse_card_line
 from generator import Generator
+from hashwindow import HashWindow, fingerprint
+from tracing import span
 
 
 # This gives me the chat title, or the first and maybe last
@@ -34,27 +38,68 @@ class Reader(object):
     ANIM_TAG = "^IS_ANIMATION^"
     VIDEO_TAG = "^IS_VIDEO^"
 
-    def __init__(self, metadata, vocab, min_period, max_period, logger, names=[]):
+    # Maximum amount of recent messages kept as possible reply targets
+    MEMORY_SIZE = 50
+    # Amount of pending messages that triggers a commit into the vocabulary
+    COMMIT_BATCH = 20
+    # Maximum time (in s) that a pending message waits before being committed
+    COMMIT_TIME = 300
+    # Approximate memory (in bytes) taken by a message in short term memory, besides its text
+    MEMORY_BYTES = 200
+    # Amount of recent text messages whose hashes are remembered to spot copies (at least)
+    DEDUP_WINDOW = 128
+    # Minimum amount of words of a text message to be checked for copies, so
+    # short common replies ("lol", "good morning") are always learned
+    DEDUP_WORDS = 4
+
+    def __init__(self, metadata, vocab, min_period, max_period, logger,
+                 memory_size=MEMORY_SIZE, commit_batch=COMMIT_BATCH, commit_time=COMMIT_TIME,
+                 dedup_window=DEDUP_WINDOW, dedup_words=DEDUP_WORDS):
         # The Metadata object holding a chat's specific bot parameters
         self.meta = metadata
         # The Generator object holding the vocabulary learned so far
         self.vocab = vocab
-        # The maximum period allowed for this bot
+        # The minimum and maximum period allowed for this bot
+        self.min_period = min_period
         self.max_period = max_period
-        # The short term memory, for recently read messages (see below)
-        self.short_term_mem = []
+        # The short term memory, a ring buffer of recently read messages to reply to
+        self.short_term_mem = deque(maxlen=memory_size)
+        # The messages read but not yet committed into the vocabulary (see below)
+        self.pending = []
+        # The amount of pending messages that triggers a commit
+        self.commit_batch = commit_batch
+        # The maximum time (in s) between commits while there are pending messages
+        self.commit_time = commit_time
+        # Last commit timestamp
+        self.commit_timer = time.perf_counter()
+        # Last read timestamp, to tell when the chat went idle
+        self.read_timer = time.perf_counter()
         # The countdown until the period ends and it's time to talk
         self.countdown = self.meta.period
         # The logger object shared program-wide
         self.logger = logger
-        # The bot's nicknames + username
-        self.names = names
+        # Whether the metadata or the vocabulary changed since they were last stored.
+        # A card without counters (older than v6) is stored again to fill them in
+        self.meta_dirty = metadata.stats is None
+        self.vocab_dirty = False
+        # The hashes of the recent text messages, to skip copies (spam, copypastas)
+        # instead of learning the same transitions over and over
+        self.recent = HashWindow(dedup_window)
+        self.dedup_words = dedup_words
+        # The amount of copies skipped since the Reader was loaded, and their characters
+        self.suppressed = 0
+        self.suppressed_chars = 0
 
     # Create a new Reader from a Chat object
-    def FromChat(chat, min_period, max_period, logger):
+    def FromChat(chat, min_period, max_period, logger, order=Generator.ORDER):
         meta = Metadata(chat.id, chat.type, get_chat_title(chat))
-        vocab = Generator()
-        return Reader(meta, vocab, min_period, max_period, logger)
+        vocab = Generator(order=order)
+        reader = Reader(meta, vocab, min_period, max_period, logger)
+        # A new chat has never been stored, so its (empty) vocabulary is stored
+        # along with its card the first time, even if nothing was learned yet
+        reader.meta_dirty = True
+        reader.vocab_dirty = True
+        return reader
 
     # TODO: Create a new Reader from a whole Chat history
     def FromHistory(history, vocab, min_period, max_period, logger):
@@ -75,7 +120,7 @@ class Reader(object):
         version = parse_card_line(lines[0]).strip()
         version = version if len(version.strip()) > 1 else lines[4]
         logger.info("Dictionary version: {} ({} lines)".format(version, len(lines)))
-        if version == "v4" or version == "v5":
+        if version == "v4" or version == "v5" or version == "v6":
             return Reader.FromCard(text, vocab, min_period, max_period, logger)
             # I stopped saving the chat metadata and the cache together
         elif version == "v3":
@@ -102,8 +147,28 @@ class Reader(object):
     # Also commits to long term memory any pending short term memories
     def archive(self):
         self.commit_memory()
+        self.meta.stats = self.vocab.stats()
         return (self.meta.id, self.meta.dumps(), self.vocab.dumps())
 
+    # Like archive(), but only with what changed since the last time the Reader
+    # was stored: the vocabulary dump is None if it didn't change, and the whole
+    # package is None if nothing did. Call mark_clean() once it's stored
+    def archive_changes(self):
+        self.commit_memory()
+        if not self.is_dirty():
+            return None
+        vocab = self.vocab.dumps() if self.vocab_dirty else None
+        self.meta.stats = self.vocab.stats()
+        return (self.meta.id, self.meta.dumps(), vocab)
+
+    # Returns True if anything changed since the Reader was last stored
+    def is_dirty(self):
+        return self.meta_dirty or self.vocab_dirty or len(self.pending) > 0
+
+    def mark_clean(self):
+        self.meta_dirty = False
+        self.vocab_dirty = False
+
     # Checks type. Returns "True" for "group" even if it's supergroupA
     def check_type(self, t):
         return t in self.meta.type
@@ -114,12 +179,14 @@ class Reader(object):
 
     def set_title(self, title):
         self.meta.title = title
+        self.meta_dirty = True
 
     # Sets a new period in the Metadata
     def set_period(self, period):
         # The period has to be in the range [min..max_period]; otherwise, clamp to said range
         new_period = max(self.min_period, min(period, self.max_period))
         set_period = self.meta.set_period(new_period)
+        self.meta_dirty = True
         if new_period == set_period and new_period < self.countdown:
             # If succesfully changed and the new period is less than the current
             # remaining countdown, reduce the countdown to the new period
@@ -127,7 +194,9 @@ class Reader(object):
         return new_period
 
     def set_answer(self, prob):
-        return self.meta.set_answer(prob)
+        answer = self.meta.set_answer(prob)
+        self.meta_dirty = True
+        return answer
 
     def cid(self):
         return str(self.meta.id)
@@ -135,6 +204,22 @@ class Reader(object):
     def count(self):
         return self.meta.count
 
+    # Returns the vocabulary's counters (see Generator.stats)
+    def stats(self):
+        return self.vocab.stats()
+
+    # Approximate memory (in bytes) taken by the Reader: its vocabulary (and
+    # transition table, if built), plus the messages in short term memory.
+    # Pending messages are the same ones in short term memory, so they are not
+    # counted twice
+    def size(self):
+        size = self.vocab.size()
+        if self.vocab.table is not None:
+            size += self.vocab.table.size()
+        for mem in self.short_term_mem:
+            size += Reader.MEMORY_BYTES + len(mem.content)
+        return size + self.recent.size()
+
     def period(self):
         return self.meta.period
 
@@ -152,12 +237,14 @@ class Reader(object):
 
     def toggle_restrict(self):
         self.meta.restricted = (not self.meta.restricted)
+        self.meta_dirty = True
 
     def is_silenced(self):
         return self.meta.silenced
 
     def toggle_silence(self):
         self.meta.silenced = (not self.meta.silenced)
+        self.meta_dirty = True
 
     # Rolls the chance for answering in this specific chat,
     # according to the answer probability
@@ -170,10 +257,24 @@ class Reader(object):
             return False
         return rand <= chance
 
-    # Adds a new message to the short term memory
-    def add_memory(self, mid, content):
+    # Adds a new message to the short term memory, and queues it to be committed
+    # unless told otherwise. The oldest memory is dropped once the ring buffer is full
+    def add_memory(self, mid, content, commit=True):
         mem = Memory(mid, content)
         self.short_term_mem.append(mem)
+        if not commit:
+            return
+        self.pending.append(content)
+        if self.should_commit():
+            self.commit_memory()
+
+    # Checks if enough messages are pending, or enough time has passed since
+    # the last commit, to fold the pending messages into the vocabulary
+    def should_commit(self):
+        if len(self.pending) >= self.commit_batch:
+            return True
+        elapsed = time.perf_counter() - self.commit_timer
+        return len(self.pending) > 0 and elapsed >= self.commit_time
 
     # Returns a random message ID from the short memory,
     # when answering to a random comment
@@ -183,18 +284,31 @@ class Reader(object):
         mem = random.choice(self.short_term_mem)
         return mem.id
 
+    # Returns the content of a message in the short term memory, or None if
+    # it's not there anymore
+    def recall(self, mid):
+        mid = str(mid)
+        for mem in reversed(self.short_term_mem):
+            if mem.id == mid:
+                return mem.content
+        return None
+
     def reset_countdown(self):
         self.countdown = self.meta.period
 
     # Reads a message
     # This process will determine which kind of message it is (Sticker, Anim,
     # Video, or actual text) and pre-process it accordingly for the Generator,
-    # then store it in the short term memory
-    def read(self, message):
+    # then store it in the short term memory.
+    # Text messages flagged as summons (see NameMatcher) are counted but not learned.
+    # Returns True if the message was skipped as a copy of a recent one
+    def read(self, message, summon=False):
         mid = str(message.message_id)
+        suppressed = False
 
         if message.text is not None:
-            self.learn(mid, message.text)
+            if not summon:
+                suppressed = not self.learn(mid, message.text)
         elif message.sticker is not None:
             self.learn_drawing(mid, Reader.STICKER_TAG, message.sticker.file_id)
         elif message.animation is not None:
@@ -203,27 +317,57 @@ class Reader(object):
             self.learn_drawing(mid, Reader.VIDEO_TAG, message.video.file_id)
 
         self.meta.count += 1
+        self.meta_dirty = True
+        self.read_timer = time.perf_counter()
+        return suppressed
 
     # Stores a multimedia message in the short term memory as a text with
-    # TAG + the media file ID
+    # TAG + a reference to the media file ID in the vocabulary's media table
     def learn_drawing(self, mid, tag, drawing):
-        self.learn(mid, tag + " " + drawing)
+        self.add_memory(mid, tag + " " + self.vocab.media_ref(drawing))
 
-    # Stores a text message in the short term memory
+    # Stores a text message in the short term memory. Long enough messages that
+    # are a copy of a recent one (see fingerprint) are kept there to be replied
+    # to, but not learned again. Returns False if it was skipped
     def learn(self, mid, text):
-        for name in self.names:
-            if name.casefold() in text.casefold() and len(text.split()) <= 3:
-                # If it's less than 3 words and one of the bot's names is in
-                # the message, ignore it as it's most probably just a summon
-                return
+        key, words = fingerprint(text)
+        if words >= self.dedup_words and self.recent.seen(key):
+            self.suppressed += 1
+            self.suppressed_chars += len(text)
+            self.add_memory(mid, text, commit=False)
+            return False
         self.add_memory(mid, text)
+        return True
 
-    # Commits the short term memory messages into the "long term memory"
-    # aka the vocabulary Generator's cache
+    # Commits the pending messages into the "long term memory" aka the
+    # vocabulary Generator's cache. The short term memory is kept as is,
+    # so its messages can still be replied to
     def commit_memory(self):
-        for mem in self.short_term_mem:
-            self.vocab.add(mem.content)
-        self.short_term_mem = []
-
-    def generate_message(self, max_len):
-        return self.vocab.generate(size=max_len, silence=self.is_silenced())
+        with span("commit"):
+            for content in self.pending:
+                self.vocab.add(content)
+        if len(self.pending) > 0:
+            self.vocab_dirty = True
+        self.pending = []
+        self.commit_timer = time.perf_counter()
+
+    # Returns the time (in s) since the last message was read
+    def idle_time(self):
+        return time.perf_counter() - self.read_timer
+
+    # Packs the vocabulary into its compact form (see Generator.freeze) after
+    # committing any pending messages, which would thaw it right away otherwise
+    def freeze(self):
+        self.commit_memory()
+        self.vocab.freeze()
+
+    def is_frozen(self):
+        return self.vocab.is_frozen()
+
+    # Generates a message, starting from a word of the seed text if given one
+    # the vocabulary knows (see Generator.generate)
+    def generate_message(self, max_len, seed=None):
+        if len(self.pending) > 0:
+            self.commit_memory()
+        # Media references are resolved back into file IDs, ready to be sent
+        return self.vocab.resolve_text(self.vocab.generate(size=max_len, silence=self.is_silenced(), seed=seed))
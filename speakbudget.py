@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+
+# Usage of a chat's budget: its token bucket, and what it spent since it
+# was last pruned (see SpeakBudget.prune)
+class ChatUsage(object):
+    __slots__ = ("tokens", "timestamp", "spent", "sent", "deferred", "dropped", "charged")
+
+    def __init__(self, tokens, timestamp):
+        self.tokens = tokens
+        self.timestamp = timestamp
+        # Time (in s) spent generating and sending messages
+        self.spent = 0.0
+        # Messages sent, periodic messages deferred and repeated messages dropped
+        self.sent = 0
+        self.deferred = 0
+        self.dropped = 0
+        # True if it was charged since the last prune
+        self.charged = False
+
+    def as_dict(self):
+        return {"spent": self.spent, "sent": self.sent, "deferred": self.deferred,
+                "dropped": self.dropped, "tokens": self.tokens}
+
+
+# This is a set of per-chat token buckets of handler time: each chat earns
+# `budget` seconds of time spent generating and sending its messages every
+# `period` seconds, and can save up to `budget` seconds. Messages the chat
+# asked for (mentions, replies, /speak) always go through, but they are
+# charged too, down to a debt of `budget` seconds, so a chat can't take the
+# handlers' thread away from every other chat with its own messages either.
+# A budget of 0 means no limit
+class SpeakBudget(object):
+    def __init__(self, budget, period=60):
+        self.budget = budget
+        self.period = period
+        # Seconds earned per second
+        self.rate = budget / period if period > 0 else 0
+        # Chat ID -> ChatUsage
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1}s per {2}s, {3} chats>".format(self.__class__.__name__, self.budget,
+                                                       self.period, len(self._chats))
+
+    def __len__(self):
+        return len(self._chats)
+
+    # Returns the ChatUsage of a chat with the tokens earned since the last
+    # call. Has to be called with the lock held
+    def _refill(self, cid):
+        now = time.monotonic()
+        usage = self._chats.get(cid)
+        if usage is None:
+            usage = self._chats[cid] = ChatUsage(self.budget, now)
+        else:
+            usage.tokens = min(self.budget, usage.tokens + (now - usage.timestamp) * self.rate)
+            usage.timestamp = now
+        return usage
+
+    # Returns True if a chat has budget left for a message it didn't ask for
+    def allow(self, cid):
+        if self.budget <= 0:
+            return True
+        with self._lock:
+            return self._refill(cid).tokens > 0
+
+    # Takes the time spent on a chat's messages from its budget
+    def charge(self, cid, elapsed, sent=1):
+        with self._lock:
+            usage = self._refill(cid)
+            if self.budget > 0:
+                usage.tokens = max(-self.budget, usage.tokens - elapsed)
+            usage.spent += elapsed
+            usage.sent += sent
+            usage.charged = True
+
+    # Counts a periodic message put off for being over budget
+    def defer(self, cid):
+        with self._lock:
+            self._refill(cid).deferred += 1
+
+    # Counts a repeated message left out for being over budget
+    def drop(self, cid):
+        with self._lock:
+            self._refill(cid).dropped += 1
+
+    # Returns the usage of the chats that spent the most, as a list of
+    # (chat ID, usage dict), up to `top` of them (all if None)
+    def usage(self, top=None):
+        with self._lock:
+            chats = [(cid, self._refill(cid).as_dict()) for cid in self._chats]
+        chats.sort(key=lambda c: c[1]["spent"], reverse=True)
+        return chats if top is None else chats[:top]
+
+    # Forgets the chats not charged since the last call whose bucket is full
+    # again, as they are no different from a chat never seen. Returns the
+    # amount of chats forgotten
+    def prune(self):
+        with self._lock:
+            idle = []
+            for cid, usage in self._chats.items():
+                if not usage.charged and (self.budget <= 0 or self._refill(cid).tokens >= self.budget):
+                    idle.append(cid)
+                usage.charged = False
+            for cid in idle:
+                del self._chats[cid]
+        return len(idle)
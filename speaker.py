@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
+import queue
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from sys import stderr
+from admincache import AdminCache
+from announcer import Announcement
 from memorylist import MemoryList
+from namematcher import NameMatcher
+from ratelimiter import RateLimiter
 from reader import Reader, get_chat_title
+from speakbudget import SpeakBudget
 from telegram.error import NetworkError
+from tracing import note, span, trace
 
 
 # Auxiliar print to stderr function (alongside logger messages)
@@ -13,6 +23,27 @@ def eprint(*args, **kwargs):
     print(*args, end=' ', file=stderr, **kwargs)
 
 
+# Formats an amount of bytes in a human readable way
+def format_bytes(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} GiB".format(size)
+
+
+# Formats a vocabulary's counters (see Generator.stats)
+def format_stats(stats):
+    return "{} messages, {} keys, {} transitions, ~{}".format(
+        stats["messages"], stats["keys"], stats["transitions"], format_bytes(stats["bytes"]))
+
+
+# Formats a chat's generation budget usage (see SpeakBudget.usage)
+def format_usage(usage):
+    return "{:.2f}s in {} messages, {} deferred, {} repeats dropped, {:.2f}s left".format(
+        usage["spent"], usage["sent"], usage["deferred"], usage["dropped"], usage["tokens"])
+
+
 # Auxiliar message to send a text to a chat through a bot
 def send(bot, cid, text, replying=None, formatting=None, logger=None, **kwargs):
     # Markdown or HTML formatting (both argument names are valid)
@@ -25,10 +56,12 @@ def send(bot, cid, text, replying=None, formatting=None, logger=None, **kwargs):
         # We're sending a media file ID
         words = text.split(maxsplit=1)
         if logger:
-            logger.info('Sending {} "{}" to {}'.format(words[0][4:-1], words[1], cid))
+            logger.info('Sending %s "%s" to %s', words[0][4:-1], words[1], cid)
             # Logs something like 'Sending VIDEO "VIDEO_ID" to CHAT_ID'
 
         if words[0] == Reader.STICKER_TAG:
+            # Stickers have no caption to format
+            kwargs.pop("parse_mode", None)
             return bot.send_sticker(cid, words[1], **kwargs)
         elif words[0] == Reader.ANIM_TAG:
             return bot.send_animation(cid, words[1], **kwargs)
@@ -38,7 +71,7 @@ def send(bot, cid, text, replying=None, formatting=None, logger=None, **kwargs):
         # It's text
         if logger:
             mtype = "reply" if (kwargs.get("reply_to_message_id")) else "message"
-            logger.info("Sending a {} to {}: '{}'".format(mtype, cid, text))
+            logger.info("Sending a %s to %s: '%s'", mtype, cid, text)
             # eprint('.')
         return bot.send_message(cid, text, **kwargs)
 
@@ -49,13 +82,27 @@ class Speaker(object):
     # Marks if the "periodic" messages have a weighted random chance to be sent, depending on the period
     ModeChance = "CHANCE_MODE"
 
+    # Minimum time (in s) between checks for idle chats to move into the cold archive
+    COLD_CHECK = 86400
+    # Minimum time (in s) between checks for idle chats in memory to freeze
+    FREEZE_CHECK = 60
+    # Minimum time (in s) between checks for pending messages that waited for
+    # too long to be committed (see Reader.COMMIT_TIME)
+    COMMIT_CHECK = 60
+
     def __init__(self, username, archivist, logger, admin=0, nicknames=[],
                  reply=0.1, repeat=0.05, wakeup=False, mode=ModeFixed,
-                 memory=20, mute_time=60, save_time=3600, bypass=False,
-                 cid_whitelist=None, max_len=50
+                 memory=20, memory_budget=0, mute_time=60, save_time=3600, bypass=False,
+                 cid_whitelist=None, max_len=50, admin_ttl=600,
+                 announce_rate=25, announce_workers=8, cold_after=0, freeze_time=600,
+                 executor=None, send_limiter=None, shared_budget=None, memory_lock=None,
+                 gc_monitor=None, gc_freeze=False, io_workers=4, batch_size=32, batch_window=0.25,
+                 seed_replies=0.5, speak_budget=3, budget_period=60
                  ):
         # List of nicknames other than the username that the bot can be called as
         self.names = nicknames
+        # Precompiled matcher for the username and nicknames in messages
+        self.matcher = NameMatcher(username, nicknames)
         # Mute time for Telegram network errors
         self.mute_time = mute_time
         # Last mute timestamp
@@ -65,6 +112,8 @@ class Speaker(object):
         # The minimum and maximum chat period for this bot
         self.min_period = archivist.min_period
         self.max_period = archivist.max_period
+        # The order of the Markov chains for new chats
+        self.order = archivist.order
 
         # The Archivist functions to load and save from and to files
         self.get_reader_file = archivist.get_reader
@@ -72,6 +121,19 @@ class Speaker(object):
 
         # Archivist function to crawl all stored Readers
         self.readers_pass = archivist.readers_pass
+        # Archivist function to crawl all stored Metadata cards
+        self.cards_pass = archivist.cards_pass
+
+        # The Archivist functions to checkpoint and resume announcements
+        self.store_announcement_file = archivist.store_announcement
+        self.load_announcement_file = archivist.load_announcement
+
+        # The Archivist functions to save and load the list of chats in memory
+        self.store_hot_file = archivist.store_hot
+        self.load_hot_file = archivist.load_hot
+
+        # The Archivist function to move idle chats into the cold archive
+        self.freeze_file = archivist.freeze_idle
 
         # Legacy load logging emssages
         logger.info("----")
@@ -89,28 +151,182 @@ class Speaker(object):
         self.repeat = repeat
         # If not empty, whitelist of chat IDs to only respond to
         self.cid_whitelist = cid_whitelist
-        # Memory list/cache for the last accessed chats
-        self.memory = MemoryList(memory)
+        # Memory list/cache for the last accessed chats, limited by amount of
+        # chats and by their estimated size in bytes (0 means no limit). When
+        # several bots run in the same process, the byte budget is the one
+        # shared by all of them instead, which pushes out the least recently
+        # accessed chats of any bot
+        self.shared_budget = shared_budget
+        if shared_budget is not None:
+            self.memory = MemoryList(memory, sizeof=Reader.size)
+            shared_budget.register(self.memory, self.evict)
+        else:
+            self.memory = MemoryList(memory, budget=memory_budget, sizeof=Reader.size)
+        # Lock for the memory list, shared by handlers and the warm up thread
+        # (and by all the bots sharing the memory budget)
+        self.memory_lock = memory_lock or threading.RLock()
         # Minimum time to wait between memory saves (triggered at the next message from any chat)
         self.save_time = save_time
+        # Time (in s) without messages after which a stored chat is moved into
+        # the cold archive (0 means never), checked at most once per COLD_CHECK
+        self.cold_after = cold_after
+        # Last cold archive check timestamp
+        self.cold_timer = None
+        # Future of the cold archive pass going on in the I/O thread pool, if any
+        self.cold_future = None
+        # Time (in s) without messages after which a chat in memory is packed into
+        # its compact frozen form (0 means never), checked every FREEZE_CHECK
+        self.freeze_time = freeze_time
+        # Last frozen chats check timestamp
+        self.freeze_timer = time.perf_counter()
+        # Last pending messages check timestamp
+        self.pending_timer = time.perf_counter()
         # Last save timestamp
         self.memory_timer = int(time.perf_counter())
         # Admin user ID
         self.admin = admin
+        # Cache of each chat's administrators, for permission checks
+        self.admins = AdminCache(admin_ttl, logger)
         # For testing purposes
         self.bypass = bypass
         # Max word length for a message
         self.max_len = max_len
+        # Chance of starting a reply from a word of the message it replies to
+        self.seed_replies = seed_replies
+        # Time (in s) of the handlers' thread that each chat can spend generating
+        # and sending its messages per budget period (0 means no limit). Periodic
+        # messages over budget wait for the chat's next message, and repeated
+        # ones are left out; replies to mentions and /speak always go through
+        self.speak_budget = SpeakBudget(speak_budget, budget_period)
+        # Rate limiter for every message sent, shared by all the bots in the
+        # process (None means only announcements are limited)
+        self.send_limiter = send_limiter
+        # Rate limiter and amount of threads for sending announcements, which
+        # get their own, even when there's a shared thread pool (see Announcement.run)
+        self.announce_limiter = send_limiter or RateLimiter(announce_rate)
+        self.announce_workers = announce_workers
+        # Thread pool shared by all the bots in the process for background work,
+        # if any (otherwise each job gets its own threads), except announcements
+        self.executor = executor
+        # Thread pool for loading chats from files and storing the ones pushed out
+        # of memory, off the handlers' thread: the shared one, if any, or one of
+        # this bot's own with io_workers threads
+        self.own_io = executor is None
+        self.io_executor = executor or ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="io")
+        # Lock for the following bookkeeping of the chats being loaded and stored
+        # (reentrant, as a finished load's callback may run while it's held)
+        self.io_lock = threading.RLock()
+        # Chat ID -> future of its reader being loaded into memory. There's only
+        # one load at a time for each chat, no matter how many ask for it
+        self.loading = {}
+        # Chat ID -> list of (update, update queue) waiting for its reader
+        self.waiting = {}
+        # Chat ID -> exception of its last load, if it failed. The updates put
+        # back into the queue after it are dropped instead of waiting again
+        self.failed = {}
+        # Chat ID -> amount of waiting updates put back into the update queue
+        # after its reader was loaded, and not handled yet
+        self.draining = {}
+        # IDs of the updates put back into the update queue, once their chat was
+        # loaded, and while the ones before them were handled
+        self.redispatched = set()
+        self.requeued = set()
+        # The update queue the handlers read from
+        self.update_queue = None
+        # Chat ID -> future of its evicted reader being stored
+        self.storing = {}
+        # Chat ID -> times its reader is in use by the handlers (see in_use),
+        # and the condition that evicted readers wait on until it's not
+        self.using = {}
+        self.use_lock = threading.Condition()
+        # Chat ID -> messages gathered to be read in a single pass, and the time
+        # when the oldest one was gathered (see flush_batches)
+        self.batches = {}
+        self.batch_timers = {}
+        # Maximum amount of messages in a batch (1 reads every message on its
+        # own), and maximum time (in s) that a message waits in one
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        # The bot that received the last gathered message
+        self.batch_bot = None
+        # Whether the I/O thread pool is shutting down, so evicted readers are
+        # stored right away instead
+        self.closing = False
+        # The garbage collector pause monitor shared program-wide, if any, and
+        # whether to freeze loaded vocabularies out of the collector's reach
+        # (see GCMonitor.freeze)
+        self.gc_monitor = gc_monitor
+        self.gc_freeze = gc_freeze and gc_monitor is not None
+        # The amount of text messages skipped as copies of recent ones (see
+        # Reader.learn) since the bot started, and their characters
+        self.suppressed = 0
+        self.suppressed_chars = 0
+        # The announcement being sent, if any
+        self.announcement = None
+        self.announcement_lock = threading.Lock()
 
-    # Sends an announcement to all chats that pass the check
+    # Sends an announcement in the background to all stored chats whose Metadata
+    # passes the check. Returns False if there's already an announcement going on
     def announce(self, bot, announcement, check=(lambda _: True)):
-        for reader in self.readers_pass():
-            try:
-                if check(reader):
-                    send(bot, reader.cid(), announcement)
-                    self.logger.info("Sending announcement to chat {}".format(reader.cid()))
-            except Exception:
-                pass
+        targets = [meta.id for meta in self.cards_pass() if check(meta)]
+        job = Announcement(announcement, targets, self.logger, self.store_announcement_file)
+        return self.start_announcement(bot, job)
+
+    # Resumes in the background the announcement that was going on when the bot
+    # stopped, if any. Returns False if there was none
+    def resume_announcement(self, bot):
+        state = self.load_announcement_file()
+        if state is None:
+            return False
+        job = Announcement.FromState(state, self.logger, self.store_announcement_file)
+        self.logger.info("Resuming announcement: {}".format(job))
+        return self.start_announcement(bot, job)
+
+    def start_announcement(self, bot, job):
+        with self.announcement_lock:
+            if self.announcement is not None:
+                return False
+            self.announcement = job
+        thread = threading.Thread(target=self.run_announcement, args=(bot, job),
+                                  name="announcement", daemon=True)
+        thread.start()
+        return True
+
+    # Sends the announcement, and reports the results to the bot admin
+    def run_announcement(self, bot, job):
+        try:
+            counts = job.run(bot, self.announce_limiter, self.announce_workers)
+            report = "Announcement finished: {} delivered, {} failed, {} blocked.".format(
+                counts[Announcement.DELIVERED], counts[Announcement.FAILED], counts[Announcement.BLOCKED])
+            send(bot, self.admin, report, logger=self.logger)
+        except Exception as e:
+            self.logger.error("Announcement caused exception:")
+            self.logger.exception(e)
+        finally:
+            with self.announcement_lock:
+                self.announcement = None
+
+    # Handling /announce command (exclusive for bot admin)
+    # Sends the given text to all stored chats, or reports the current announcement's progress
+    def announce_command(self, update, context):
+        if update.message.from_user.id != self.admin:
+            return
+        words = update.message.text.split(maxsplit=1)
+        with self.announcement_lock:
+            job = self.announcement
+        if len(words) <= 1:
+            if job is None:
+                update.message.reply_text("There is no announcement going on.")
+            else:
+                counts = job.counts()
+                update.message.reply_text("Announcing: {} delivered, {} failed, {} blocked, {} pending.".format(
+                    counts[Announcement.DELIVERED], counts[Announcement.FAILED],
+                    counts[Announcement.BLOCKED], counts["pending"]))
+            return
+        if self.announce(context.bot, words[1]):
+            update.message.reply_text("Announcement started.")
+        else:
+            update.message.reply_text("There is already an announcement going on.")
 
     # If wakeup flag is set, sends a wake-up message as announcement to all chats that
     # are groups. Also, always sends a wakeup message to the 'bot admin'
@@ -129,27 +345,307 @@ class Speaker(object):
 
     # Looks up a reader in the memory list
     def get_reader(self, cid):
-        return self.memory.search(lambda r: r.cid() == cid, None)
+        with self.memory_lock:
+            return self.memory.search(lambda r: r.cid() == cid, None)
+
+    # Returns True if a reader is in the memory list, without counting it as accessed
+    def is_cached(self, cid):
+        with self.memory_lock:
+            return any(r.cid() == cid for r in self.memory)
+
+    # Marks a chat's reader as in use by the handlers inside this context. If
+    # it's pushed out of memory meanwhile (by a load in the I/O threads, or by
+    # another bot sharing the budget), storing it waits until the context is
+    # left, instead of racing with whatever the handlers do to it. Yields True
+    # if the reader is still in memory, as it may already be being stored
+    # otherwise, and then it has to be loaded again instead
+    @contextmanager
+    def in_use(self, reader):
+        cid = reader.cid()
+        with self.use_lock:
+            self.using[cid] = self.using.get(cid, 0) + 1
+        try:
+            with self.memory_lock:
+                cached = reader in self.memory
+            yield cached
+        finally:
+            with self.use_lock:
+                self.using[cid] -= 1
+                if self.using[cid] <= 0:
+                    del self.using[cid]
+                    self.use_lock.notify_all()
+
+    # Loads a chat's reader like load_reader, and keeps it in use inside this
+    # context (see in_use). The reader has to be loaded before it's marked, as
+    # its load may wait for the store of the chat's previous reader
+    @contextmanager
+    def use_reader(self, chat):
+        while True:
+            with span("load"):
+                reader = self.load_reader(chat)
+            with self.in_use(reader) as cached:
+                if cached:
+                    yield reader
+                    return
 
     # Looks up and returns a reader if it's in memory, or loads up a reader from
     # file, adds it to memory, and returns it. Any other reader pushed out of
-    # memory is saved to file
+    # memory is saved to file. If the chat is already being loaded, it waits
+    # for that same load instead of starting another one
     def load_reader(self, chat):
+        reader = self.get_reader(str(chat.id))
+        if reader is not None:
+            return reader
+        with self.io_lock:
+            if self.closing:
+                # The thread pool is done, so it's loaded right here
+                future = None
+            else:
+                future = self.start_load(chat)
+        if future is None:
+            return self.load_into_memory(chat)
+        return future.result()
+
+    # Returns the future of a chat's reader being loaded into memory, and starts
+    # loading it in the I/O thread pool if it wasn't already. Call with io_lock held
+    def start_load(self, chat):
+        cid = str(chat.id)
+        future = self.loading.get(cid)
+        if future is None:
+            future = self.io_executor.submit(self.load_into_memory, chat)
+            self.loading[cid] = future
+            # Called right away, in this thread, if the load is already done
+            future.add_done_callback(lambda f: self.loaded(cid, f))
+        return future
+
+    # Called once a chat's reader is loaded (or failed to). Puts the updates
+    # waiting for it back into their update queue, in the order they came
+    def loaded(self, cid, future):
+        with self.io_lock:
+            self.loading.pop(cid, None)
+            waiting = self.waiting.pop(cid, [])
+            if future.exception() is not None:
+                self.failed[cid] = future.exception()
+            else:
+                self.failed.pop(cid, None)
+            if len(waiting) > 0:
+                self.draining[cid] = self.draining.get(cid, 0) + len(waiting)
+                self.redispatched.update(update.update_id for update, update_queue in waiting)
+        if future.exception() is not None:
+            self.logger.error("Failed loading chat {}:".format(cid))
+            self.logger.exception(future.exception())
+        for update, update_queue in waiting:
+            update_queue.put(update)
+
+    # Returns True if the update's chat is not in memory yet: the update is then
+    # queued until its reader is loaded in the background, and put back into
+    # the update queue, so the handlers' thread can go on with other chats.
+    # Updates that come while it's waiting, or while the waiting ones are
+    # handled, are put back into the queue behind them, keeping their order
+    def defer(self, update, context):
+        chat = update.message.chat
+        cid = str(chat.id)
+        self.update_queue = context.update_queue
+        with self.io_lock:
+            self.requeued.discard(update.update_id)
+            if update.update_id in self.redispatched:
+                self.redispatched.discard(update.update_id)
+                self.draining[cid] -= 1
+                if self.draining[cid] <= 0:
+                    del self.draining[cid]
+                # If it was pushed out of memory again meanwhile, it's loaded right away
+                return False
+            if cid in self.draining:
+                self.requeued.add(update.update_id)
+                context.update_queue.put(update)
+                return True
+            if cid not in self.loading and self.is_cached(cid):
+                return False
+            self.waiting.setdefault(cid, []).append((update, context.update_queue))
+            self.start_load(chat)
+        return True
+
+    # Loads a chat's reader from its file, or creates a new one if there's none,
+    # and adds it to memory. Any other reader pushed out of memory is stored
+    def load_into_memory(self, chat):
         cid = str(chat.id)
         reader = self.get_reader(cid)
         if reader is not None:
             return reader
 
-        reader = self.get_reader_file(cid)
-        if not reader:
-            reader = Reader.FromChat(chat, self.min_period, self.max_period, self.logger)
+        # Traced on its own when loaded by the I/O threads
+        with trace("load", bot=self.username, cid=cid):
+            with span("read_file"):
+                reader = self.read_file(cid)
+            if not reader:
+                reader = Reader.FromChat(chat, self.min_period, self.max_period, self.logger, self.order)
+            else:
+                with span("freeze_gc"):
+                    self.freeze_gc()
+            note(vocab_bytes=reader.size)
 
-        old_reader = self.memory.add(reader)
-        if old_reader is not None:
-            old_reader.commit_memory()
-            self.store(old_reader)
+            with self.memory_lock:
+                # The warm up thread may have loaded it in the meantime
+                cached = self.get_reader(cid)
+                if cached is not None:
+                    return cached
+                old_readers = self.memory.add(reader)
+            with span("evict"):
+                self.evict(old_readers)
+                if self.shared_budget is not None:
+                    self.trim_memory()
 
-        return reader
+            return reader
+
+    # Stores the readers pushed out of memory in the I/O thread pool. Until a
+    # reader is stored, loading that chat waits for it (see read_file)
+    def evict(self, readers):
+        for reader in readers:
+            self.logger.info("Evicting chat %s (~%s) from memory.", reader.cid(), format_bytes(reader.size()))
+            cid = reader.cid()
+            with self.io_lock:
+                previous = self.storing.get(cid)
+                if not self.closing:
+                    future = self.io_executor.submit(self.store_evicted, reader, previous)
+                    self.storing[cid] = future
+            if self.closing:
+                self.store_evicted(reader, previous)
+                continue
+            future.add_done_callback(lambda f, cid=cid: self.stored(cid, f))
+
+    # Stores an evicted reader, after any previous store of the same chat
+    def store_evicted(self, reader, previous=None):
+        with trace("store", bot=self.username, cid=reader.cid(), vocab_bytes=reader.size):
+            if previous is not None:
+                with span("wait_store"):
+                    previous.exception()
+            # Not while the handlers still use it (see in_use)
+            with span("wait_use"):
+                with self.use_lock:
+                    while reader.cid() in self.using:
+                        self.use_lock.wait()
+            try:
+                self.store(reader)
+            except Exception as e:
+                note(error=type(e).__name__)
+                self.logger.error("Failed storing evicted chat {}:".format(reader.cid()))
+                self.logger.exception(e)
+
+    # Called once an evicted reader is stored
+    def stored(self, cid, future):
+        with self.io_lock:
+            if self.storing.get(cid) is future:
+                del self.storing[cid]
+
+    # Loads a reader from its file, once any pending store of that chat is done
+    def read_file(self, cid):
+        with self.io_lock:
+            pending = self.storing.get(cid)
+        if pending is not None:
+            with span("wait_store"):
+                pending.exception()
+        return self.get_reader_file(cid)
+
+    # Pushes out of memory the least recently used readers that don't fit the
+    # budget anymore, since readers grow as they learn. With a shared budget,
+    # the readers pushed out may belong to other bots, and are stored by them
+    def trim_memory(self):
+        with self.memory_lock:
+            evictions = [(self.evict, self.memory.trim())]
+            if self.shared_budget is not None:
+                evictions += self.shared_budget.trim()
+        for evict, readers in evictions:
+            evict(readers)
+
+    # Returns True if there's no room left in memory for another reader
+    # without pushing another one out
+    def memory_full(self):
+        with self.memory_lock:
+            if self.shared_budget is not None and self.shared_budget.full():
+                return True
+            return self.memory.full()
+
+    # Adds a reader to memory only if there's room for it without pushing
+    # anything else out. Returns True if it was added
+    def memory_add_cold(self, reader):
+        with self.memory_lock:
+            if self.shared_budget is not None and not self.shared_budget.fits(self.memory.sizeof(reader)):
+                return False
+            return self.memory.add_cold(reader)
+
+    # Returns the estimated size of each reader in memory, largest first, and their total
+    def memory_usage(self):
+        with self.memory_lock:
+            sizes = [(reader.cid(), reader.title(), size) for reader, size in self.memory.sizes()]
+        sizes.sort(key=lambda s: s[2], reverse=True)
+        return sizes, sum(s[2] for s in sizes)
+
+    # Stores the IDs of the chats in memory, most recently accessed first, so
+    # they can be preloaded the next time the bot starts
+    def store_hot(self):
+        with self.memory_lock:
+            cids = [reader.cid() for reader in reversed(self.memory)]
+        self.store_hot_file(cids)
+
+    # Starts preloading in the background the chats that were in memory the last
+    # time the bot stopped. Returns the preloading thread (or the future, with a
+    # shared thread pool), if any
+    def warm_up(self):
+        cids = self.load_hot_file()
+        if len(cids) == 0:
+            return None
+        if self.executor is not None:
+            return self.executor.submit(self.preload, cids)
+        thread = threading.Thread(target=self.preload, args=(cids,), name="warm_up", daemon=True)
+        thread.start()
+        return thread
+
+    # Loads the given chats into memory in priority order, as long as there's room
+    # for them. Chats already loaded by a handler are skipped, and preloaded chats
+    # are queued behind them, so they never push out a chat that is in use
+    def preload(self, cids):
+        self.logger.info("Preloading {} chats...".format(len(cids)))
+        start = time.perf_counter()
+        loaded = 0
+        for cid in cids:
+            if self.is_cached(cid):
+                continue
+            if self.memory_full():
+                break
+            try:
+                reader = self.read_file(cid)
+            except Exception as e:
+                self.logger.error("Failed preloading chat {}".format(cid))
+                self.logger.exception(e)
+                continue
+            if reader is None:
+                continue
+            with self.memory_lock:
+                if not self.is_cached(cid) and self.memory_add_cold(reader):
+                    loaded += 1
+        elapsed = time.perf_counter() - start
+        self.logger.info("Preloaded {} chats in {:.2f}s.".format(loaded, elapsed))
+        self.freeze_gc()
+
+    # Moves the vocabularies loaded so far out of the garbage collector's reach,
+    # if enabled, so full collections don't have to go through them again
+    def freeze_gc(self):
+        if not self.gc_freeze:
+            return
+        start = time.perf_counter()
+        frozen = self.gc_monitor.freeze()
+        self.logger.debug("Froze {} objects out of the garbage collector in {:.3f}s.".format(
+            frozen, time.perf_counter() - start))
+
+    # Collects the garbage frozen along with the vocabularies since the last
+    # save, if freezing them is enabled (see GCMonitor.refreeze)
+    def refreeze_gc(self):
+        if not self.gc_freeze:
+            return
+        start = time.perf_counter()
+        frozen = self.gc_monitor.refreeze()
+        self.logger.info("Collected the garbage frozen since the last save, {} objects frozen, in {:.3f}s.".format(
+            frozen, time.perf_counter() - start))
 
     # Returns a reader if it's in memory, or loads it up from a file and returns
     # it otherwise. Does NOT add the Reader to memory
@@ -157,18 +653,13 @@ class Speaker(object):
     def access_reader(self, cid):
         reader = self.get_reader(cid)
         if reader is None:
-            return self.get_reader_file(cid)
+            return self.read_file(cid)
         return reader
 
     # Returns True if the bot's username is called, or if one of the nicknames is
     # mentioned and they're not another user's username
     def mentioned(self, text):
-        if self.username in text:
-            return True
-        for name in self.names:
-            if name in text and "@{}".format(name) not in text:
-                return True
-        return False
+        return self.matcher.mentioned(text)
 
     # Returns True if not enough time has passed since the last mute timestamp
     def is_mute(self):
@@ -176,117 +667,400 @@ class Speaker(object):
         return self.mute_timer is not None and (current_time - self.mute_timer) < self.mute_time
 
     # Series of checks to determine if the bot should reply to a specific message, aside
-    # from the usual periodic messages
-    def should_reply(self, message, reader):
+    # from the usual periodic messages. The mention check can be given if it was
+    # already matched
+    def should_reply(self, message, reader, mentioned=None):
         if self.is_mute():
             # Not if mute time hasn't finished
             return False
         if not self.bypass and reader.is_restricted():
             # If we're not in testing mode and the chat is restricted
-            user = message.chat.get_member(message.from_user.id)
-            if not self.user_is_admin(user):
+            if not self.user_is_admin(message.chat, message.from_user):
                 # ...And the user has no permissions, should not reply
                 return False
 
         # otherwise (testing mode, or the chat is unrestricted, or the user has permissions)
         replied = message.reply_to_message
-        text = message.text.casefold() if message.text else ""
+        if mentioned is None:
+            mentioned = self.mentioned(message.text)
         # Only if it's a reply to a message of ours or the bot is mentioned in the message
         return (((replied is not None) and (replied.from_user.name == self.username))
-                or (self.mentioned(text)))
+                or mentioned)
 
+    # Stores whatever changed in a Reader since it was last stored, if anything.
+    # Returns the amount of files written
     def store(self, reader):
         if reader is None:
             raise ValueError("Tried to store a None Reader.")
-        else:
-            self.store_file(*reader.archive())
+        with span("dump"):
+            changes = reader.archive_changes()
+        if changes is None:
+            return 0
+        self.store_file(*changes)
+        reader.mark_clean()
+        # The card is always written, the vocabulary only if it changed
+        return 1 if changes[2] is None else 2
+
+    # Stores all the changed Readers in memory, and reports the writes and the time spent
+    def store_all(self):
+        with self.memory_lock:
+            readers = list(self.memory)
+        start = time.perf_counter()
+        stored = 0
+        writes = 0
+        for reader in readers:
+            written = self.store(reader)
+            if written > 0:
+                stored += 1
+                writes += written
+        elapsed = time.perf_counter() - start
+        self.logger.info("Stored {} of {} chats in memory ({} file writes) in {:.3f}s.".format(
+            stored, len(readers), writes, elapsed))
+        sizes, total = self.memory_usage()
+        self.logger.info("Memory usage: ~{} in {} chats{}.".format(
+            format_bytes(total), len(sizes), self.budget_text()))
+        if self.suppressed > 0:
+            self.logger.info("Skipped {} copied messages ({} characters) since start.".format(
+                self.suppressed, self.suppressed_chars))
+        if self.gc_monitor is not None:
+            for line in self.gc_monitor.summary():
+                self.logger.info("Garbage collector {}.".format(line))
+        busiest = self.speak_budget.usage(top=1)
+        if len(busiest) > 0:
+            self.logger.info("Busiest chat: [{}] - {}.".format(busiest[0][0], format_usage(busiest[0][1])))
+        return writes
+
+    # The memory budget, as text to append to usage reports
+    def budget_text(self):
+        if self.shared_budget is not None:
+            with self.memory_lock:
+                budget, usage = self.shared_budget.budget(), self.shared_budget.usage()
+            return " (~{} of the shared budget {} in use by all bots)".format(
+                format_bytes(usage), format_bytes(budget)) if budget > 0 else ""
+        budget = self.memory.budget()
+        return " (budget {})".format(format_bytes(budget)) if budget > 0 else ""
+
+    # The generation budget, as text to append to usage reports
+    def speak_budget_text(self):
+        budget = self.speak_budget
+        if budget.budget <= 0:
+            return "no budget"
+        return "budget {:.1f}s per {}s".format(budget.budget, budget.period)
 
     # Check if enough time for saving memory has passed
     def should_save(self):
         current_time = int(time.perf_counter())
         elapsed = (current_time - self.memory_timer)
-        self.logger.debug("Save check: {}".format(elapsed))
+        self.logger.debug("Save check: %s", elapsed)
         return elapsed >= self.save_time
 
     # Save all Readers in memory to files if it's save time
     def save(self):
         if self.should_save():
             self.logger.info("Saving chats in memory...")
-            for reader in self.memory:
-                self.store(reader)
+            self.store_all()
+            self.trim_memory()
+            self.store_hot()
+            self.freeze()
+            self.refreeze_gc()
+            self.speak_budget.prune()
             self.memory_timer = time.perf_counter()
             self.logger.info("Chats saved.")
 
+    # Starts moving the chats that have been idle for too long into the cold
+    # archive in the I/O thread pool, if the last check was long enough ago and
+    # it's not still going on, as it may take a while on a big archive
+    def freeze(self):
+        if self.cold_after <= 0:
+            return
+        now = time.perf_counter()
+        if self.cold_timer is not None and now - self.cold_timer < Speaker.COLD_CHECK:
+            return
+        with self.io_lock:
+            if self.closing or (self.cold_future is not None and not self.cold_future.done()):
+                return
+            self.cold_timer = now
+            self.cold_future = self.io_executor.submit(self.freeze_idle)
+
+    # Moves the chats that have been idle for too long into the cold archive.
+    # Chats in memory are never moved. Stops early if the bot is shutting down
+    def freeze_idle(self):
+        with self.memory_lock:
+            cids = set(reader.cid() for reader in self.memory)
+        # Neither are the chats being loaded or stored in the background
+        with self.io_lock:
+            cids.update(self.loading)
+            cids.update(self.storing)
+        try:
+            self.freeze_file(self.cold_after, exclude=cids, stop=lambda: self.closing)
+        except Exception as e:
+            self.logger.error("Failed freezing idle chats.")
+            self.logger.exception(e)
+
+    # Commits the pending messages of the chats in memory that waited for
+    # their commit time, including chats that went quiet since, which would
+    # otherwise keep them pending until their next message or the next save
+    def commit_due(self):
+        now = time.perf_counter()
+        if now - self.pending_timer < Speaker.COMMIT_CHECK:
+            return
+        self.pending_timer = now
+        with self.memory_lock:
+            readers = [reader for reader in self.memory if reader.should_commit()]
+        for reader in readers:
+            with self.in_use(reader) as cached:
+                if cached:
+                    reader.commit_memory()
+
+    # Packs the chats in memory that have been idle for long enough into their
+    # compact frozen form, so more of them fit in the memory budget. They keep
+    # talking as usual, and thaw when they learn again
+    def compact(self):
+        if self.freeze_time <= 0:
+            return
+        now = time.perf_counter()
+        if now - self.freeze_timer < Speaker.FREEZE_CHECK:
+            return
+        self.freeze_timer = now
+        with self.memory_lock:
+            readers = [reader for reader in self.memory
+                       if not reader.is_frozen() and reader.idle_time() >= self.freeze_time]
+        if len(readers) == 0:
+            return
+        before = sum(reader.size() for reader in readers)
+        for reader in readers:
+            with self.in_use(reader) as cached:
+                if cached:
+                    reader.freeze()
+        after = sum(reader.size() for reader in readers)
+        self.logger.info("Froze {} idle chats in memory: ~{} -> ~{}, in {:.3f}s.".format(
+            len(readers), format_bytes(before), format_bytes(after), time.perf_counter() - now))
+
+    # Called once the bot stops polling. Flushes all pending changes
+    def shutdown(self):
+        self.logger.info("Shutting down, saving chats in memory...")
+        # Loads and stores still going on are finished before anything else
+        with self.io_lock:
+            self.closing = True
+        if self.own_io:
+            self.io_executor.shutdown(wait=True)
+        else:
+            self.wait_io()
+        for cid in list(self.batches):
+            self.flush(cid, self.batch_bot)
+        self.drain()
+        self.store_all()
+        self.store_hot()
+
+    # Waits for this bot's loads, stores and cold archive pass going on in the
+    # shared thread pool, which goes on working for the other bots
+    def wait_io(self):
+        while True:
+            with self.io_lock:
+                pending = list(self.loading.values()) + list(self.storing.values())
+                if self.cold_future is not None:
+                    pending.append(self.cold_future)
+            pending = [future for future in pending if not future.done()]
+            if len(pending) == 0:
+                return
+            wait(pending)
+
+    # Reads the messages that were set aside (see defer) and put back into the
+    # update queue, but not handled before the bot stopped. Those would be
+    # lost otherwise, as they were already taken from Telegram
+    def drain(self):
+        if self.update_queue is None:
+            return
+        drained = []
+        while True:
+            try:
+                update = self.update_queue.get_nowait()
+            except queue.Empty:
+                break
+            uid = getattr(update, "update_id", None)
+            if uid in self.redispatched or uid in self.requeued:
+                drained.append(update)
+        for update in drained:
+            self.ingest([update], self.batch_bot)
+        if len(drained) > 0:
+            self.logger.info("Read {} messages set aside before stopping.".format(len(drained)))
+
     # Reads a non-command message
+    # Messages are not handled right away, but gathered by chat (see flush_batches)
     def read(self, update, context):
-        # Check for save time
-        self.save()
-
         # Ignore non-message updates
         if update.message is None:
             return
 
-        chat = update.message.chat
-        reader = self.load_reader(chat)
-        reader.read(update.message)
+        # Chats not in memory are loaded in the background, and their updates
+        # come back once they are
+        if self.defer(update, context):
+            return
+        cid = str(update.message.chat.id)
+        batch = self.batches.get(cid)
+        if batch is None:
+            batch = self.batches[cid] = []
+            self.batch_timers[cid] = time.perf_counter()
+        batch.append(update)
+        self.batch_bot = context.bot
+        if len(batch) >= self.batch_size:
+            self.flush(cid, context.bot)
 
-        # Check if it's a "replyable" message & roll the chance to do so
-        if self.should_reply(update.message, reader) and reader.is_answering():
-            self.say(context.bot, reader, replying=update.message.message_id)
+    # Called after every update. Handles the gathered messages of every chat if
+    # there are no more updates waiting in the queue (so an isolated message is
+    # never delayed), and otherwise the ones of the chats whose oldest gathered
+    # message has waited for batch_window seconds. During bursts, this turns
+    # many passes through the same chat into a single one
+    def flush_batches(self, update, context):
+        if len(self.batches) == 0:
             return
+        idle = context.update_queue.empty()
+        now = time.perf_counter()
+        for cid in list(self.batches):
+            if idle or now - self.batch_timers[cid] >= self.batch_window:
+                self.flush(cid, context.bot)
 
-        # Update the Reader's title if it has changed since the last message read
-        title = get_chat_title(update.message.chat)
-        if title != reader.title():
-            reader.set_title(title)
+    # Handles the gathered messages of a chat. If the chat was pushed out of
+    # memory while they were gathered, they are set aside again until it's
+    # loaded back in the background, instead of loading it right here. If it
+    # couldn't be loaded, they are dropped, and its next message tries again
+    def flush(self, cid, bot):
+        updates = self.batches.pop(cid, None)
+        self.batch_timers.pop(cid, None)
+        if not updates:
+            return
+        with self.io_lock:
+            if not self.closing and self.update_queue is not None and self.get_reader(cid) is None:
+                if self.failed.pop(cid, None) is not None:
+                    self.logger.error("Dropped {} messages from chat {}, which failed to load.".format(
+                        len(updates), cid))
+                    return
+                self.waiting.setdefault(cid, []).extend((update, self.update_queue) for update in updates)
+                if cid not in self.loading:
+                    self.start_load(updates[0].message.chat)
+                return
+        self.ingest(updates, bot)
+
+    # Reads a batch of messages from the same chat, in a single pass: the save
+    # and idle checks, the reader lookup, and the title update are done once,
+    # while every message is learned, counted and rolled for a reply in order,
+    # just as if they were handled one by one
+    def ingest(self, updates, bot):
+        cid = str(updates[0].message.chat.id)
+        with trace("update", bot=self.username, cid=cid, messages=len(updates)):
+            # Check for save time
+            with span("save"):
+                self.save()
+            # Check for idle chats to pack, and for pending messages due
+            with span("compact"):
+                self.compact()
+                self.commit_due()
+
+            # The reader stays in use until the whole batch is read
+            with self.use_reader(updates[0].message.chat) as reader:
+                note(vocab_bytes=reader.size, chats_in_memory=len(self.memory))
+                last_chat = None
+                for update in updates:
+                    message = update.message
+                    # Match the bot's names once, for both learning and replying
+                    mentioned, summon = self.matcher.match(message.text)
+                    with span("read"):
+                        suppressed = reader.read(message, summon)
+                    if suppressed:
+                        self.suppressed += 1
+                        self.suppressed_chars += len(message.text)
 
-        # Decrease the countdown for the chat, and send a message if it reached 0
-        reader.countdown -= 1
-        if reader.countdown < 0:
-            reader.reset_countdown()
-            # Random chance to reply to a recent message
-            rid = reader.random_memory() if random.random() <= self.reply else None
-            self.say(context.bot, reader, replying=rid)
+                    # Check if it's a "replyable" message & roll the chance to do so
+                    if self.should_reply(message, reader, mentioned) and reader.is_answering():
+                        self.say(bot, reader, replying=message.message_id, seed=message.text, priority=True)
+                        continue
+
+                    # The chat as of the last message that wasn't replied to
+                    last_chat = message.chat
+
+                    # Decrease the countdown for the chat, and send a message if it reached 0
+                    reader.countdown -= 1
+                    if reader.countdown < 0 and not self.speak_budget.allow(reader.cid()):
+                        # Over budget, the message is due again at the chat's next message
+                        reader.countdown = 0
+                        self.speak_budget.defer(reader.cid())
+                    elif reader.countdown < 0:
+                        reader.reset_countdown()
+                        # Random chance to reply to a recent message
+                        rid = reader.random_memory() if random.random() <= self.reply else None
+                        self.say(bot, reader, replying=rid)
+
+                # Update the Reader's title if it has changed since the last message read
+                if last_chat is not None:
+                    title = get_chat_title(last_chat)
+                    if title != reader.title():
+                        reader.set_title(title)
 
     # Handles /speak command
     def speak(self, update, context):
         chat = (update.message.chat)
-        reader = self.load_reader(chat)
+        with self.use_reader(chat) as reader:
+            if not self.bypass and reader.is_restricted():
+                if not self.user_is_admin(update.message.chat, update.message.from_user):
+                    # update.message.reply_text("You do not have permissions to do that.")
+                    return
 
-        if not self.bypass and reader.is_restricted():
-            user = update.message.chat.get_member(update.message.from_user.id)
-            if not self.user_is_admin(user):
-                # update.message.reply_text("You do not have permissions to do that.")
-                return
+            mid = str(update.message.message_id)
+            replied = update.message.reply_to_message
+            # Reply to the message that the command replies to, otherwise to the command itself
+            rid = replied.message_id if replied else mid
+            words = update.message.text.split()
+            if len(words) > 1:
+                reader.read(' '.join(words[1:]))
+            success = self.say(context.bot, reader, replying=rid, seed=(replied.text if replied else None),
+                               priority=True)
+            if not success:
+                empty_gen_warning = "I haven't learned a single word yet."
+                send(context.bot, reader.cid(), empty_gen_warning, replying=rid, logger=self.logger)
 
-        mid = str(update.message.message_id)
-        replied = update.message.reply_to_message
-        # Reply to the message that the command replies to, otherwise to the command itself
-        rid = replied.message_id if replied else mid
-        words = update.message.text.split()
-        if len(words) > 1:
-            reader.read(' '.join(words[1:]))
-        success = self.say(context.bot, reader, replying=rid)
-        if not success:
-            empty_gen_warning = "I haven't learned a single word yet."
-            send(context.bot, reader.cid(), empty_gen_warning, replying=rid, logger=self.logger)
-
-    # Checks user permissions. Bot admin is always considered as having full permissions
-    def user_is_admin(self, member):
-        self.logger.info("user {} ({}) requesting a restricted action".format(str(member.user.id), member.user.name))
+    # Checks user permissions in a chat. Bot admin is always considered as having full permissions
+    def user_is_admin(self, chat, user):
+        self.logger.info("user %s (%s) requesting a restricted action", user.id, user.name)
         # eprint('!')
         # self.logger.info("Bot Creator ID is {}".format(str(self.admin)))
-        return ((member.status == 'creator')
-                or (member.status == 'administrator')
-                or (member.user.id == self.admin))
+        return ((user.id == self.admin)
+                or self.admins.is_admin(chat, user.id))
+
+    # Handles chat member updates, dropping the chat's cached administrators
+    # whenever someone's status changes
+    def member_update(self, update, context):
+        member_update = update.chat_member or update.my_chat_member
+        if member_update is None:
+            return
+        old_status = member_update.old_chat_member.status
+        new_status = member_update.new_chat_member.status
+        if old_status != new_status:
+            self.admins.invalidate(member_update.chat.id)
+
+    # Generate speech (message), starting from a word of the seed text (if
+    # any) as often as set by seed_replies
+    def speech(self, reader, seed=None):
+        if seed is not None and random.random() >= self.seed_replies:
+            seed = None
+        return reader.generate_message(self.max_len, seed=seed)
 
-    # Generate speech (message)
-    def speech(self, reader):
-        return reader.generate_message(self.max_len)
+    # Waits for the shared outbound rate limiter, if any. Returns the time (in
+    # s) waited, which isn't charged to any chat's budget
+    def throttle(self):
+        if self.send_limiter is None:
+            return 0
+        start = time.perf_counter()
+        self.send_limiter.acquire()
+        return time.perf_counter() - start
 
     # Say a newly generated message. Returns True if it could generate a response (even
-    # if it failed to send it)
-    def say(self, bot, reader, replying=None, **kwargs):
+    # if it failed to send it). A reply starts from a word of the seed text, or
+    # of the message it replies to if it's still in short term memory. The time
+    # spent generating and sending (but not waiting for the rate limiter) is
+    # charged to the chat's budget. A repeated message is only sent if the chat
+    # has budget left after the first one. Messages the chat asked for (a
+    # mention or /speak) are marked as priority in the traces
+    def say(self, bot, reader, replying=None, seed=None, priority=False, **kwargs):
         cid = reader.cid()
         if self.cid_whitelist is not None and cid not in self.cid_whitelist:
             # Don't, if there's a whitelist and this chat is not in it
@@ -294,36 +1068,65 @@ class Speaker(object):
         if self.is_mute():
             # Don't, if mute time isn't over
             return
-        try:
-            new_msg = self.speech(reader)
-            if new_msg == "":
-                return False
-            send(bot, cid, new_msg, replying, logger=self.logger, **kwargs)
-            if self.bypass:
-                # Testing mode, force a reasonable period (to not have the bot spam one specific chat with a low period)
-                minp = self.min_period
-                maxp = self.max_period
-                rangep = maxp - minp
-                reader.set_period(random.randint(rangep // 4, rangep) + minp)
-            if random.random() <= self.repeat:
-                new_msg = self.speech(reader)
-                send(bot, cid, new_msg, logger=self.logger, **kwargs)
-        # Consider any Network Error as a Telegram temporary ban, as I couldn't find
-        # out in the documentation how error 429 is handled by python-telegram-bot
-        except NetworkError as e:
-            self.logger.error("Sending a message caused network error:")
-            self.logger.exception(e)
-            self.logger.error("Going mute for {} seconds.".format(self.mute_time))
-            self.mute_timer = int(time.perf_counter())
-        except Exception as e:
-            self.logger.error("Sending a message caused exception:")
-            self.logger.exception(e)
-        return True
+        with trace("say", bot=self.username, cid=cid, priority=priority):
+            start = time.perf_counter()
+            waited = 0
+            sent = 0
+            try:
+                if seed is None and replying is not None:
+                    seed = reader.recall(replying)
+                if seed is not None:
+                    # Starting a reply with the bot's own name would be silly
+                    seed = self.matcher.strip(seed)
+                with span("generate"):
+                    new_msg = self.speech(reader, seed)
+                if new_msg == "":
+                    return False
+                with span("throttle"):
+                    waited += self.throttle()
+                with span("send"):
+                    send(bot, cid, new_msg, replying, logger=self.logger, **kwargs)
+                sent += 1
+                if self.bypass:
+                    # Testing mode, force a reasonable period (to not have the bot spam one specific chat with a low period)
+                    minp = self.min_period
+                    maxp = self.max_period
+                    rangep = maxp - minp
+                    reader.set_period(random.randint(rangep // 4, rangep) + minp)
+                if random.random() <= self.repeat:
+                    self.speak_budget.charge(cid, time.perf_counter() - start - waited, sent)
+                    start = time.perf_counter()
+                    waited = 0
+                    sent = 0
+                    if self.speak_budget.allow(cid):
+                        with span("generate"):
+                            new_msg = self.speech(reader)
+                        with span("throttle"):
+                            waited += self.throttle()
+                        with span("send"):
+                            send(bot, cid, new_msg, logger=self.logger, **kwargs)
+                        sent += 1
+                    else:
+                        self.speak_budget.drop(cid)
+            # Consider any Network Error as a Telegram temporary ban, as I couldn't find
+            # out in the documentation how error 429 is handled by python-telegram-bot
+            except NetworkError as e:
+                note(error=type(e).__name__)
+                self.logger.error("Sending a message caused network error:")
+                self.logger.exception(e)
+                self.logger.error("Going mute for {} seconds.".format(self.mute_time))
+                self.mute_timer = int(time.perf_counter())
+            except Exception as e:
+                note(error=type(e).__name__)
+                self.logger.error("Sending a message caused exception:")
+                self.logger.exception(e)
+            finally:
+                self.speak_budget.charge(cid, time.perf_counter() - start - waited, sent)
+            return True
 
     # Handling /count command
     def get_count(self, update, context):
-        cid = str(update.message.chat.id)
-        reader = self.load_reader(cid)
+        reader = self.load_reader(update.message.chat)
 
         num = str(reader.count()) if reader else "no"
         update.message.reply_text("I remember {} messages.".format(num))
@@ -334,11 +1137,60 @@ class Speaker(object):
         chat_list = "\n".join(lines)
         update.message.reply_text("I have the following chats:\n\n" + chat_list)
 
+    # Handling /stats command (exclusive for bot admin)
+    # Reports the vocabulary counters of this chat, the largest chats, and all of them
+    # together, from the stored cards (or the chats in memory) without loading any vocabulary.
+    # Chats whose cards have no counters yet (see Metadata.stats) are left out of the totals
+    def get_stats(self, update, context, top=10):
+        if update.message.from_user.id != self.admin:
+            return
+        cid = str(update.message.chat.id)
+        with self.memory_lock:
+            chats = {reader.cid(): (reader.title(), reader.stats()) for reader in self.memory}
+            suppressed = sum(reader.suppressed for reader in self.memory if reader.cid() == cid)
+        for meta in self.cards_pass():
+            if meta.id not in chats:
+                chats[meta.id] = (meta.title, meta.stats)
+
+        unknown = sum(1 for title, stats in chats.values() if stats is None)
+        chats = {chat: (title, stats) for chat, (title, stats) in chats.items() if stats is not None}
+        total = {"messages": 0, "keys": 0, "transitions": 0, "bytes": 0}
+        for title, stats in chats.values():
+            for key in total:
+                total[key] += stats[key]
+
+        lines = []
+        if cid in chats:
+            lines.append("This chat: " + format_stats(chats[cid][1]))
+        lines.append("All {} chats: {}".format(len(chats), format_stats(total)))
+        if unknown > 0:
+            lines.append("Not counted: {} chats with cards older than v6, until they are stored again".format(unknown))
+        lines.append("Copies skipped: {} in this chat since loaded, {} ({} characters) in all chats since start".format(
+            suppressed, self.suppressed, self.suppressed_chars))
+        largest = sorted(chats.items(), key=lambda c: c[1][1]["bytes"], reverse=True)[:top]
+        if len(largest) > 0:
+            lines.append("\nLargest chats:")
+            for cid, (title, stats) in largest:
+                lines.append("[{}]: {} - {}".format(cid, title, format_stats(stats)))
+        sizes, total = self.memory_usage()
+        lines.append("\nIn memory: ~{} in {} chats{}".format(format_bytes(total), len(sizes), self.budget_text()))
+        for cid, title, size in sizes[:top]:
+            lines.append("[{}]: {} - ~{}".format(cid, title, format_bytes(size)))
+        if self.gc_monitor is not None:
+            lines.append("\nGarbage collector pauses:")
+            lines.extend(self.gc_monitor.summary())
+        usage = self.speak_budget.usage(top=top)
+        if len(usage) > 0:
+            lines.append("\nGeneration time ({}):".format(self.speak_budget_text()))
+            for cid, chat_usage in usage:
+                lines.append("[{}]: {}".format(cid, format_usage(chat_usage)))
+        update.message.reply_text("\n".join(lines))
+
     # Handling /period command
     # Print the current period or set a new one if one is given
     def period(self, update, context):
         chat = update.message.chat
-        reader = self.load_reader(str(chat.id))
+        reader = self.load_reader(chat)
 
         words = update.message.text.split()
         if len(words) <= 1:
@@ -346,8 +1198,7 @@ class Speaker(object):
             return
 
         if reader.is_restricted():
-            user = update.message.chat.get_member(update.message.from_user.id)
-            if not self.user_is_admin(user):
+            if not self.user_is_admin(update.message.chat, update.message.from_user):
                 update.message.reply_text("You do not have permissions to do that.")
                 return
         try:
@@ -361,7 +1212,7 @@ class Speaker(object):
     # Print the current answer probability or set a new one if one is given
     def answer(self, update, context):
         chat = update.message.chat
-        reader = self.load_reader(str(chat.id))
+        reader = self.load_reader(chat)
 
         words = update.message.text.split()
         if len(words) <= 1:
@@ -369,8 +1220,7 @@ class Speaker(object):
             return
 
         if reader.is_restricted():
-            user = update.message.chat.get_member(update.message.from_user.id)
-            if not self.user_is_admin(user):
+            if not self.user_is_admin(update.message.chat, update.message.from_user):
                 update.message.reply_text("You do not have permissions to do that.")
                 return
         try:
@@ -387,11 +1237,10 @@ class Speaker(object):
             update.message.reply_text("That only works in groups.")
             return
         chat = update.message.chat
-        user = chat.get_member(update.message.from_user.id)
-        reader = self.load_reader(str(chat.id))
+        reader = self.load_reader(chat)
 
         if reader.is_restricted():
-            if not self.user_is_admin(user):
+            if not self.user_is_admin(chat, update.message.from_user):
                 update.message.reply_text("You do not have permissions to do that.")
                 return
         reader.toggle_restrict()
@@ -405,11 +1254,10 @@ class Speaker(object):
             update.message.reply_text("That only works in groups.")
             return
         chat = update.message.chat
-        user = chat.get_member(update.message.from_user.id)
-        reader = self.load_reader(str(chat.id))
+        reader = self.load_reader(chat)
 
         if reader.is_restricted():
-            if not self.user_is_admin(user):
+            if not self.user_is_admin(chat, update.message.from_user):
                 update.message.reply_text("You do not have permissions to do that.")
                 return
         reader.toggle_silence()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram.error import BadRequest  # noqa: E402
+
+import admincache  # noqa: E402
+from admincache import AdminCache  # noqa: E402
+
+
+def member(uid, status):
+    return SimpleNamespace(user=SimpleNamespace(id=uid), status=status)
+
+
+# A chat that counts the calls made to Telegram
+class StubChat(object):
+    def __init__(self, cid, members, listable=True):
+        self.id = cid
+        self.members = members
+        self.listable = listable
+        self.listed = 0
+        self.asked = 0
+
+    def get_administrators(self):
+        self.listed += 1
+        if not self.listable:
+            raise BadRequest("There are no administrators in the private chat")
+        return [m for m in self.members if m.status in admincache.ADMIN_STATUSES]
+
+    def get_member(self, uid):
+        self.asked += 1
+        return next(m for m in self.members if m.user.id == uid)
+
+
+class AdminCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(admincache.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = AdminCache(ttl=60)
+        self.chat = StubChat(-100, [member(1, "creator"), member(2, "administrator"), member(3, "member")])
+
+    def test_cached_until_expired(self):
+        self.assertTrue(self.cache.is_admin(self.chat, 1))
+        self.assertTrue(self.cache.is_admin(self.chat, 2))
+        self.assertFalse(self.cache.is_admin(self.chat, 3))
+        self.assertEqual(self.chat.listed, 1)
+        self.now += 59
+        self.assertTrue(self.cache.is_admin(self.chat, 2))
+        self.assertEqual(self.chat.listed, 1)
+        # Expired
+        self.now += 1
+        self.assertIsNone(self.cache.cached(self.chat.id))
+        self.assertTrue(self.cache.is_admin(self.chat, 2))
+        self.assertEqual(self.chat.listed, 2)
+
+    def test_invalidate(self):
+        self.cache.is_admin(self.chat, 3)
+        self.chat.members[2] = member(3, "administrator")
+        self.assertFalse(self.cache.is_admin(self.chat, 3))
+        self.cache.invalidate(self.chat.id)
+        self.assertEqual(len(self.cache), 0)
+        self.assertTrue(self.cache.is_admin(self.chat, 3))
+        self.assertEqual(self.chat.listed, 2)
+
+    def test_unlistable_chat(self):
+        chat = StubChat(5, [member(5, "member")], listable=False)
+        self.assertFalse(self.cache.is_admin(chat, 5))
+        self.assertFalse(self.cache.is_admin(chat, 5))
+        # Nothing to cache, so each check asks for the member
+        self.assertEqual(chat.asked, 2)
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
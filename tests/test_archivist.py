@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from archivist import Archivist  # noqa: E402
+from generator import Generator  # noqa: E402
+from metadata import Metadata  # noqa: E402
+from reader import Reader  # noqa: E402
+
+MESSAGES = ["hello there", "there is no place like home", "hello again", "home sweet home"]
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="velasco_test_")
+        self.logger = logging.getLogger("test_archivist")
+        self.logger.setLevel(logging.CRITICAL)
+        self.source = Archivist(self.logger, os.path.join(self.root, "source"), ".json")
+        os.makedirs(self.source.chatdir)
+        self.tags = []
+        for i in range(6):
+            vocab = Generator()
+            for text in MESSAGES[i % len(MESSAGES):]:
+                vocab.add(text)
+            reader = Reader(Metadata(-1000 - i, "group", "Group {}".format(i)), vocab, 1, 100000, self.logger)
+            self.source.store(*reader.archive())
+            self.tags.append(reader.cid())
+        # Half of them idle for long enough to go into the cold archive
+        old = time.time() - 365 * 86400
+        for tag in self.tags[:3]:
+            os.utime(self.source.chat_file(tag=tag, file="card", ext=".txt"), (old, old))
+        self.hot = self.tags[-2:]
+        self.source.store_hot(self.hot)
+        self.source.freeze_idle(30 * 86400, exclude=set(self.hot))
+        self.path = os.path.join(self.root, "snapshot.tar.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def target(self):
+        return Archivist(self.logger, os.path.join(self.root, "target"), ".json")
+
+    def assertSameChat(self, target, tag):
+        restored = target.get_reader(tag, thaw=False)
+        original = self.source.get_reader(tag, thaw=False)
+        self.assertIsNotNone(restored, tag)
+        self.assertEqual(restored.vocab.dumps(), original.vocab.dumps())
+        self.assertEqual(restored.title(), original.title())
+
+    def test_export_and_restore(self):
+        self.assertEqual(self.source.export_snapshot(self.path), 3)
+        target = self.target()
+        self.assertEqual(target.restore_snapshot(self.path, workers=2), 3)
+        self.assertEqual(target.chat_count(), self.source.chat_count())
+        self.assertEqual(target.load_hot(), self.hot)
+        for tag in self.tags:
+            self.assertSameChat(target, tag)
+
+    def test_export_some(self):
+        # A chat in the cold archive is exported as a folder
+        tags = [self.tags[0], self.tags[-1], "-1"]
+        self.assertEqual(self.source.export_snapshot(self.path, tags), 2)
+        target = self.target()
+        target.restore_snapshot(self.path, workers=2)
+        for tag in tags[:2]:
+            self.assertSameChat(target, tag)
+        self.assertIsNone(target.get_reader(self.tags[1], thaw=False))
+
+    def test_not_a_snapshot(self):
+        with tarfile.open(self.path, "w:gz") as snapshot:
+            snapshot.add(os.path.abspath(__file__), arcname="test.py")
+        with self.assertRaises(ValueError):
+            self.target().start_restore(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
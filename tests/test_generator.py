@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generator import Generator  # noqa: E402
+
+MESSAGES = [
+    "hello there",
+    "Hello again, old friend",
+    "there is no place like home",
+    "the place is\nsplit over lines",
+    "hello",
+]
+
+
+# The vocabulary of a Generator, as plain dicts and lists. A thawed trie may
+# have its keys in another order than the one it was frozen from
+def plain(gen):
+    return json.loads(gen.dumps())
+
+
+def learned(order=Generator.ORDER):
+    gen = Generator(order=order)
+    for text in MESSAGES:
+        gen.add(text)
+    return gen
+
+
+class RoundTripTest(unittest.TestCase):
+    def assertSameVocabulary(self, gen, other):
+        self.assertEqual(plain(gen), plain(other))
+        self.assertEqual(gen.stats()["keys"], other.stats()["keys"])
+        self.assertEqual(gen.total(), other.total())
+        self.assertEqual(gen.messages, other.messages)
+
+    def test_dump_and_load(self):
+        for order in range(Generator.MIN_ORDER, Generator.MAX_ORDER + 1):
+            gen = learned(order)
+            self.assertSameVocabulary(gen, Generator.loads(gen.dumps(), order))
+
+    def test_dump_and_load_incremental(self):
+        for order in range(Generator.MIN_ORDER, Generator.MAX_ORDER + 1):
+            gen = learned(order)
+            dump = io.StringIO()
+            gen.dump(dump)
+            dump.seek(0)
+            self.assertSameVocabulary(gen, Generator.load_incremental(dump, order))
+
+    def test_load_empty_file(self):
+        gen = Generator.load_incremental(io.StringIO(""))
+        self.assertEqual(gen.total(), 0)
+
+    def test_freeze_and_thaw(self):
+        for order in range(Generator.MIN_ORDER, Generator.MAX_ORDER + 1):
+            gen = learned(order)
+            dump = plain(gen)
+            stats = gen.stats()
+            gen.freeze()
+            self.assertTrue(gen.is_frozen())
+            # A frozen Generator dumps the same vocabulary, and keeps it frozen
+            self.assertEqual(plain(gen), dump)
+            self.assertTrue(gen.is_frozen())
+            self.assertEqual(gen.total(), stats["transitions"])
+            for key in ("hello", "there", "place"):
+                gen.freeze()
+                frozen = gen.followers(key)
+                gen.thaw()
+                self.assertEqual(frozen, gen.followers(key))
+            self.assertFalse(gen.is_frozen())
+            self.assertEqual(plain(gen), dump)
+            self.assertEqual(gen.stats()["keys"], stats["keys"])
+
+    def test_learn_after_freeze(self):
+        gen = learned()
+        gen.freeze()
+        gen.add("something new")
+        self.assertFalse(gen.is_frozen())
+        other = learned()
+        other.add("something new")
+        self.assertEqual(plain(gen), plain(other))
+
+    def test_frozen_generates(self):
+        gen = learned()
+        gen.freeze()
+        words = set(" ".join(MESSAGES).split())
+        for i in range(20):
+            message = gen.generate(20)
+            self.assertTrue(set(message.split()) <= words, message)
+
+
+class SeedTest(unittest.TestCase):
+    def test_seed_starts_reply(self):
+        gen = learned()
+        for i in range(20):
+            # As written in the text
+            self.assertEqual(gen.generate(20, seed="PLACE").split()[0], "PLACE")
+        # Words the chain doesn't know start at random instead
+        for i in range(20):
+            words = gen.generate(20, seed="unknown words").split()
+            self.assertGreater(len(words), 0)
+            self.assertNotEqual(words[0], "unknown")
+
+    def test_seed_that_ends_messages(self):
+        # "friend" only ever ended a message, so it can't be a reply on its own
+        gen = learned()
+        for i in range(20):
+            words = gen.generate(20, seed="my friend").split()
+            self.assertEqual(words[0], "friend")
+            self.assertGreater(len(words), 1)
+        gen.freeze()
+        for i in range(20):
+            self.assertGreater(len(gen.generate(20, seed="friend").split()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hashwindow import HashWindow, fingerprint  # noqa: E402
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_same_message(self):
+        self.assertEqual(fingerprint("Hello, there!"), fingerprint("hello   THERE"))
+        self.assertEqual(fingerprint("hello there 🎉"), fingerprint("hello there"))
+        self.assertEqual(fingerprint("hello there")[1], 2)
+
+    def test_different_message(self):
+        self.assertNotEqual(fingerprint("hello there")[0], fingerprint("there hello")[0])
+        self.assertNotEqual(fingerprint("hello there")[0], fingerprint("hello the re")[0])
+
+
+class HashWindowTest(unittest.TestCase):
+    def test_seen(self):
+        window = HashWindow(3)
+        self.assertFalse(window.seen(1))
+        self.assertTrue(window.seen(1))
+        self.assertIn(1, window)
+        self.assertNotIn(2, window)
+
+    def test_window(self):
+        window = HashWindow(3)
+        for key in range(10):
+            window.seen(key)
+            self.assertLessEqual(len(window), 6)
+        # Remembered for at least `capacity` more insertions
+        for key in range(7, 10):
+            self.assertIn(key, window)
+        self.assertNotIn(0, window)
+        self.assertEqual(window.size(), len(window) * HashWindow.HASH_BYTES)
+
+    def test_repeated_is_kept(self):
+        window = HashWindow(2)
+        window.seen(0)
+        for key in range(1, 20):
+            window.seen(key)
+            # A message repeated over and over is never forgotten
+            self.assertTrue(window.seen(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
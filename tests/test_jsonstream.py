@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jsonstream import JSONStream  # noqa: E402
+
+DOCUMENT = {
+    "VERSION": 3,
+    "ORDER": 2,
+    "MESSAGES": 1234567890,
+    "CHAIN": {"hello": ["there", "again"], "there": {" ": ["is"], "hello": ["^MESSAGE_SEPARATOR^"]}},
+    "MEDIA": ["a" * 100, "b"],
+    "EMPTY": {},
+}
+
+
+# Reads an object with JSONStream, walking into the nested objects key by key
+def walk(stream):
+    result = {}
+    for key in stream.keys():
+        if stream.peek() == "{":
+            result[key] = walk(stream)
+        else:
+            result[key] = stream.value()
+    return result
+
+
+class JSONStreamTest(unittest.TestCase):
+    def test_walk(self):
+        text = json.dumps(DOCUMENT, indent=1)
+        # Windows smaller than most values, which have to grow the window
+        for chunk_size in (1, 3, 7, 64, JSONStream.CHUNK_SIZE):
+            stream = JSONStream(io.StringIO(text), chunk_size=chunk_size)
+            self.assertEqual(walk(stream), DOCUMENT, chunk_size)
+            self.assertEqual(stream.peek(), "")
+
+    def test_number_at_window_end(self):
+        # The number goes on past the first window
+        stream = JSONStream(io.StringIO('{"n": 1234567890}'), chunk_size=8)
+        self.assertEqual(walk(stream), {"n": 1234567890})
+
+    def test_value_with_decoder(self):
+        decoder = json.JSONDecoder(object_hook=lambda d: sorted(d))
+        stream = JSONStream(io.StringIO('{"a": {"y": 1, "x": 2}}'), chunk_size=4)
+        self.assertEqual([(key, stream.value(decoder)) for key in stream.keys()], [("a", ["x", "y"])])
+
+    def test_malformed(self):
+        stream = JSONStream(io.StringIO('{"a": 1 "b": 2}'), chunk_size=4)
+        with self.assertRaises(ValueError):
+            walk(stream)
+        stream = JSONStream(io.StringIO('{"a": [1, 2'), chunk_size=4)
+        with self.assertRaises(ValueError):
+            walk(stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
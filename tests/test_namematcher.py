@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from namematcher import NameMatcher, trie_pattern  # noqa: E402
+
+
+class TriePatternTest(unittest.TestCase):
+    def test_matches_every_word(self):
+        words = ["velasco", "velascobot", "vel", "other", "@velascobot"]
+        pattern = re.compile(trie_pattern(words))
+        for word in words:
+            self.assertEqual(pattern.fullmatch(word).group(), word)
+        self.assertIsNone(pattern.fullmatch("velas"))
+        # The longest name is matched
+        self.assertEqual(pattern.match("velascobot!").group(), "velascobot")
+
+
+class NameMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = NameMatcher("@Velascobot", ["velasco", "Vel", ""])
+
+    def test_mentions(self):
+        self.assertEqual(self.matcher.match("hey @VELASCOBOT how are you doing today"), (True, False))
+        self.assertEqual(self.matcher.match("what does velasco think about this"), (True, False))
+        self.assertEqual(self.matcher.match("nothing to see here"), (False, False))
+        self.assertEqual(self.matcher.match(None), (False, False))
+        self.assertEqual(self.matcher.match(""), (False, False))
+
+    def test_other_users_username(self):
+        # A nickname that is another user's username is not a mention
+        self.assertEqual(self.matcher.match("ask @velasco about it later on today"), (False, False))
+        self.assertEqual(self.matcher.match("ask @velasco and velasco about it later"), (True, False))
+        self.assertEqual(self.matcher.match("@velasco in here"), (False, True))
+
+    def test_summons(self):
+        self.assertEqual(self.matcher.match("velasco"), (True, True))
+        self.assertEqual(self.matcher.match("hey vel, talk"), (True, True))
+        self.assertEqual(self.matcher.match("hey vel, talk to me"), (True, False))
+        self.assertTrue(self.matcher.is_summon("VELASCO!"))
+        self.assertFalse(self.matcher.is_summon("hello"))
+
+    def test_strip(self):
+        self.assertEqual(self.matcher.strip("Hi Velasco, hi @VelascoBot"), "Hi , hi ")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import speakbudget  # noqa: E402
+from speakbudget import SpeakBudget  # noqa: E402
+
+
+class SpeakBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(speakbudget.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_limit(self):
+        budget = SpeakBudget(0)
+        budget.charge("a", 100)
+        self.assertTrue(budget.allow("a"))
+        self.assertEqual(budget.usage(), [("a", {"spent": 100, "sent": 1, "deferred": 0,
+                                                 "dropped": 0, "tokens": 0})])
+
+    def test_spend_and_refill(self):
+        budget = SpeakBudget(1.0, period=10)
+        self.assertTrue(budget.allow("a"))
+        budget.charge("a", 0.6)
+        self.assertTrue(budget.allow("a"))
+        budget.charge("a", 0.6)
+        self.assertFalse(budget.allow("a"))
+        # Other chats keep their own budget
+        self.assertTrue(budget.allow("b"))
+        # 0.1s earned per second
+        self.now += 1
+        self.assertFalse(budget.allow("a"))
+        self.now += 2
+        self.assertTrue(budget.allow("a"))
+        # Saved up to the budget
+        self.now += 1000
+        self.assertAlmostEqual(dict(budget.usage())["a"]["tokens"], 1.0)
+
+    def test_debt_is_capped(self):
+        budget = SpeakBudget(1.0, period=10)
+        budget.charge("a", 50)
+        self.assertAlmostEqual(dict(budget.usage())["a"]["tokens"], -1.0)
+        self.now += 20
+        self.assertTrue(budget.allow("a"))
+
+    def test_usage_and_counts(self):
+        budget = SpeakBudget(1.0, period=10)
+        budget.charge("a", 0.1)
+        budget.charge("b", 0.5, sent=2)
+        budget.defer("a")
+        budget.drop("b")
+        usage = budget.usage()
+        self.assertEqual([cid for cid, chat in usage], ["b", "a"])
+        self.assertEqual(budget.usage(top=1)[0][1]["sent"], 2)
+        self.assertEqual(dict(usage)["a"]["deferred"], 1)
+        self.assertEqual(dict(usage)["b"]["dropped"], 1)
+
+    def test_prune(self):
+        budget = SpeakBudget(1.0, period=10)
+        budget.charge("a", 0.5)
+        budget.charge("b", 0.5)
+        # Both were charged since the last prune
+        self.assertEqual(budget.prune(), 0)
+        budget.charge("b", 0.5)
+        self.now += 100
+        # "a" wasn't charged since, and its bucket is full again
+        self.assertEqual(budget.prune(), 1)
+        self.assertEqual(len(budget), 1)
+        self.assertEqual(budget.prune(), 1)
+        self.assertEqual(len(budget), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
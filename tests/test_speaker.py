@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import datetime
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, Update  # noqa: E402
+
+from archivist import Archivist  # noqa: E402
+from speaker import Speaker  # noqa: E402
+
+
+class StubBot(object):
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FailedLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="velasco_test_")
+        self.logger = logging.getLogger("test_speaker")
+        self.logger.setLevel(logging.CRITICAL)
+        self.archivist = Archivist(self.logger, self.root, ".json", min_period=1, max_period=100000)
+        self.speaker = Speaker("@test_bot", self.archivist, self.logger, memory=4, reply=0, repeat=0)
+        self.chat = Chat(-1001, "group", title="Broken")
+        # A card the bot can read, and a vocabulary it can't
+        folder = self.archivist.chat_folder(tag=str(self.chat.id))
+        os.makedirs(folder)
+        with open(self.archivist.chat_file(tag=str(self.chat.id), file="card", ext=".txt"), 'w') as file:
+            file.write("CARD=v5\nCHAT_ID=-1001\nCHAT_TYPE=group\nCHAT_NAME=Broken\nWORD_COUNT=3\n"
+                       "MESSAGE_FREQ=10\nANSWER_FREQ=0.5\nRESTRICTED=False\nSILENCED=False\n")
+        with open(self.archivist.chat_file(tag=str(self.chat.id), file="record", ext=".json"), 'w',
+                  encoding="utf-16") as file:
+            file.write('{"VERSION": 3, "ORDER": 2, "CHAIN": {"^')
+
+    def tearDown(self):
+        self.speaker.io_executor.shutdown(wait=True)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    # Handles the updates in the queue like the dispatcher does, until it's
+    # empty for a while. Returns the amount of updates handled
+    def dispatch(self, update_queue, limit=1000):
+        context = SimpleNamespace(bot=StubBot(), update_queue=update_queue)
+        handled = 0
+        while handled < limit:
+            try:
+                update = update_queue.get(timeout=2)
+            except queue.Empty:
+                break
+            self.speaker.read(update, context)
+            self.speaker.flush_batches(update, context)
+            handled += 1
+        return handled
+
+    def test_failed_load_drops_messages(self):
+        update_queue = queue.Queue()
+        date = datetime.datetime.now()
+        for uid in range(3):
+            update_queue.put(Update(uid, message=Message(uid, date, self.chat, text="hello there")))
+        handled = self.dispatch(update_queue)
+        # Each message is handled once when it arrives and once after the
+        # failed load, instead of going back into the queue over and over
+        self.assertLessEqual(handled, 6)
+        self.assertTrue(update_queue.empty())
+        cid = str(self.chat.id)
+        self.assertFalse(self.speaker.is_cached(cid))
+        self.assertNotIn(cid, self.speaker.waiting)
+        self.assertNotIn(cid, self.speaker.loading)
+        self.assertEqual(len(self.speaker.batches), 0)
+
+
+class EvictionTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="velasco_test_")
+        self.logger = logging.getLogger("test_speaker")
+        self.logger.setLevel(logging.CRITICAL)
+        self.archivist = Archivist(self.logger, self.root, ".json", min_period=1, max_period=100000)
+        self.speaker = Speaker("@test_bot", self.archivist, self.logger, memory=4, reply=0, repeat=0)
+
+    def tearDown(self):
+        self.speaker.io_executor.shutdown(wait=True)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_store_waits_for_reader_in_use(self):
+        chat = Chat(-1002, "group", title="Busy")
+        cid = str(chat.id)
+        with self.speaker.use_reader(chat) as reader:
+            reader.set_period(7)
+            # Pushed out of memory, as by a load in the I/O threads
+            with self.speaker.memory_lock:
+                self.speaker.memory.remove(reader)
+            self.speaker.evict([reader])
+            future = self.speaker.storing[cid]
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                future.result(timeout=0.5)
+            self.assertIsNone(self.archivist.get_reader(cid))
+        future.result(timeout=10)
+        stored = self.archivist.get_reader(cid)
+        self.assertIsNotNone(stored)
+        self.assertEqual(stored.period(), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+import time
+
+# Thread -> trace being recorded on it (see trace)
+_local = threading.local()
+# The Tracer in use, if any (see Tracer.install)
+_tracer = None
+
+
+# This writes the traces (see trace) that took `threshold` seconds or more as
+# JSON lines into a file, one per trace, with the time spent in each of their
+# stages (see span) and the chat and sizes involved (see note)
+class Tracer(object):
+    def __init__(self, path, threshold):
+        self.path = path
+        # Minimum total time (in s) of a trace for it to be written
+        self.threshold = threshold
+        # Amount of traces recorded and written
+        self.traced = 0
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1}, {2} of {3} written>".format(self.__class__.__name__, self.path,
+                                                      self.written, self.traced)
+
+    # Starts tracing (there's only one Tracer in use per process)
+    def install(self):
+        global _tracer
+        _tracer = self
+
+    # Stops tracing. Traces already started are still reported
+    def uninstall(self):
+        global _tracer
+        if _tracer is self:
+            _tracer = None
+
+    # Called once a trace is over (by any thread), writes it if it's slow enough
+    def report(self, trace, total):
+        if total < self.threshold:
+            with self._lock:
+                self.traced += 1
+            return
+        record = {"time": round(time.time(), 3), "kind": trace.kind, "total_ms": round(total * 1000, 3),
+                  "stages": {name: round(elapsed * 1000, 3) for name, elapsed in trace.stages.items()}}
+        for key, value in trace.fields.items():
+            # Sizes that are costly to measure are only measured now
+            record[key] = value() if callable(value) else value
+        if trace.error is not None:
+            record["error"] = trace.error
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self.traced += 1
+            with open(self.path, 'a') as file:
+                file.write(line)
+            self.written += 1
+
+
+# A no-op trace or span, used when nothing is being traced
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+# The timings of a unit of work done by one thread, like an update
+class Trace(object):
+    __slots__ = ("tracer", "kind", "fields", "stages", "error", "start")
+
+    def __init__(self, tracer, kind, fields):
+        self.tracer = tracer
+        self.kind = kind
+        self.fields = fields
+        # Stage name -> total time (in s) spent in it
+        self.stages = {}
+        self.error = None
+        self.start = None
+
+    def __enter__(self):
+        _local.trace = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total = time.perf_counter() - self.start
+        _local.trace = None
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer.report(self, total)
+        return False
+
+
+# The time spent in a stage of a trace. A stage entered more than once adds up
+# its times, and stages within stages count towards both
+class Span(object):
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stages = self.trace.stages
+        stages[self.name] = stages.get(self.name, 0.0) + elapsed
+        return False
+
+
+# Returns a context manager that traces what this thread does inside it, with
+# the given fields (like the chat ID) written along. Inside another trace, or
+# when no Tracer is in use, it does nothing
+def trace(kind, **fields):
+    if _tracer is None or getattr(_local, "trace", None) is not None:
+        return NULL_SPAN
+    return Trace(_tracer, kind, fields)
+
+
+# Returns a context manager that times a stage of the trace of this thread, if
+# there's one (and does nothing otherwise)
+def span(name):
+    current = getattr(_local, "trace", None)
+    if current is None:
+        return NULL_SPAN
+    return Span(current, name)
+
+
+# Adds fields to the trace of this thread, if there's one. A field can be a
+# function, only called if the trace is written
+def note(**fields):
+    current = getattr(_local, "trace", None)
+    if current is not None:
+        current.fields.update(fields)
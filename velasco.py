@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+from telegram import Update
+from telegram.ext import Updater, CommandHandler, MessageHandler, ChatMemberHandler, TypeHandler, Filters
 from telegram.error import NetworkError
 from archivist import Archivist
+from gcmonitor import GCMonitor
+import logqueue
+from tracing import Tracer
+from memorylist import SharedBudget
+from ratelimiter import RateLimiter
 from speaker import Speaker
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import atexit
+import json
 import logging
 import os
 import sys
+import tarfile
+import threading
+import warnings
 
 coloredlogsError = None
 try:
@@ -15,12 +27,16 @@ except ImportError as e:
     coloredlogsError = e
 
 username = "Welaskobot"
-speakerbot = None
+speakerbots = []
+# Garbage collector pause monitor, shared by all the bots in the process
+gc_monitor = GCMonitor()
 
 logger = logging.getLogger(__name__)
 
 # Enable logging
 log_format = "[{}][%(asctime)s]%(name)s::%(levelname)s: %(message)s".format(username.upper())
+# Which shows nothing about where each line was logged from
+logqueue.skip_record_details()
 
 if coloredlogsError:
     logging.basicConfig(format=log_format, level=logging.INFO)
@@ -63,9 +79,7 @@ def error(update, context):
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
 
-def main():
-    global speakerbot
-    
+def build_parser():
     parser = argparse.ArgumentParser(description='A Telegram markov bot.')
     parser.add_argument('token', metavar='TOKEN', nargs='?',
                         help='The Bot Token to work with the Telegram Bot API')
@@ -79,59 +93,89 @@ def main():
                         help='Any possible nicknames that the bot could answer to.')
     parser.add_argument('-d', '--directory', metavar='CHATLOG_DIR', default='./chatlogs',
                         help='The chat logs directory path (default: "./chatlogs").')
-    parser.add_argument('-c', '--capacity', metavar='C', type=int, default=20,
-                        help='The memory capacity for the last C updated chats. (default: 20).')
+    parser.add_argument('-c', '--capacity', metavar='C', type=int, default=0,
+                        help='The memory capacity for the last C updated chats, 0 for no limit. (default: 0).')
+    parser.add_argument('-b', '--memory_budget', metavar='MIB', type=int, default=256,
+                        help='The estimated memory (in MiB) for the last updated chats, 0 for no limit. (default: 256).')
     parser.add_argument('-m', '--mute_time', metavar='T', type=int, default=60,
                         help='The time (in s) for the muting period when Telegram limits the bot. (default: 60).')
     parser.add_argument('-s', '--save_time', metavar='T', type=int, default=3600,
                         help='The time (in s) for periodic saves. (default: 3600)')
+    parser.add_argument('-F', '--freeze_time', metavar='T', type=int, default=600,
+                        help='The time (in s) without messages after which a chat in memory is packed into a compact form, 0 for never. (default: 600)')
+    parser.add_argument('-C', '--cold_after', metavar='DAYS', type=float, default=0,
+                        help='The days without messages after which a chat is moved into the compressed cold archive, 0 for never. (default: 0)')
     parser.add_argument('-p', '--min_period', metavar='MIN_P', type=int, default=1,
                         help='The minimum value for a chat\'s period. (default: 1)')
     parser.add_argument('-P', '--max_period', metavar='MAX_P', type=int, default=100000,
                         help='The maximum value for a chat\'s period. (default: 100000)')
-
-    args = parser.parse_args()
-
-    # Usar variáveis de ambiente se argumentos não forem fornecidos
-    if not args.token:
-        args.token = os.getenv('BOT_TOKEN')
-    if not args.admin_id:
-        args.admin_id = int(os.getenv('ADMIN_ID', 0))
-    
-    if not args.token:
-        logger.error("Token não fornecido! Use argumentos ou defina BOT_TOKEN como variável de ambiente.")
-        return
-    
-    if not args.admin_id:
-        logger.error("Admin ID não fornecido! Use argumentos ou defina ADMIN_ID como variável de ambiente.")
-        return
-
-    # Criar diretório se não existir
-    if not os.path.exists(args.directory):
-        os.makedirs(args.directory)
-        logger.info(f"Created directory: {args.directory}")
-
-    assert args.max_period >= args.min_period
-
-    # Create the Updater and pass it your bot's token.
-    updater = Updater(args.token, use_context=True)
-
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
-
-    filter_cids = args.filter
-    if filter_cids:
-        filter_cids = [int(cid) for cid in filter_cids]
-        logger.info("Filter whitelist: {}".format(filter_cids))
-
-    archivist = Archivist(logger, args.directory, ".json", args.admin_id,
-                         read_only=False)
-
-    speakerbot = Speaker("@" + username, archivist, logger, args.admin_id, args.nicknames,
-                        reply=0.1, repeat=0.05, wakeup=args.wakeup,
-                        memory=args.capacity, mute_time=args.mute_time,
-                        save_time=args.save_time, cid_whitelist=filter_cids)
-
+    parser.add_argument('-o', '--order', metavar='N', type=int, default=2, choices=range(1, 5),
+                        help='The number of previous words used to pick the next one, from 1 to 4. (default: 2)')
+    parser.add_argument('-u', '--api_url', metavar='URL', default=None,
+                        help='The Bot API base URL, the token is appended to it (default: Telegram\'s).')
+    parser.add_argument('-a', '--admin_ttl', metavar='T', type=int, default=600,
+                        help='The time (in s) that a chat\'s cached administrators list is valid. (default: 600)')
+    parser.add_argument('-U', '--username', metavar='NAME', default=username,
+                        help='The bot\'s username, without "@". (default: "{}")'.format(username))
+    parser.add_argument('--config', metavar='FILE', default=None,
+                        help='A JSON file listing several bots to run in this same process (see MANUAL.md).')
+    parser.add_argument('--export', metavar='FILE', default=None,
+                        help='Export the chat logs directory into a snapshot file and exit, instead of running the bot.')
+    parser.add_argument('--export_chats', nargs='*', default=None, metavar='cid',
+                        help='Only export these chat IDs into the snapshot (default is all of them).')
+    parser.add_argument('--restore', metavar='FILE', default=None,
+                        help='Restore a snapshot file into the chat logs directory in the background while the bot starts. Chats already there are kept.')
+    parser.add_argument('-I', '--io_workers', metavar='N', type=int, default=4,
+                        help='The number of threads loading chats from files and storing the ones pushed out of memory. With --config, the shared workers do it instead. (default: 4)')
+    parser.add_argument('--batch_size', metavar='N', type=int, default=32,
+                        help='The maximum number of messages from a chat read in a single pass during bursts, 1 to read them one by one. (default: 32)')
+    parser.add_argument('--batch_window', metavar='T', type=float, default=0.25,
+                        help='The maximum time (in s) that a message waits to be read during bursts. (default: 0.25)')
+    parser.add_argument('-L', '--log_rate', metavar='N', type=int, default=20,
+                        help='The maximum number of routine log lines of each kind per second, like the ones for every message sent (0 for no limit). Warnings and errors are never left out. (default: 20)')
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help='Write the updates that took too long to handle into this file, one JSON line each, with the time spent in each stage.')
+    parser.add_argument('--trace_threshold', metavar='MS', type=float, default=500,
+                        help='The time (in ms) from which an update is written into the --trace file. (default: 500)')
+    parser.add_argument('-R', '--seed_replies', metavar='P', type=float, default=0.5,
+                        help='The chance that a reply starts from a word of the message it answers, when the bot knows any. (default: 0.5)')
+    parser.add_argument('-B', '--chat_budget', metavar='S', type=float, default=3,
+                        help='The time (in s) per minute that each chat can take generating and sending messages. Periodic messages over it are put off, mentions and /speak are not (0 for no limit). (default: 3)')
+    parser.add_argument('-G', '--gc_freeze', action='store_true',
+                        help='Freeze the loaded vocabularies out of the garbage collector, to avoid long pauses.')
+    parser.add_argument('--restore_workers', metavar='N', type=int, default=8,
+                        help='The number of threads writing the restored chats. (default: 8)')
+
+    return parser
+
+
+# Reads the multi-bot config file. Returns the settings shared by all bots, and
+# each bot's settings: the command line ones, overriden by the bot's entry
+def load_config(args):
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    shared = {
+        "workers": config.get("workers", 8),
+        "send_rate": config.get("send_rate", 25),
+        "memory_budget": config.get("memory_budget", args.memory_budget),
+    }
+    bots = []
+    for entry in config.get("bots", []):
+        unknown = set(entry) - set(vars(args))
+        if unknown:
+            raise ValueError("Unknown bot settings in {}: {}".format(args.config, ", ".join(sorted(unknown))))
+        bots.append(argparse.Namespace(**{**vars(args), **entry, "config": None}))
+
+    directories = [os.path.abspath(bot.directory) for bot in bots]
+    if len(set(directories)) != len(directories):
+        raise ValueError("Each bot in {} needs its own chat logs directory.".format(args.config))
+    usernames = [bot.username for bot in bots]
+    if len(set(usernames)) != len(usernames):
+        raise ValueError("Each bot in {} needs its own username.".format(args.config))
+    return shared, bots
+
+
+def add_handlers(dp, speakerbot):
     # on different commands - answer in Telegram
     dp.add_handler(CommandHandler("start", static_reply(start_msg)))
     dp.add_handler(CommandHandler("help", static_reply(help_msg)))
@@ -141,6 +185,8 @@ def main():
     dp.add_handler(CommandHandler("speak", speakerbot.speak))
     dp.add_handler(CommandHandler("count", speakerbot.get_count))
     dp.add_handler(CommandHandler("get_chats", speakerbot.get_chats))
+    dp.add_handler(CommandHandler("stats", speakerbot.get_stats))
+    dp.add_handler(CommandHandler("announce", speakerbot.announce_command))
     dp.add_handler(CommandHandler("period", speakerbot.period))
     dp.add_handler(CommandHandler("answer", speakerbot.answer))
     dp.add_handler(CommandHandler("restrict", speakerbot.restrict))
@@ -154,21 +200,185 @@ def main():
     dp.add_handler(MessageHandler(Filters.animation, speakerbot.read))
     dp.add_handler(MessageHandler(Filters.video, speakerbot.read))
 
+    # on chat member changes - forget the chat's cached administrators
+    dp.add_handler(ChatMemberHandler(speakerbot.member_update, ChatMemberHandler.ANY_CHAT_MEMBER))
+
+    # after every update - read the messages gathered by chat, when it's time
+    dp.add_handler(TypeHandler(Update, speakerbot.flush_batches), group=1)
+
     # log all errors
     dp.add_error_handler(error)
 
-    # Start the Bot
-    logger.info("Starting bot...")
-    
+
+# Creates a bot's Updater and Speaker. `shared` holds the thread pool, outbound
+# rate limiter, memory budget and memory lock shared by all the bots in the
+# process, or is None when running a single bot
+def create_bot(args, shared=None):
+    bot_logger = logger if shared is None else logger.getChild(args.username)
+
+    # Criar diretório se não existir
+    if not os.path.exists(args.directory):
+        os.makedirs(args.directory)
+        bot_logger.info(f"Created directory: {args.directory}")
+
+    assert args.max_period >= args.min_period
+
+    # Create the Updater and pass it your bot's token.
+    if shared is None:
+        updater = Updater(args.token, base_url=args.api_url, use_context=True)
+    else:
+        # No handler runs asynchronously, and background work goes to the shared
+        # pool, so the Updater doesn't need its own pool of worker threads
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="Asynchronous callbacks")
+            updater = Updater(args.token, base_url=args.api_url, workers=0, use_context=True)
+
+    filter_cids = args.filter
+    if filter_cids:
+        filter_cids = [int(cid) for cid in filter_cids]
+        bot_logger.info("Filter whitelist: {}".format(filter_cids))
+
+    archivist = Archivist(bot_logger, args.directory, ".json", args.admin_id,
+                         read_only=False, order=args.order)
+
+    # Restored in the background: the chats that were hot come first, and loading
+    # a chat that isn't restored yet waits for it
+    if args.restore:
+        try:
+            archivist.start_restore(args.restore, args.restore_workers)
+        except (OSError, ValueError, tarfile.TarError) as e:
+            bot_logger.error("Could not restore the snapshot {}: {}".format(args.restore, e))
+            return None, None
+
+    shared = shared or {}
+    speakerbot = Speaker("@" + args.username, archivist, bot_logger, args.admin_id, args.nicknames,
+                        reply=0.1, repeat=0.05, wakeup=args.wakeup,
+                        memory=args.capacity, memory_budget=args.memory_budget * 2 ** 20,
+                        mute_time=args.mute_time,
+                        save_time=args.save_time, cid_whitelist=filter_cids,
+                        admin_ttl=args.admin_ttl, cold_after=args.cold_after * 86400,
+                        freeze_time=args.freeze_time,
+                        executor=shared.get("executor"), send_limiter=shared.get("limiter"),
+                        shared_budget=shared.get("budget"), memory_lock=shared.get("lock"),
+                        gc_monitor=gc_monitor, gc_freeze=args.gc_freeze, io_workers=args.io_workers,
+                        batch_size=args.batch_size, batch_window=args.batch_window,
+                        seed_replies=args.seed_replies, speak_budget=args.chat_budget)
+
+    add_handlers(updater.dispatcher, speakerbot)
+    return updater, speakerbot
+
+
+# Sends the wake up messages, starts polling, and starts the background work
+def start_bot(args, updater, speakerbot):
     # Corrigir o wake - passar uma mensagem de texto
     if args.wakeup:
         speakerbot.wake(updater.bot, "Good morning. I just woke up")
     else:
         speakerbot.wake(updater.bot, None)
+
+    speakerbot.logger.info("Starting bot polling...")
+    # chat_member updates are only sent by Telegram if explicitly requested
+    updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    # Preload the chats that were active before the last stop, while already polling
+    speakerbot.warm_up()
+    # Resume any announcement that was interrupted by the last stop
+    speakerbot.resume_announcement(updater.bot)
+
+
+def main():
+    args = build_parser().parse_args()
+
+    # From now on, log lines are written by a background thread
+    log_listener = logqueue.install(rate=args.log_rate)
+    atexit.register(log_listener.stop)
+    if args.trace:
+        Tracer(args.trace, args.trace_threshold / 1000).install()
+
+    if args.export:
+        archivist = Archivist(logger, args.directory, ".json", read_only=True, order=args.order)
+        try:
+            archivist.export_snapshot(args.export, args.export_chats)
+        except OSError as e:
+            logger.error("Could not export the snapshot {}: {}".format(args.export, e))
+        return
+
+    gc_monitor.install()
+
+    if args.config:
+        try:
+            shared_config, bots = load_config(args)
+        except (OSError, ValueError) as e:
+            logger.error("Could not read the config file {}: {}".format(args.config, e))
+            return
+        if len(bots) == 0:
+            logger.error("No bots listed in the config file {}.".format(args.config))
+            return
+        for bot in bots:
+            if not bot.token or not bot.admin_id:
+                logger.error("Token or admin ID missing for bot {} in {}.".format(bot.username, args.config))
+                return
+        run_bots(bots, shared_config)
+        return
+
+    # Usar variáveis de ambiente se argumentos não forem fornecidos
+    if not args.token:
+        args.token = os.getenv('BOT_TOKEN')
+    if not args.admin_id:
+        args.admin_id = int(os.getenv('ADMIN_ID', 0))
     
-    logger.info("Starting bot polling...")
-    updater.start_polling()
+    if not args.token:
+        logger.error("Token não fornecido! Use argumentos ou defina BOT_TOKEN como variável de ambiente.")
+        return
+    
+    if not args.admin_id:
+        logger.error("Admin ID não fornecido! Use argumentos ou defina ADMIN_ID como variável de ambiente.")
+        return
+
+    updater, speakerbot = create_bot(args)
+    if speakerbot is None:
+        return
+    speakerbots.append(speakerbot)
+
+    # Start the Bot
+    logger.info("Starting bot...")
+    start_bot(args, updater, speakerbot)
     updater.idle()
+    speakerbot.shutdown()
+
+
+# Runs several bots in this process. Each one keeps its own Updater (polling
+# and dispatching its own updates) and its own chat logs directory, but they
+# share a thread pool for background work, an outbound rate limiter, a memory
+# budget, and the lock that guards it
+def run_bots(bots, config):
+    shared = {
+        "executor": ThreadPoolExecutor(max_workers=config["workers"], thread_name_prefix="shared"),
+        "limiter": RateLimiter(config["send_rate"]),
+        "budget": SharedBudget(config["memory_budget"] * 2 ** 20),
+        "lock": threading.RLock(),
+    }
+    logger.info("Starting {} bots: {} (shared: {} workers, {} msg/s, {} MiB)...".format(
+        len(bots), ", ".join(bot.username for bot in bots),
+        config["workers"], config["send_rate"], config["memory_budget"]))
+
+    updaters = []
+    for bot in bots:
+        updater, speakerbot = create_bot(bot, shared)
+        if speakerbot is None:
+            shared["executor"].shutdown(wait=False)
+            return
+        updaters.append(updater)
+        speakerbots.append(speakerbot)
+    for bot, updater, speakerbot in zip(bots, updaters, speakerbots):
+        start_bot(bot, updater, speakerbot)
+
+    # The first Updater handles the stop signals, then the rest are stopped
+    updaters[0].idle()
+    for updater in updaters[1:]:
+        updater.stop()
+    for speakerbot in speakerbots:
+        speakerbot.shutdown()
+    shared["executor"].shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == '__main__':